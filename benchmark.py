@@ -0,0 +1,893 @@
+"""
+Headless benchmark for Spotify Mini Carthing.
+
+Runs SpotifyApp offscreen against a local fake Spotify Web API that replays a
+scripted session, then prints the results as JSON:
+
+    python benchmark.py --session churn --duration 60 --output churn.json
+
+The fake server runs in a child process, so its CPU time is not counted
+against the app. With --source mpris it also plays the Spotify desktop
+client on a private D-Bus session bus, which the app then follows instead
+of polling. Use --list to see the available sessions.
+"""
+import os
+import sys
+import json
+import time
+import zlib
+import socket
+import contextlib
+import argparse
+import tempfile
+import threading
+import subprocess
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+from urllib.request import urlopen
+
+# Scripted sessions: track length and (seconds after login, event, argument) entries.
+# Server events: skip, pause, resume, rate_limit (seconds of 429s), outage (seconds
+# of 503s), slow ((extra ms per response, seconds)). press events tap a button in
+# the app, the argument being the SpotifyApp slot to call (showMinimized and
+# showNormal hide and re-show the window). scroll events scroll through the
+# recently played list for the given number of seconds, timing every frame. type
+# events type into the command palette one key at a time, a trailing newline
+# pressing Enter.
+sessions = {
+    'steady': {
+        'track_ms': 30000,
+        'events': [],
+    },
+    'churn': {
+        'track_ms': 10000,
+        'events': [(4, 'skip', None), (6, 'skip', None), (15, 'skip', None), (25, 'skip', None),
+                   (35, 'press', 'next_track'), (35.2, 'press', 'next_track'), (45, 'press', 'previous_track')],
+    },
+    'pauses': {
+        'track_ms': 45000,
+        'events': [(5, 'pause', None), (12, 'resume', None), (20, 'pause', None), (21, 'resume', None),
+                   (30, 'press', 'toggle_play_pause'), (34, 'press', 'toggle_play_pause'),
+                   (40, 'pause', None), (50, 'resume', None)],
+    },
+    'rate-limited': {
+        'track_ms': 15000,
+        'events': [(8, 'rate_limit', 10), (30, 'rate_limit', 30)],
+    },
+    'outage': {
+        'track_ms': 15000,
+        'events': [(10, 'outage', 12), (40, 'outage', 5)],
+    },
+    'slow': {
+        'track_ms': 15000,
+        'events': [(5, 'slow', (1500, 30))],
+    },
+    'mixed': {
+        'track_ms': 12000,
+        'events': [(3, 'skip', None), (8, 'press', 'like_unlike_track'), (10, 'pause', None),
+                   (14, 'resume', None), (18, 'rate_limit', 8), (30, 'slow', (800, 10)),
+                   (33, 'press', 'toggle_shuffle'), (42, 'outage', 6), (52, 'skip', None)],
+    },
+    'track-list': {
+        'track_ms': 15000,
+        'events': [(2, 'press', 'toggle_track_list'), (3, 'scroll', 20), (12, 'skip', None), (30, 'scroll', 10)],
+    },
+    'background': {
+        'track_ms': 20000,
+        'events': [(5, 'press', 'showMinimized'), (15, 'skip', None), (45, 'press', 'showNormal'),
+                   (50, 'skip', None)],
+    },
+    'library': {
+        'track_ms': 20000,
+        # The library sync is paced by the request budget; this one lets 5000 tracks sync before the searches
+        'hourly_budget': 60000,
+        'events': [(35, 'press', 'toggle_command_palette'), (36, 'type', 'track 2004'), (40, 'type', 'artist 3 al'),
+                   (44, 'type', 'xyz'), (46, 'type', 'album 1001\n'), (50, 'press', 'toggle_command_palette'),
+                   (51, 'type', 'mix 4\n')],
+    },
+}
+
+
+# *** Fake Spotify Web API ***
+
+class FakePlayer:
+    """
+    Simulated Spotify player that advances in real time and replays a session script.
+    """
+    image_size = 640
+    history_size = 400  # Tracks played before the session, for the recently played list
+    library_sizes = {'tracks': 5000, 'albums': 400, 'playlists': 60}  # Saved items, for the library sync
+
+    def __init__(self, session, base_url):
+        self.track_ms = session['track_ms']
+        self.script = sorted(event for event in session['events'] if event[1] not in ('press', 'scroll'))
+        self.base_url = base_url
+        self.lock = threading.Lock()
+        self.started = None  # Set by the first request, the script runs from there
+        self.cursor = 0
+        self.index = 0
+        self.position_ms = 0
+        self.anchor = None
+        self.is_playing = True
+        self.shuffle_state = False
+        self.liked = set()
+        self.faults = []  # (kind, until, value)
+        self.events = []  # State changes with the monotonic time they happened
+        self.listeners = []  # Called with the kind of every change, with the lock held
+        self.requests = Counter()
+        self.dbus_calls = Counter()
+        self.statuses = Counter()
+        self.images = {}
+        now_ms = int(time.time() * 1000)
+        self.history = [(now_ms - (self.history_size - offset) * self.track_ms, 100000 + offset)
+                        for offset in range(self.history_size)]  # (played at in ms, track index), oldest first
+
+    def track(self, index):
+        album = index // 2  # Two tracks per album so the app sees repeat art
+        return {
+            'id': f"{index:022d}",
+            'uri': f"spotify:track:{index:022d}",
+            'type': 'track',
+            'name': f"Track {index}",
+            'is_local': False,
+            'duration_ms': self.track_ms,
+            'artists': [{'name': f"Artist {album % 7}"}],
+            'album': self.album(album),
+        }
+
+    def album(self, album):
+        image_id = f"{album:040x}"
+        return {
+            'id': f"{album:022d}",
+            'uri': f"spotify:album:{album:022d}",
+            'name': f"Album {album}",
+            'artists': [{'name': f"Artist {album % 7}"}],
+            'images': [{'url': f"{self.base_url}/image/{image_id}", 'width': 640, 'height': 640},
+                       {'url': f"{self.base_url}/image/{image_id}s", 'width': 300, 'height': 300},
+                       {'url': f"{self.base_url}/image/{image_id}t", 'width': 64, 'height': 64}],
+        }
+
+    def saved(self, kind, limit, offset):
+        """
+        Return a page of saved tracks, albums or playlists, newest first like the real API.
+        """
+        total = self.library_sizes[kind]
+        items = []
+        for position in range(offset, min(offset + limit, total)):
+            added_at = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(1.7e9 - position * 3600))
+            if kind == 'tracks':
+                items.append({'added_at': added_at, 'track': self.track(200000 + position)})
+            elif kind == 'albums':
+                items.append({'added_at': added_at, 'album': self.album(50000 + position)})
+            else:
+                items.append({'uri': f"spotify:playlist:{position:022d}", 'name': f"Mix {position}",
+                              'owner': {'display_name': 'Benchmark'},
+                              'images': self.album(position)['images'][:1]})
+        return {
+            'items': items,
+            'total': total,
+            'limit': limit,
+            'offset': offset,
+            'next': f"{self.base_url}/v1/me/{kind}?offset={offset + limit}" if offset + limit < total else None,
+        }
+
+    def advance(self, now):
+        """
+        Bring the player up to now, applying track ends and script events in order.
+        """
+        if self.started is None:
+            self.started = self.anchor = now
+            self.notify('start')
+        while True:
+            script_at, end_at = self.next_changes()
+            at = min(script_at, end_at)
+            if at > now:
+                break
+            self.settle(at)
+            if at == end_at:
+                self.change_track(1, at, 'end')
+            else:
+                self.apply(self.script[self.cursor], at)
+                self.cursor += 1
+        self.settle(now)
+
+    def next_changes(self):
+        """
+        Return the times of the next script event and of the current track's end.
+        """
+        script_at = (self.started + self.script[self.cursor][0]
+                     if self.cursor < len(self.script) else float('inf'))
+        end_at = (self.anchor + (self.track_ms - self.position_ms) / 1000
+                  if self.is_playing else float('inf'))
+        return script_at, end_at
+
+    def settle(self, at):
+        if self.is_playing:
+            self.position_ms = min(self.position_ms + (at - self.anchor) * 1000, self.track_ms)
+        self.anchor = at
+
+    def change_track(self, step, at, source):
+        played_at_ms = int((time.time() - (time.monotonic() - at)) * 1000)
+        self.history.append((played_at_ms, self.index))
+        self.index = max(self.index + step, 0)
+        self.position_ms = 0
+        self.anchor = at
+        self.log(at, 'track', source)
+
+    def set_playing(self, is_playing, at, source):
+        if is_playing != self.is_playing:
+            self.is_playing = is_playing
+            self.log(at, 'resume' if is_playing else 'pause', source)
+
+    def log(self, at, kind, source):
+        self.events.append({'at': at, 'kind': kind, 'source': source, 'track_name': f"Track {self.index}"})
+        self.notify(kind)
+
+    def notify(self, kind):
+        for listener in self.listeners:
+            listener(kind)
+
+    def apply(self, event, at):
+        _, kind, argument = event
+        if kind == 'skip':
+            self.change_track(1, at, 'script')
+        elif kind in ('pause', 'resume'):
+            self.set_playing(kind == 'resume', at, 'script')
+        elif kind == 'rate_limit':
+            self.faults.append(('rate_limit', at + argument, None))
+        elif kind == 'outage':
+            self.faults.append(('outage', at + argument, None))
+        elif kind == 'slow':
+            delay_ms, seconds = argument
+            self.faults.append(('slow', at + seconds, delay_ms))
+
+    def fault(self, now):
+        """
+        Return (status, Retry-After seconds, extra delay in seconds) for an API request at now.
+        """
+        status, retry_after, delay = 200, None, 0
+        for kind, until, value in self.faults:
+            if now >= until:
+                continue
+            if kind == 'rate_limit':
+                status, retry_after = 429, max(int(until - now + 0.999), 1)
+            elif kind == 'outage' and status == 200:
+                status = 503
+            elif kind == 'slow':
+                delay = max(delay, value / 1000)
+        return status, retry_after, delay
+
+    def playback(self):
+        return {
+            'item': self.track(self.index),
+            'progress_ms': int(self.position_ms),
+            'is_playing': self.is_playing,
+            'shuffle_state': self.shuffle_state,
+            'repeat_state': 'off',
+            'timestamp': int(time.time() * 1000),
+            'context': {'type': 'playlist', 'uri': f"spotify:playlist:{0:022d}"},
+            'currently_playing_type': 'track',
+            'device': {'id': 'benchmark', 'name': 'Benchmark', 'type': 'Computer', 'is_active': True},
+        }
+
+    def respond(self, method, path, query, now, body=None):
+        """
+        Handle one API request; returns (status, JSON body or None).
+        """
+        endpoint = f"{method} {path}"
+        # Newer spotipy versions use me/library with URIs instead of me/tracks with IDs
+        ids = [item.rsplit(':', 1)[-1] for key in ('ids', 'uris')
+               for value in query.get(key, []) for item in value.split(',')]
+        if endpoint == 'GET me':
+            return 200, {'id': 'benchmark', 'display_name': 'Benchmark'}
+        if endpoint in ('GET me/player', 'GET me/player/currently-playing'):
+            return 200, self.playback()
+        if endpoint == 'GET me/player/queue':
+            return 200, {'currently_playing': self.track(self.index),
+                         'queue': [self.track(self.index + offset) for offset in range(1, 11)]}
+        if endpoint == 'GET me/player/recently-played':
+            return 200, self.recently_played(int(query.get('limit', ['20'])[0]),
+                                             int(query['before'][0]) if 'before' in query else None)
+        if endpoint in ('GET me/tracks', 'GET me/albums', 'GET me/playlists'):
+            return 200, self.saved(path[len('me/'):], int(query.get('limit', ['20'])[0]),
+                                   int(query.get('offset', ['0'])[0]))
+        if endpoint in ('GET me/tracks/contains', 'GET me/library/contains'):
+            return 200, [track_id in self.liked for track_id in ids]
+        if endpoint in ('PUT me/tracks', 'PUT me/library'):
+            self.liked.update(ids)
+            return 200, None
+        if endpoint in ('DELETE me/tracks', 'DELETE me/library'):
+            self.liked.difference_update(ids)
+            return 200, None
+        if endpoint == 'PUT me/player/shuffle':
+            self.shuffle_state = query.get('state', ['false'])[0] == 'true'
+            self.notify('shuffle')
+            return 204, None
+        if endpoint == 'PUT me/player/play' and body:
+            # Play a track by its index, or an album or playlist from the first track or the offset's
+            uri = (body.get('uris') or [(body.get('offset') or {}).get('uri') or body.get('context_uri')])[0]
+            kind, item_id = uri.split(':')[1:]
+            self.index = int(item_id) * 2 if kind == 'album' else int(item_id)
+            self.position_ms = 0
+            self.anchor = now
+            self.is_playing = True
+            self.log(now, 'track', 'command')
+            return 204, None
+        if endpoint in ('PUT me/player/play', 'PUT me/player/pause'):
+            self.set_playing(path.endswith('play'), now, 'command')
+            return 204, None
+        if endpoint in ('POST me/player/next', 'POST me/player/previous'):
+            self.change_track(1 if path.endswith('next') else -1, now, 'command')
+            return 204, None
+        return 404, {'error': {'status': 404, 'message': 'Service not found'}}
+
+    def recently_played(self, limit, before):
+        older = [entry for entry in reversed(self.history) if before is None or entry[0] < before]
+        page = older[:limit]
+        return {
+            'items': [{'track': self.track(index),
+                       'played_at': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(played_at_ms / 1000))
+                                    + f".{played_at_ms % 1000:03d}Z"}
+                      for played_at_ms, index in page],
+            'cursors': {'after': str(page[0][0]), 'before': str(page[-1][0])} if page else None,
+            'next': f"{self.base_url}/v1/me/player/recently-played?before={page[-1][0]}" if len(older) > limit else None,
+            'limit': limit,
+        }
+
+    def image(self, image_id):
+        """
+        Return a JPEG for image_id, a two-color gradient seeded by the id.
+        """
+        from PyQt5.QtGui import QImage, QColor, QPainter, QLinearGradient
+        from PyQt5.QtCore import QBuffer, QByteArray, QIODevice
+
+        with self.lock:
+            if image_id in self.images:
+                return self.images[image_id]
+        seed = zlib.crc32(image_id.rstrip('st').encode())
+        size = {'s': 300, 't': 64}.get(image_id[-1], self.image_size)
+        image = QImage(size, size, QImage.Format_RGB32)
+        image.fill(QColor.fromHsv(seed % 360, 160, 200))
+        gradient = QLinearGradient(0, 0, size, size)
+        gradient.setColorAt(0, QColor.fromHsv(seed % 360, 200, 90))
+        gradient.setColorAt(1, QColor.fromHsv((seed // 360) % 360, 120, 230))
+        painter = QPainter(image)
+        painter.fillRect(0, size // 3, size, size, gradient)
+        painter.end()
+        data = QByteArray()
+        buffer = QBuffer(data)
+        buffer.open(QIODevice.WriteOnly)
+        image.save(buffer, 'JPEG', 85)
+        with self.lock:
+            self.images[image_id] = bytes(data)
+            return self.images[image_id]
+
+    def report(self):
+        return {'started_at': self.started, 'events': self.events, 'requests': dict(self.requests),
+                'dbus_calls': dict(self.dbus_calls), 'statuses': dict(self.statuses)}
+
+
+class FakeSpotifyHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep-alive, like the real API
+
+    def setup(self):
+        super().setup()
+        # Headers and body are written separately; without this, delayed ACKs add ~40 ms
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_PUT(self):
+        self.handle_request('PUT')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def do_DELETE(self):
+        self.handle_request('DELETE')
+
+    def handle_request(self, method):
+        player = self.server.player
+        url = urlsplit(self.path)
+        path = url.path.strip('/')
+        length = int(self.headers.get('Content-Length') or 0)
+        data = self.rfile.read(length) if length else b''
+
+        if path.startswith('image/'):
+            self.send_body(200, player.image(path[len('image/'):]), 'image/jpeg')
+            return
+        if path == 'bench/report':
+            with player.lock:
+                self.send_json(200, player.report())
+            return
+
+        path = path[len('v1/'):] if path.startswith('v1/') else path
+        now = time.monotonic()
+        with player.lock:
+            player.advance(now)
+            player.requests[f"{method} {path}"] += 1
+            status, retry_after, delay = player.fault(now)
+        if delay:
+            time.sleep(delay)
+        if status == 429:
+            self.send_json(429, {'error': {'status': 429, 'message': 'API rate limit exceeded'}},
+                           {'Retry-After': str(retry_after)})
+        elif status == 503:
+            self.send_json(503, {'error': {'status': 503, 'message': 'Service unavailable'}})
+        else:
+            with player.lock:
+                player.advance(time.monotonic())
+                status, body = player.respond(method, path, parse_qs(url.query), time.monotonic(),
+                                              json.loads(data) if data else None)
+            self.send_json(status, body)
+        with player.lock:
+            player.statuses[str(status)] += 1
+
+    def send_json(self, status, body, headers=None):
+        if body is None:
+            self.send_body(status, b'', None, headers)
+        else:
+            self.send_body(status, json.dumps(body).encode(), 'application/json', headers)
+
+    def send_body(self, status, data, content_type, headers=None):
+        self.send_response(status)
+        if content_type:
+            self.send_header('Content-Type', content_type)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# *** Fake MPRIS Player ***
+
+def publish_mpris(player, bus=None):
+    """
+    Expose player on the session bus, or on the QDBusConnection bus, like the
+    Spotify desktop client does, as org.mpris.MediaPlayer2.spotify, and
+    return the object to keep alive.
+
+    Track ends and script events are applied on a precise timer, so their
+    PropertiesChanged signals go out when they happen instead of on the
+    next API request. Needs a running Qt event loop.
+    """
+    from PyQt5.QtCore import QObject, QTimer, Qt, Q_CLASSINFO, pyqtSignal, pyqtSlot, pyqtProperty
+    from PyQt5.QtDBus import QDBusConnection, QDBusAbstractAdaptor, QDBusMessage, QDBusVariant, QDBusObjectPath
+
+    if bus is None:
+        bus = QDBusConnection.sessionBus()
+
+    def metadata():
+        item = player.track(player.index)
+        return {
+            'mpris:trackid': QDBusObjectPath(f"/com/spotify/track/{item['id']}"),
+            'mpris:length': item['duration_ms'] * 1000,
+            'mpris:artUrl': item['album']['images'][0]['url'],
+            'xesam:title': item['name'],
+            'xesam:album': item['album']['name'],
+            'xesam:artist': [artist['name'] for artist in item['artists']],
+        }
+
+    class ChangeTimer(QObject):
+        """
+        Apply the player's next change when it is due and announce every change on the bus.
+        """
+        changed_signal = pyqtSignal()  # Emitted from any thread, moves the timer to the next change
+
+        def __init__(self):
+            super().__init__()
+            self.timer = QTimer(self)
+            self.timer.setSingleShot(True)
+            self.timer.setTimerType(Qt.PreciseTimer)
+            self.timer.timeout.connect(self.tick)
+            # Queued even on this thread: the listener runs with the player's lock held
+            self.changed_signal.connect(self.schedule, Qt.QueuedConnection)
+            player.listeners.append(self.handle_change)
+
+        def handle_change(self, kind):
+            changed = {}
+            if kind == 'track':
+                changed['Metadata'] = QDBusVariant(metadata())
+            elif kind in ('pause', 'resume'):
+                changed['PlaybackStatus'] = QDBusVariant('Playing' if player.is_playing else 'Paused')
+            elif kind == 'shuffle':
+                changed['Shuffle'] = QDBusVariant(player.shuffle_state)
+            if changed:
+                message = QDBusMessage.createSignal('/org/mpris/MediaPlayer2', 'org.freedesktop.DBus.Properties',
+                                                   'PropertiesChanged')
+                message.setArguments(['org.mpris.MediaPlayer2.Player', changed, []])
+                bus.send(message)
+            self.changed_signal.emit()
+
+        @pyqtSlot()
+        def schedule(self):
+            with player.lock:
+                at = min(player.next_changes()) if player.started is not None else float('inf')
+            if at == float('inf'):
+                self.timer.stop()
+                return
+            remaining_ms = max(int((at - time.monotonic()) * 1000 + 0.999), 0)
+            if remaining_ms > 100:
+                # Long timers drift by a few ms, so wake up shortly before and re-arm for the rest
+                self.timer.start(remaining_ms - 50)
+            else:
+                self.timer.start(remaining_ms)
+
+        @pyqtSlot()
+        def tick(self):
+            with player.lock:
+                player.advance(time.monotonic())
+            self.schedule()
+
+    class PlayerAdaptor(QDBusAbstractAdaptor):
+        Q_CLASSINFO('D-Bus Interface', 'org.mpris.MediaPlayer2.Player')
+
+        def read(self, name, value):
+            now = time.monotonic()
+            with player.lock:
+                player.advance(now)
+                player.dbus_calls[f"get {name}"] += 1
+                return value()
+
+        def command(self, name, change):
+            now = time.monotonic()
+            with player.lock:
+                player.advance(now)
+                player.dbus_calls[name] += 1
+                change(now)
+
+        @pyqtProperty('QVariantMap')
+        def Metadata(self):
+            return self.read('Metadata', metadata)
+
+        @pyqtProperty(str)
+        def PlaybackStatus(self):
+            return self.read('PlaybackStatus', lambda: 'Playing' if player.is_playing else 'Paused')
+
+        @pyqtProperty('qlonglong')
+        def Position(self):
+            return self.read('Position', lambda: int(player.position_ms * 1000))
+
+        @pyqtProperty(bool)
+        def Shuffle(self):
+            return self.read('Shuffle', lambda: player.shuffle_state)
+
+        @Shuffle.setter
+        def Shuffle(self, shuffle_state):
+            def change(now):
+                player.shuffle_state = shuffle_state
+                player.notify('shuffle')
+            self.command('set Shuffle', change)
+
+        @pyqtSlot()
+        def PlayPause(self):
+            self.command('PlayPause', lambda now: player.set_playing(not player.is_playing, now, 'command'))
+
+        @pyqtSlot()
+        def Play(self):
+            self.command('Play', lambda now: player.set_playing(True, now, 'command'))
+
+        @pyqtSlot()
+        def Pause(self):
+            self.command('Pause', lambda now: player.set_playing(False, now, 'command'))
+
+        @pyqtSlot()
+        def Next(self):
+            self.command('Next', lambda now: player.change_track(1, now, 'command'))
+
+        @pyqtSlot()
+        def Previous(self):
+            self.command('Previous', lambda now: player.change_track(-1, now, 'command'))
+
+    client = QObject()
+    PlayerAdaptor(client)
+    client.change_timer = ChangeTimer()
+    if not (bus.registerObject('/org/mpris/MediaPlayer2', client, QDBusConnection.ExportAdaptors)
+            and bus.registerService('org.mpris.MediaPlayer2.spotify')):
+        raise RuntimeError(f"Cannot publish the fake player on D-Bus: {bus.lastError().message()}")
+    return client
+
+
+def serve(session_name, port, mpris=False):
+    """
+    Run the fake API until killed, printing the port it listens on first.
+
+    With mpris the player is also published on the session bus, and the API
+    is served from a thread while Qt runs the D-Bus side.
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', port), FakeSpotifyHandler)
+    server.daemon_threads = True
+    server.player = FakePlayer(sessions[session_name], f"http://127.0.0.1:{server.server_address[1]}")
+    if not mpris:
+        print(server.server_address[1], flush=True)
+        server.serve_forever()
+        return
+
+    from PyQt5.QtCore import QCoreApplication
+
+    app = QCoreApplication(sys.argv[:1])
+    server.mpris_client = publish_mpris(server.player)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(server.server_address[1], flush=True)
+    app.exec_()
+
+
+# *** Benchmark Harness ***
+
+def percentiles(values):
+    values = sorted(values)
+    if not values:
+        return {'count': 0}
+    return {
+        'count': len(values),
+        'mean': sum(values) / len(values),
+        'p50': values[len(values) // 2],
+        'p95': values[min(int(len(values) * 0.95), len(values) - 1)],
+        'max': values[-1],
+    }
+
+
+def update_latencies(events, renders):
+    """
+    Match every scripted or natural state change on the server with the first
+    render that shows it and return (latencies in ms, number never shown).
+
+    Changes caused by the app's own commands are skipped, the UI shows those
+    optimistically before the server even sees them.
+    """
+    latencies = []
+    missed = 0
+    for event in events:
+        if event['source'] == 'command':
+            continue
+        for at, track_name, is_playing in renders:
+            if at < event['at']:
+                continue
+            if ((event['kind'] == 'track' and track_name == event['track_name'])
+                    or (event['kind'] == 'pause' and not is_playing)
+                    or (event['kind'] == 'resume' and is_playing)):
+                latencies.append((at - event['at']) * 1000)
+                break
+        else:
+            missed += 1
+    return latencies, missed
+
+
+def run(session_name, duration_s, cache_root, source='web'):
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    with contextlib.ExitStack() as stack:
+        serve_args = [sys.executable, os.path.abspath(__file__), '--serve', session_name]
+        if source == 'mpris':
+            # A private session bus, so the fake player never meets a real one
+            bus = subprocess.Popen(['dbus-daemon', '--session', '--nofork', '--print-address'],
+                                   stdout=subprocess.PIPE, text=True)
+            stack.callback(bus.wait)
+            stack.callback(bus.kill)
+            os.environ['DBUS_SESSION_BUS_ADDRESS'] = bus.stdout.readline().strip()
+            serve_args.append('--mpris')
+        server = subprocess.Popen(serve_args, stdout=subprocess.PIPE, text=True)
+        stack.callback(server.wait)
+        stack.callback(server.kill)
+        base_url = f"http://127.0.0.1:{server.stdout.readline().strip()}"
+        # The app logs notices on stdout, keep that free for the results
+        with contextlib.redirect_stdout(sys.stderr):
+            return measure(session_name, duration_s, cache_root, base_url, source)
+
+
+def measure(session_name, duration_s, cache_root, base_url, source='web'):
+    from PyQt5.QtWidgets import QApplication
+    from PyQt5.QtCore import Qt, QTimer
+    from PyQt5.QtTest import QTest
+
+    import main
+
+    # Keep the benchmark's art cache and last state away from the user's
+    main.cache_dir = cache_root
+    main.last_state_file = os.path.join(cache_root, 'last_state.json')
+    main.library_file = os.path.join(cache_root, 'library.sqlite3')
+    main.playback_source = source
+
+    class BenchmarkApp(main.SpotifyApp):
+        """
+        SpotifyApp that timestamps every render showing a new track or play state.
+        """
+
+        def __init__(self, *args, **kwargs):
+            self.renders = []
+            super().__init__(*args, **kwargs)
+
+        def render_state(self, state):
+            old = self.view_state
+            super().render_state(state)
+            if old is None or (state.track_name, state.is_playing) != (old.track_name, old.is_playing):
+                self.renders.append((time.monotonic(), state.track_name, state.is_playing))
+
+    app = QApplication(sys.argv[:1])
+    main.metrics.enable()
+    transport = main.HttpTransport()
+
+    def create_client():
+        sp = main.spotipy.Spotify(auth='benchmark-token', requests_session=transport.session)
+        sp.prefix = f"{base_url}/v1/"
+        return sp
+
+    window = BenchmarkApp(create_client, transport,
+                          hourly_budget=sessions[session_name].get('hourly_budget', main.hourly_request_budget))
+    results = {}
+    scroll_frames = []
+    keystrokes = []
+
+    def scroll(seconds):
+        """
+        Scroll the recently played list down and back up at 60 Hz, timing the repaint of every frame.
+        """
+        panel = window.track_list
+        panel.tab_group.button(1).setChecked(True)
+        panel.show_tab(1)
+        scroll_bar = panel.view.verticalScrollBar()
+        model = panel.recent_model
+        until = time.monotonic() + seconds
+        timer = QTimer(window)
+        timer.setTimerType(Qt.PreciseTimer)
+        direction = [1]
+
+        def frame():
+            if time.monotonic() > until:
+                timer.stop()
+                return
+            if scroll_bar.value() >= scroll_bar.maximum() and model.cursor is None and not model.fetching:
+                direction[0] = -1
+            elif scroll_bar.value() <= 0:
+                direction[0] = 1
+            scroll_bar.setValue(scroll_bar.value() + 12 * direction[0])
+            started = time.perf_counter()
+            panel.view.viewport().repaint()
+            scroll_frames.append((time.perf_counter() - started) * 1000)
+
+        timer.timeout.connect(frame)
+        timer.start(16)
+
+    def type_text(text):
+        """
+        Type into the command palette at 10 keys per second, timing each key until the results are painted.
+        """
+        palette = window.command_palette
+        palette.search_edit.clear()
+
+        def key(character):
+            started = time.perf_counter()
+            if character == '\n':
+                QTest.keyClick(palette.search_edit, Qt.Key_Return)
+                return
+            QTest.keyClick(palette.search_edit, character)
+            palette.view.viewport().repaint()
+            keystrokes.append((time.perf_counter() - started) * 1000)
+
+        for i, character in enumerate(text):
+            QTimer.singleShot(100 * (i + 1), lambda character=character: key(character))
+
+    def start_script(display_name):
+        for at, kind, argument in sessions[session_name]['events']:
+            if kind == 'press':
+                QTimer.singleShot(int(at * 1000), getattr(window, argument))
+            elif kind == 'scroll':
+                QTimer.singleShot(int(at * 1000), lambda seconds=argument: scroll(seconds))
+            elif kind == 'type':
+                QTimer.singleShot(int(at * 1000), lambda text=argument: type_text(text))
+        QTimer.singleShot(int(duration_s * 1000), finish)
+        results['started'] = time.monotonic()
+        results['cpu_started'] = os.times()
+
+    def finish():
+        results['wall_s'] = time.monotonic() - results['started']
+        results['cpu'] = os.times()
+        results['wakeups'] = window.power_monitor.wakeup_rates()
+        with urlopen(f"{base_url}/bench/report") as response:
+            results['server'] = json.load(response)
+        window.close()
+        app.quit()
+
+    window.worker.logged_in_signal.connect(start_script)
+    window.worker.library_synced_signal.connect(
+        lambda counts: results.setdefault('library_synced', (time.monotonic() - results['started'], counts)))
+    window.show()
+    app.exec_()
+
+    server = results['server']
+    api_requests = {endpoint: count for endpoint, count in server['requests'].items()}
+    cpu_s = sum(results['cpu'][:2]) - sum(results['cpu_started'][:2])
+    latencies, missed = update_latencies(server['events'], window.renders)
+    stalls = main.metrics.summary('gui_stall_ms').get((), (0, 0, 0))
+    peak_rss = None
+    try:
+        import resource
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak_rss = peak_rss if sys.platform == 'darwin' else peak_rss * 1024
+    except ImportError:
+        pass
+    if scroll_frames:
+        results['track_list'] = {
+            'rows': window.track_list.recent_model.rowCount(),
+            'scroll_frame_ms': percentiles(scroll_frames),
+            'frames_over_16ms': sum(1 for ms in scroll_frames if ms > 1000 / 60),
+            'thumbnails': window.services.thumbnail_cache.stats,
+        }
+    if 'library_synced' in results or keystrokes:
+        synced_after_s, counts = results.get('library_synced', (None, None))
+        results['library'] = {
+            'items': counts,
+            'synced_after_s': synced_after_s,
+            'keystroke_ms': percentiles(keystrokes),
+            'query_ms': dict(zip(('count', 'mean', 'max'),
+                                 main.metrics.summary('library_search_ms').get((), (0, 0, 0)))),
+        }
+    return {
+        'session': session_name,
+        'source': source,
+        'track_list': results.get('track_list'),
+        'library': results.get('library'),
+        'duration_s': results['wall_s'],
+        'api_calls': {
+            'total': sum(api_requests.values()),
+            'per_minute': sum(api_requests.values()) / results['wall_s'] * 60,
+            'by_endpoint': api_requests,
+            'statuses': server['statuses'],
+        },
+        'dbus_calls': server['dbus_calls'],
+        'ui_update_latency_ms': dict(percentiles(latencies), missed=missed),
+        'gui_stalls': {'count': stalls[0], 'total_ms': stalls[0] * stalls[1], 'max_ms': stalls[2]},
+        'gui_slot_ms': {dict(labels)['slot']: {'count': count, 'mean': mean, 'max': peak}
+                        for labels, (count, mean, peak) in main.metrics.summary('gui_slot_ms').items()},
+        'repaints': {dict(labels)['widget']: count
+                     for labels, count in main.metrics.counter('repaints_total').items()},
+        'http_latency_ms': transport.latency_stats(),
+        'cpu_percent': 100 * cpu_s / results['wall_s'],
+        'wakeups_per_second': results['wakeups'],
+        'rss_bytes': main.resident_memory_bytes(),
+        'peak_rss_bytes': peak_rss,
+        'startup_ms': window.startup_times,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Spotify Mini Carthing against a fake Spotify Web API.")
+    parser.add_argument('--session', default='mixed', choices=sorted(sessions))
+    parser.add_argument('--duration', type=float, default=60, help="seconds to run after login")
+    parser.add_argument('--output', help="write the JSON results to this file instead of stdout")
+    parser.add_argument('--source', default='web', choices=['web', 'mpris'],
+                        help="playback source to benchmark; mpris runs a fake Spotify client on a private D-Bus")
+    parser.add_argument('--cache-dir', help="reuse this cache directory (default: a fresh, cold one)")
+    parser.add_argument('--list', action='store_true', help="list the sessions and exit")
+    parser.add_argument('--serve', metavar='SESSION', help=argparse.SUPPRESS)
+    parser.add_argument('--mpris', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, 0, args.mpris)
+        return
+    if args.list:
+        for name, session in sorted(sessions.items()):
+            print(f"{name:<14} {session['track_ms'] // 1000:>3} s tracks, {len(session['events'])} events")
+        return
+
+    if args.cache_dir:
+        results = run(args.session, args.duration, args.cache_dir, args.source)
+    else:
+        with tempfile.TemporaryDirectory() as cache_root:
+            results = run(args.session, args.duration, cache_root, args.source)
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,82 +1,3814 @@
+import time
+
+# Reference point for the startup timings reported by SpotifyApp
+startup_started = time.monotonic()
+
+import os
+import re
 import sys
+import json
+import hashlib
+import importlib
+import threading
+import contextlib
+import functools
+import itertools
+import argparse
+import signal
+import weakref
+from collections import OrderedDict, deque
+from typing import NamedTuple
+from urllib.parse import urlsplit
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+try:
+    from PyQt5 import QtDBus
+except ImportError:  # PyQt5 built without D-Bus support, e.g. on Windows
+    QtDBus = None
 from PyQt5.QtWidgets import (
     QApplication, QWidget, QLabel, QPushButton, QVBoxLayout, QHBoxLayout,
-    QProgressBar, QSizePolicy, QGraphicsDropShadowEffect, QMessageBox
+    QSizePolicy, QGraphicsDropShadowEffect, QMessageBox, QListView, QAbstractItemView, QStyledItemDelegate,
+    QButtonGroup, QFrame, QLineEdit, QStyle
+)
+from PyQt5.QtGui import (
+    QGuiApplication, QPixmap, QImage, QImageReader, QColor, QFont, QFontMetrics, QPainter, QPainterPath,
+    QIcon, QPalette
+)
+from PyQt5.QtNetwork import QLocalServer, QLocalSocket
+from PyQt5 import sip
+from PyQt5.QtCore import (
+    Qt, QTimer, QObject, QThread, pyqtSignal, pyqtSlot, QSize, QPoint, QRect, QStandardPaths,
+    QRunnable, QThreadPool, QMetaObject, QBuffer, QIODevice, QEvent, QSocketNotifier, QAbstractListModel, QModelIndex
 )
-from PyQt5.QtGui import QPixmap, QImage, QColor, QFont, QPainter, QRegion, QPainterPath
-from PyQt5.QtCore import Qt, QTimer, QObject, QThread, pyqtSignal, pyqtSlot, QUrl, QSize, QPoint, QRect
-from PyQt5.QtNetwork import QNetworkAccessManager, QNetworkRequest
-import spotipy
-from spotipy.oauth2 import SpotifyOAuth
-import qtawesome as qta  # Import QtAwesome for FontAwesome icons
 
-# Spotify authentication credentials
-client_id = 'your_client_id_here'
-client_secret = 'your_client_secret_here'
-redirect_uri = 'http://localhost:8888/callback'
 
-# Updated scope with 'user-read-playback-state'
-scope = "user-read-currently-playing user-read-playback-state user-modify-playback-state user-library-read user-library-modify"
+class LazyModule:
+    """
+    Stand-in for a module that is only imported on first attribute access.
+
+    spotipy, requests, numpy and qtawesome are slow to import and none of
+    them is needed to paint the first frame.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.module = None
+
+    def __getattr__(self, attribute):
+        if self.module is None:
+            self.module = importlib.import_module(self.name)
+        return getattr(self.module, attribute)
+
+
+spotipy = LazyModule('spotipy')
+requests = LazyModule('requests')
+np = LazyModule('numpy')
+qta = LazyModule('qtawesome')  # QtAwesome for FontAwesome icons
+sqlite3 = LazyModule('sqlite3')  # Only needed once the library syncs or the command palette opens
+
+# Spotify authentication credentials
+client_id = 'your_client_id_here'
+client_secret = 'your_client_secret_here'
+redirect_uri = 'http://localhost:8888/callback'
+
+# Updated scope with 'user-read-playback-state' and 'user-read-recently-played'
+scope = ("user-read-currently-playing user-read-playback-state user-modify-playback-state user-library-read "
+         "user-library-modify user-read-recently-played playlist-read-private playlist-read-collaborative")
+
+# Maximum number of Web API requests a single display may spend per hour
+hourly_request_budget = 1800
+
+# Shared HTTP connection pool for the Web API client and album art downloads
+http_pool_size = 4
+art_download_threads = 2
+
+# Threads shared by the poll workers, token managers and library syncs of every display in this
+# process (see --config). Requests on one thread wait for each other; None gives every account its own
+poll_threads = 2
+
+# Local socket on which --daemon publishes playback state for --subscribe windows
+daemon_socket_name = 'spotify_mini_carthing'
+
+# Where playback state comes from: 'web' polls the Web API, 'mpris' follows the Spotify desktop
+# client on this machine over D-Bus (Linux) and polls the Web API only while no client is running
+playback_source = 'web'
+mpris_bus_name = 'org.mpris.MediaPlayer2.spotify'  # Instance suffixes like .instance1234 match too
+
+# Local cache directory (album art, etc.)
+cache_dir = os.path.join(QStandardPaths.writableLocation(QStandardPaths.GenericCacheLocation), 'spotify_mini_carthing')
+
+# OAuth token store shared by every process/display using this account, and how
+# long before expiry the access token is refreshed in the background
+token_cache_path = os.path.join(cache_dir, 'token.json')
+token_refresh_margin_s = 300
+
+# Album art cache limits
+album_art_size = 190  # Displayed album art size in pixels
+last_state_file = os.path.join(cache_dir, 'last_state.json')  # Snapshot shown at startup
+album_art_memory_entries = 64  # Decoded pixmaps kept in memory
+album_art_disk_bytes = 50 * 1024 * 1024  # Downloaded images kept on disk
+
+# Upcoming-track prefetching
+prefetch_depth = 3  # Number of queued tracks whose art is warmed ahead of time
+prefetch_threshold_ms = 20000  # Refresh the queue when this little of the track remains
+prefetch_max_concurrent = 1  # Parallel prefetch downloads
+prefetch_max_kbps = 2000  # Bandwidth cap for prefetch downloads, 0 for unlimited
+
+# Up-next / recently-played list, opened from the top bar next to the track info
+track_list_width = 260
+track_list_page_size = 50  # Recently played tracks fetched per request, at most 50
+track_thumbnail_size = 40
+track_thumbnail_memory_entries = 256  # Decoded thumbnails kept in memory
+track_thumbnail_disk_bytes = 10 * 1024 * 1024
+
+# Local library index behind the Ctrl+K command palette: saved tracks, albums and playlists
+# are paged in the background, no faster than the hourly request budget allows polls
+library_file = os.path.join(cache_dir, 'library.sqlite3')
+library_sync_delay_ms = 5000  # After login, so the first poll and album art go first
+library_sync_interval_ms = 15 * 60 * 1000  # Incremental syncs stop at the first item already indexed
+library_full_sync_s = 24 * 3600  # Read everything again this often, which also catches removals
+library_page_size = 50  # At most 50
+command_palette_results = 8
+library_budget_reserve = 0.25  # Share of the hourly request budget the sync leaves to polls and commands
+library_rank_candidates = 1000  # Hits scored per search, about 1.5 ms per thousand
+
+# Palette extraction
+palette_clusters = 5  # Number of k-means color clusters
+palette_sample_size = 48  # Album art is downsampled to about this many pixels per side
+
+# Playback button taps within this window are merged into a single batch of commands
+command_coalesce_ms = 300
+
+# Theme color transitions, set theme_transition_ms to 0 to switch colors instantly
+theme_transition_ms = 300
+theme_transition_fps = 30
+
+# Instrumentation, off by default: port of the localhost Prometheus endpoint (None
+# to disable) and whether the debug overlay starts visible (F12 toggles it)
+metrics_port = None
+debug_overlay = False
+gui_stall_threshold_ms = 50  # Event loop delays longer than this count as stalls
+
+# Power saving: while a window is minimized, covered or the screen saver is on it stops
+# rendering and its worker only polls this often
+power_saving = True
+background_poll_interval_ms = 60000
+
+
+class Metrics:
+    """
+    Thread-safe counters and latency histograms for the hot paths.
+
+    Every recording method returns straight away while disabled, so the
+    instrumentation can stay in place permanently.
+    """
+    buckets_ms = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.counters = {}  # (name, labels) -> value
+        self.histograms = {}  # (name, labels) -> [bucket counts..., sum, count, max]
+        self.stall_detector = None
+
+    def enable(self):
+        """
+        Start collecting; must be called on the GUI thread, which the stall detector watches.
+        """
+        self.enabled = True
+        if self.stall_detector is None:
+            self.stall_detector = StallDetector(self)
+
+    def inc(self, name, amount=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, ms, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [0] * (len(self.buckets_ms) + 3)
+            for i, bound in enumerate(self.buckets_ms):
+                if ms <= bound:
+                    histogram[i] += 1
+                    break
+            histogram[-3] += ms
+            histogram[-2] += 1
+            histogram[-1] = max(histogram[-1], ms)
+
+    def summary(self, name):
+        """
+        Return (count, mean, max) in ms per label set of a histogram.
+        """
+        with self.lock:
+            return {labels: (h[-2], h[-3] / h[-2], h[-1])
+                    for (key, labels), h in self.histograms.items() if key == name and h[-2]}
+
+    def counter(self, name):
+        with self.lock:
+            return {labels: value for (key, labels), value in self.counters.items() if key == name}
+
+    def render(self):
+        """
+        Format every metric in the Prometheus text exposition format.
+        """
+        def label_text(labels, extra=()):
+            pairs = [f'{key}="{value}"' for key, value in labels + extra]
+            return '{' + ','.join(pairs) + '}' if pairs else ''
+
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items())
+        lines = []
+        declared = set()
+        for (name, labels), value in counters:
+            if name not in declared:
+                declared.add(name)
+                lines.append(f"# TYPE carthing_{name} counter")
+            lines.append(f"carthing_{name}{label_text(labels)} {value}")
+        for (name, labels), histogram in histograms:
+            if name not in declared:
+                declared.add(name)
+                lines.append(f"# TYPE carthing_{name} histogram")
+            cumulative = 0
+            for bound, count in zip(self.buckets_ms, histogram):
+                cumulative += count
+                lines.append(f"carthing_{name}_bucket{label_text(labels, (('le', bound),))} {cumulative}")
+            lines.append(f"carthing_{name}_bucket{label_text(labels, (('le', '+Inf'),))} {histogram[-2]}")
+            lines.append(f"carthing_{name}_sum{label_text(labels)} {histogram[-3]:.3f}")
+            lines.append(f"carthing_{name}_count{label_text(labels)} {histogram[-2]}")
+        rss = resident_memory_bytes()
+        if rss is not None:
+            lines.append("# TYPE process_resident_memory_bytes gauge")
+            lines.append(f"process_resident_memory_bytes {rss}")
+        wakeups = process_wakeups()
+        if wakeups is not None:
+            lines.append("# TYPE process_wakeups_total counter")
+            lines.append(f"process_wakeups_total {wakeups}")
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+def timed(name, **labels):
+    """
+    Decorator recording how long each call takes in the named histogram.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not metrics.enabled:
+                return function(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                metrics.observe(name, (time.perf_counter() - started) * 1000, **labels)
+        return wrapper
+    return decorator
+
+
+def resident_memory_bytes():
+    """
+    Current resident set size of this process, or the peak where only that is available.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def process_wakeups():
+    """
+    Number of times a thread of this process went to sleep and was woken up again so far.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_nvcsw  # Voluntary context switches
+
+
+class StallDetector(QObject):
+    """
+    Detect long-running slots by measuring how late a GUI-thread heartbeat fires.
+    """
+    interval_ms = 50
+
+    def __init__(self, metrics, threshold_ms=gui_stall_threshold_ms):
+        super().__init__()
+        self.metrics = metrics
+        self.threshold_ms = threshold_ms
+        self.last_tick = time.monotonic()
+        self.timer = QTimer(self)
+        self.timer.setTimerType(Qt.PreciseTimer)
+        self.timer.timeout.connect(self.tick)
+        self.timer.start(self.interval_ms)
+
+    def set_paused(self, paused):
+        """
+        Stop the heartbeat while no window is shown, nothing can visibly stall then.
+        """
+        if paused:
+            self.timer.stop()
+        elif not self.timer.isActive():
+            self.last_tick = time.monotonic()
+            self.timer.start(self.interval_ms)
+
+    def tick(self):
+        now = time.monotonic()
+        late_ms = (now - self.last_tick) * 1000 - self.interval_ms
+        self.last_tick = now
+        if late_ms > self.threshold_ms:
+            self.metrics.observe('gui_stall_ms', late_ms)
+
+
+def start_metrics_server(port):
+    """
+    Serve metrics.render() at http://127.0.0.1:<port>/metrics from a daemon thread.
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            body = metrics.render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # Scrapes are too frequent to log
+
+    server = ThreadingHTTPServer(('127.0.0.1', port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    return server
+
+
+class PollScheduler:
+    """
+    Decide when the next playback poll should happen.
+
+    The delay is picked from the last playback state: shortly after the
+    predicted end of the current track while playing, slowly while paused
+    or idle, with exponential backoff on errors and honouring Retry-After.
+    While background is set, i.e. nothing shows the state, polls are at
+    least background_interval_ms apart.
+    """
+
+    def __init__(self, playing_interval_ms=3000, paused_interval_ms=10000,
+                 idle_interval_ms=15000, track_end_margin_ms=500,
+                 base_backoff_ms=2000, max_backoff_ms=120000,
+                 hourly_budget=hourly_request_budget, background_interval_ms=background_poll_interval_ms):
+        self.playing_interval_ms = playing_interval_ms
+        self.paused_interval_ms = paused_interval_ms
+        self.idle_interval_ms = idle_interval_ms
+        self.track_end_margin_ms = track_end_margin_ms
+        self.base_backoff_ms = base_backoff_ms
+        self.max_backoff_ms = max_backoff_ms
+        self.hourly_budget = hourly_budget
+        self.background_interval_ms = background_interval_ms
+        self.background = False
+        self.error_count = 0
+        self.retry_after_ms = 0
+        self.retry_after_until = 0.0  # Monotonic time before which no request may go out after a 429
+        self.request_times = deque()  # Monotonic timestamps of requests in the last hour
+        self.lock = threading.Lock()  # The library sync counts its requests and errors from another thread
+
+    def record_request(self, now=None):
+        """
+        Count one Web API request against the hourly budget.
+        """
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            self.request_times.append(now)
+            self._expire(now)
+
+    def _expire(self, now):
+        while self.request_times and now - self.request_times[0] > 3600:
+            self.request_times.popleft()
+
+    def budget_interval_ms(self):
+        """
+        Smallest delay between polls that keeps us within the hourly budget.
+        """
+        return 3600000 // self.hourly_budget
+
+    def min_interval_ms(self):
+        interval = self.budget_interval_ms()
+        return max(interval, self.background_interval_ms) if self.background else interval
+
+    def on_success(self, current_track):
+        """
+        Reset the error state and return the delay until the next poll.
+        """
+        with self.lock:
+            self.error_count = 0
+            self.retry_after_ms = 0
+
+        if not current_track or not current_track.get('item'):
+            delay = self.idle_interval_ms
+        elif not current_track.get('is_playing'):
+            delay = self.paused_interval_ms
+        else:
+            remaining_ms = current_track['item']['duration_ms'] - (current_track.get('progress_ms') or 0)
+            # Wake up just after the track is expected to end
+            delay = min(self.playing_interval_ms, max(remaining_ms, 0) + self.track_end_margin_ms)
+
+        return max(delay, self.min_interval_ms())
+
+    def on_error(self, retry_after=None):
+        """
+        Register a failed request and return the backoff delay until the next poll.
+
+        A Retry-After also holds back the polls already scheduled, see retry_after_remaining_ms.
+        """
+        with self.lock:
+            self.error_count += 1
+            delay = min(self.base_backoff_ms * 2 ** (self.error_count - 1), self.max_backoff_ms)
+
+            self.retry_after_ms = 0
+            if retry_after is not None:
+                try:
+                    self.retry_after_ms = int(float(retry_after) * 1000)
+                except (TypeError, ValueError):
+                    pass
+                delay = max(delay, self.retry_after_ms)
+                self.retry_after_until = max(self.retry_after_until, time.monotonic() + self.retry_after_ms / 1000)
+
+        return max(delay, self.min_interval_ms())
+
+    def retry_after_remaining_ms(self, now=None):
+        """
+        How long requests must still wait out the last Retry-After, whichever request got the 429.
+        """
+        now = time.monotonic() if now is None else now
+        return max(int((self.retry_after_until - now) * 1000), 0)
+
+    def allows_deferred_request(self, now=None):
+        """
+        Whether a request that can wait, like a library page, may go out now.
+
+        Not while background is set or polls are backing off after an error,
+        nor once less than library_budget_reserve of the budget is left.
+        """
+        if self.background or self.error_count:
+            return False
+        return self.budget(now)['remaining'] > self.hourly_budget * library_budget_reserve
+
+    def budget(self, now=None):
+        """
+        Report how much of the hourly request budget has been used.
+        """
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            self._expire(now)
+            used = len(self.request_times)
+        return {
+            'requests_last_hour': used,
+            'hourly_budget': self.hourly_budget,
+            'remaining': max(self.hourly_budget - used, 0),
+            'error_count': self.error_count,
+            'retry_after_ms': self.retry_after_ms,
+            'background': self.background,
+        }
+
+
+class DownloadCancelled(Exception):
+    """
+    Raised when a streamed download is abandoned because it was superseded.
+    """
+
+
+def create_transport_session(transport):
+    """
+    Build the requests session for an HttpTransport.
+
+    Defined in a function so that requests is only imported when the first
+    request is made.
+    """
+
+    class TransportSession(requests.Session):
+        """
+        requests session that applies per-endpoint timeouts and records latency.
+        """
+
+        def request(self, method, url, **kwargs):
+            # Per-endpoint timeouts replace whatever the caller (e.g. spotipy) passes
+            kwargs['timeout'] = transport.timeout_for(url)
+            started = time.monotonic()
+            try:
+                return super().request(method, url, **kwargs)
+            finally:
+                if not kwargs.get('stream'):
+                    transport.record(endpoint_name(method, url), time.monotonic() - started)
+
+    from urllib3.util.retry import Retry
+
+    session = TransportSession()
+    session.headers['Accept-Encoding'] = 'gzip'
+    # Same retry policy as spotipy, except 429, which is left to the poll scheduler. urllib3
+    # would otherwise sleep for the whole Retry-After of a 429 or 503 on the calling thread.
+    # Once retries run out the last 5xx response is returned, otherwise spotipy reports it as a 429
+    retry = Retry(total=3, connect=None, read=False, status=3, backoff_factor=0.3,
+                  allowed_methods=frozenset(['GET', 'POST', 'PUT', 'DELETE']),
+                  status_forcelist=(500, 502, 503, 504), raise_on_status=False,
+                  respect_retry_after_header=False)
+    adapter = requests.adapters.HTTPAdapter(pool_connections=transport.pool_size,
+                                            pool_maxsize=transport.pool_size, max_retries=retry)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def endpoint_name(method, url):
+    """
+    Group URLs into endpoints for latency statistics, e.g. 'GET me/player'.
+    """
+    path = urlsplit(url).path
+    if '/image/' in path:
+        return f"{method} image"
+    path = path.split('/v1/', 1)[-1].strip('/')
+    segments = ['{id}' if re.fullmatch(r'[A-Za-z0-9]{22,}', segment) else segment for segment in path.split('/')]
+    return f"{method} {'/'.join(segments)}"
+
+
+class HttpTransport:
+    """
+    Shared HTTP layer for the spotipy client and album art downloads.
+
+    One keep-alive connection pool serves API calls and art fetches, every
+    request gets an endpoint-specific (connect, read) timeout, responses are
+    requested gzip-compressed and latency is recorded per endpoint.
+    """
+    # (URL fragment, (connect, read) timeout in seconds), first match wins
+    endpoint_timeouts = [
+        ('/v1/me/player', (3.05, 4)),
+        ('/v1/me/tracks', (3.05, 6)),
+        ('/v1/me/library', (3.05, 6)),
+        ('accounts.spotify.com', (3.05, 10)),
+        ('/image/', (3.05, 10)),
+    ]
+    default_timeout = (3.05, 8)
+    latency_samples = 256  # Samples kept per endpoint
+
+    def __init__(self, pool_size=http_pool_size):
+        self.pool_size = pool_size
+        self.lock = threading.Lock()
+        self.latencies = {}  # Endpoint -> deque of seconds
+        self.counts = {}  # Endpoint -> total number of requests
+        self._session = None
+
+    @property
+    def session(self):
+        """
+        The shared requests session, created on first use from any thread.
+        """
+        with self.lock:
+            if self._session is None:
+                self._session = create_transport_session(self)
+            return self._session
+
+    def timeout_for(self, url):
+        for fragment, timeout in self.endpoint_timeouts:
+            if fragment in url:
+                return timeout
+        return self.default_timeout
+
+    def record(self, endpoint, seconds):
+        with self.lock:
+            self.latencies.setdefault(endpoint, deque(maxlen=self.latency_samples)).append(seconds)
+            self.counts[endpoint] = self.counts.get(endpoint, 0) + 1
+        metrics.observe('http_request_duration_ms', seconds * 1000, endpoint=endpoint)
+
+    def latency_stats(self):
+        """
+        Return count, mean, p50, p95 and max latency in milliseconds per endpoint.
+        """
+        with self.lock:
+            snapshot = {endpoint: sorted(samples) for endpoint, samples in self.latencies.items()}
+            counts = dict(self.counts)
+        stats = {}
+        for endpoint, samples in snapshot.items():
+            stats[endpoint] = {
+                'count': counts[endpoint],
+                'mean_ms': 1000 * sum(samples) / len(samples),
+                'p50_ms': 1000 * samples[len(samples) // 2],
+                'p95_ms': 1000 * samples[min(int(len(samples) * 0.95), len(samples) - 1)],
+                'max_ms': 1000 * samples[-1],
+            }
+        return stats
+
+    def fetch(self, url, is_cancelled=lambda: False, chunk_size=16384):
+        """
+        Download url in chunks, giving up with DownloadCancelled as soon as is_cancelled() is true.
+        """
+        started = time.monotonic()
+        with self.session.get(url, stream=True) as response:
+            response.raise_for_status()
+            chunks = []
+            for chunk in response.iter_content(chunk_size):
+                if is_cancelled():
+                    raise DownloadCancelled(url)
+                chunks.append(chunk)
+        self.record(endpoint_name('GET', url), time.monotonic() - started)
+        return b''.join(chunks)
+
+
+@contextlib.contextmanager
+def file_lock(path):
+    """
+    Hold an exclusive lock on path, shared with other processes.
+    """
+    with open(path, 'a') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def create_token_store(path=None):
+    """
+    Build a spotipy cache handler that keeps the token in one file shared by several processes.
+
+    Writes replace the file atomically so readers never need a lock; the
+    refresh lock makes sure only one process refreshes at a time.
+    """
+    path = path or token_cache_path
+
+    class LockedTokenStore(spotipy.cache_handler.CacheHandler):
+
+        def get_cached_token(self):
+            try:
+                with open(path) as f:
+                    return json.load(f)
+            except (OSError, ValueError):
+                return None
+
+        def save_token_to_cache(self, token_info):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, 'w') as f:
+                json.dump(token_info, f)
+            os.replace(temp_path, path)
+
+        def refresh_lock(self):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            return file_lock(path + '.lock')
+
+    return LockedTokenStore()
+
+
+class TokenManager(QObject):
+    """
+    Refresh the OAuth access token ahead of expiry, on its own thread.
+
+    API calls then always find a valid token instead of stalling on a
+    refresh round-trip. Before refreshing, the shared store is re-read under
+    its lock, so when another process got there first its token is reused.
+    """
+    refreshed_signal = pyqtSignal(float)  # Refresh latency in ms
+    refresh_failed_signal = pyqtSignal(str)
+
+    def __init__(self, auth_manager, margin_s=token_refresh_margin_s, retry_s=30):
+        super().__init__()
+        self.auth_manager = auth_manager
+        self.store = auth_manager.cache_handler
+        self.margin_s = margin_s
+        self.retry_s = retry_s
+
+    @pyqtSlot()
+    def start(self):
+        self.timer = QTimer()
+        self.timer.setSingleShot(True)
+        self.timer.setTimerType(Qt.VeryCoarseTimer)
+        self.timer.timeout.connect(self.refresh)
+        self.schedule()
+
+    def schedule(self):
+        token = self.store.get_cached_token()
+        if not token:
+            self.timer.start(self.retry_s * 1000)
+            return
+        delay_s = token['expires_at'] - self.margin_s - time.time()
+        self.timer.start(int(max(delay_s, 0) * 1000))
+
+    def refresh(self):
+        started = time.monotonic()
+        try:
+            with self.store.refresh_lock():
+                token = self.store.get_cached_token()
+                if token and token['expires_at'] - time.time() > self.margin_s:
+                    # Another process already refreshed it
+                    self.schedule()
+                    return
+                if not token or not token.get('refresh_token'):
+                    self.refresh_failed_signal.emit('not logged in')
+                    self.timer.start(self.retry_s * 1000)
+                    return
+                self.auth_manager.refresh_access_token(token['refresh_token'])
+        except Exception as e:
+            self.refresh_failed_signal.emit(str(e))
+            self.timer.start(self.retry_s * 1000)
+            return
+        self.refreshed_signal.emit((time.monotonic() - started) * 1000)
+        self.schedule()
+
+    @pyqtSlot()
+    def stop(self):
+        self.timer.stop()
+
+
+class LikedCache:
+    """
+    Remember the liked state of tracks by ID so it is only queried on track changes.
+    """
+    # The Web API accepts at most 50 IDs per contains call
+    batch_size = 50
+
+    def __init__(self):
+        self.liked = {}
+
+    def get(self, track_id):
+        """
+        Return True/False for a known track, or None if it has not been looked up yet.
+        """
+        return self.liked.get(track_id)
+
+    def set(self, track_id, is_liked):
+        self.liked[track_id] = is_liked
+
+    def missing(self, track_ids):
+        """
+        Return the unique IDs that are not cached yet, capped at one batch.
+        """
+        missing = []
+        for track_id in track_ids:
+            if track_id and track_id not in self.liked and track_id not in missing:
+                missing.append(track_id)
+        return missing[:self.batch_size]
+
+    def update(self, track_ids, results):
+        for track_id, is_liked in zip(track_ids, results):
+            self.liked[track_id] = bool(is_liked)
+
+
+class LibraryIndex:
+    """
+    Saved tracks, albums and playlists in a local SQLite FTS5 index.
+
+    The worker thread writes and the command palette reads, each through its
+    own LibraryIndex; WAL mode lets a search run while a sync is writing.
+    """
+    schema = """
+        CREATE TABLE IF NOT EXISTS items (
+            uri TEXT PRIMARY KEY,
+            source TEXT NOT NULL,
+            name TEXT NOT NULL,
+            subtitle TEXT NOT NULL,
+            image_url TEXT,
+            added_at TEXT
+        );
+        CREATE INDEX IF NOT EXISTS items_by_source ON items (source, added_at);
+        CREATE VIRTUAL TABLE IF NOT EXISTS items_fts USING fts5(
+            name, subtitle, content='items', tokenize='unicode61 remove_diacritics 2', prefix='1 2 3'
+        );
+        CREATE TRIGGER IF NOT EXISTS items_insert AFTER INSERT ON items BEGIN
+            INSERT INTO items_fts (rowid, name, subtitle) VALUES (new.rowid, new.name, new.subtitle);
+        END;
+        CREATE TRIGGER IF NOT EXISTS items_delete AFTER DELETE ON items BEGIN
+            INSERT INTO items_fts (items_fts, rowid, name, subtitle) VALUES ('delete', old.rowid, old.name, old.subtitle);
+        END;
+        CREATE TRIGGER IF NOT EXISTS items_update AFTER UPDATE ON items BEGIN
+            INSERT INTO items_fts (items_fts, rowid, name, subtitle) VALUES ('delete', old.rowid, old.name, old.subtitle);
+            INSERT INTO items_fts (rowid, name, subtitle) VALUES (new.rowid, new.name, new.subtitle);
+        END;
+        CREATE TABLE IF NOT EXISTS sources (
+            source TEXT PRIMARY KEY,
+            total INTEGER NOT NULL,
+            full_synced_at REAL NOT NULL
+        );
+    """
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path, timeout=5)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript(self.schema)
+
+    def search(self, text, limit=command_palette_results):
+        """
+        Return the best TrackRows for the words typed so far, each matched as a prefix.
+        """
+        words = re.findall(r'\w+', text)
+        if not words:
+            # Nothing typed yet: the most recently saved items
+            cursor = self.db.execute('SELECT uri, name, subtitle, image_url FROM items '
+                                     'ORDER BY added_at IS NULL, added_at DESC LIMIT ?', (limit,))
+        else:
+            query = ' '.join(f'"{word}"*' for word in words)
+            # Name matches count ten times as much as artist, album or owner matches. Scoring
+            # costs about a microsecond per hit, so a one-letter prefix that matches most of the
+            # library only ranks the first library_rank_candidates hits.
+            cursor = self.db.execute('SELECT items.uri, items.name, items.subtitle, items.image_url '
+                                     'FROM (SELECT rowid, bm25(items_fts, 10.0, 1.0) AS score FROM items_fts '
+                                     'WHERE items_fts MATCH ? LIMIT ?) AS hits '
+                                     'JOIN items ON items.rowid = hits.rowid ORDER BY hits.score LIMIT ?',
+                                     (query, library_rank_candidates, limit))
+        return [TrackRow(uri=uri, name=name, artist_name=subtitle, thumbnail_url=image_url)
+                for uri, name, subtitle, image_url in cursor]
+
+    def added_at(self, source):
+        return dict(self.db.execute('SELECT uri, added_at FROM items WHERE source = ?', (source,)))
+
+    def count(self, source):
+        return self.db.execute('SELECT COUNT(*) FROM items WHERE source = ?', (source,)).fetchone()[0]
+
+    def counts(self):
+        return dict(self.db.execute('SELECT source, COUNT(*) FROM items GROUP BY source'))
+
+    def upsert(self, source, rows):
+        """
+        Add or update (uri, name, subtitle, image URL, added at) rows of a source.
+        """
+        with self.db:
+            self.db.executemany('INSERT INTO items (uri, source, name, subtitle, image_url, added_at) '
+                                'VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (uri) DO UPDATE SET '
+                                'name = excluded.name, subtitle = excluded.subtitle, '
+                                'image_url = excluded.image_url, added_at = excluded.added_at',
+                                [(uri, source, name, subtitle, image_url, added_at)
+                                 for uri, name, subtitle, image_url, added_at in rows])
+
+    def finish_full_sync(self, source, uris, total):
+        """
+        Drop the items of source that a full pass did not see, and record the pass.
+        """
+        with self.db:
+            stale = [(uri,) for uri in set(self.added_at(source)) - set(uris)]
+            self.db.executemany('DELETE FROM items WHERE uri = ?', stale)
+            self.db.execute('INSERT OR REPLACE INTO sources (source, total, full_synced_at) VALUES (?, ?, ?)',
+                            (source, total, time.time()))
+
+    def full_synced_at(self, source):
+        row = self.db.execute('SELECT full_synced_at FROM sources WHERE source = ?', (source,)).fetchone()
+        return row[0] if row else 0
+
+    def close(self):
+        self.db.close()
+
+
+def library_row(source, entry):
+    """
+    Reduce a saved track, saved album or playlist entry to an index row.
+    """
+    if source == 'playlist':
+        item = entry
+        subtitle = f"Playlist · {(item.get('owner') or {}).get('display_name') or ''}"
+        images = item.get('images') or []
+    else:
+        item = entry[source]
+        artists = ', '.join(artist['name'] for artist in item['artists'])
+        if source == 'track':
+            subtitle = f"{artists} · {item['album']['name']}"
+            images = item['album']['images']
+        else:
+            subtitle = f"Album · {artists}"
+            images = item['images']
+    # The smallest image is plenty for a palette thumbnail
+    return item['uri'], item['name'], subtitle, images[-1]['url'] if images else None, entry.get('added_at')
+
+
+class LibrarySync:
+    """
+    Page the account's saved tracks, albums and playlists into a LibraryIndex, one request per step.
+
+    Saved tracks and albums are listed newest first, so an incremental sync
+    stops at the first item that is already indexed. When the indexed count
+    then differs from the API's total (something was removed), or the last
+    full pass is older than library_full_sync_s, every page is read again.
+    Playlists are few, so they are always read in full. A request that
+    fails is made again by the next step, so a sync resumes where it was.
+    """
+    sources = [
+        # Source, spotipy method
+        ('track', 'current_user_saved_tracks'),
+        ('album', 'current_user_saved_albums'),
+        ('playlist', 'current_user_playlists'),
+    ]
+
+    def __init__(self, index, call):
+        self.index = index
+        self.call = call  # LibraryWorker.call, so requests count against the budget
+        self.steps = None  # The running sync, a generator that yields requests and is sent their pages
+        self.request = None  # (spotipy method, offset) the next step makes
+
+    def step(self):
+        """
+        Make the next request; returns True once a whole sync has finished.
+
+        Errors of the request propagate and leave it to be made again by the next step.
+        """
+        if self.steps is None:
+            self.steps = self.run()
+            self.request = next(self.steps)
+        method, offset = self.request
+        page = self.call(method, limit=library_page_size, offset=offset)
+        try:
+            self.request = self.steps.send(page)
+        except StopIteration:
+            self.steps = None
+            return True
+        except Exception:
+            self.steps = None  # Storing the page failed, start over
+            raise
+        return False
+
+    def run(self):
+        for source, method in self.sources:
+            if source != 'playlist' and time.time() - self.index.full_synced_at(source) < library_full_sync_s:
+                known = self.index.added_at(source)
+                offset = 0
+                while True:
+                    page = yield method, offset
+                    entries = [entry for entry in page['items'] if entry.get(source)]
+                    new = list(itertools.takewhile(
+                        lambda entry: known.get(entry[source]['uri']) != entry['added_at'], entries))
+                    self.index.upsert(source, [library_row(source, entry) for entry in new])
+                    offset += len(page['items'])
+                    if len(new) < len(entries) or not page['next']:
+                        break
+                if self.index.count(source) == page['total']:
+                    continue
+            yield from self.full_sync(source, method)
+
+    def full_sync(self, source, method):
+        uris = []
+        offset = 0
+        while True:
+            page = yield method, offset
+            rows = [library_row(source, entry) for entry in page['items']
+                    if entry and (source == 'playlist' or entry.get(source))]
+            self.index.upsert(source, rows)
+            uris.extend(row[0] for row in rows)
+            offset += len(page['items'])
+            if not page['next']:
+                break
+        self.index.finish_full_sync(source, uris, page['total'])
+
+
+class LibraryWorker(QObject):
+    """
+    Run a LibrarySync for a Worker, one request per budget interval of its poll scheduler.
+
+    It is a member of the WorkerPool like the worker, usually on another
+    of its threads. Library pages can wait, so each step first asks the
+    scheduler: while it says no, e.g. because the window is hidden or polls
+    are backing off, or the worker has not logged in yet, the sync pauses
+    and asks again later.
+    """
+    library_synced_signal = pyqtSignal(dict)  # Indexed items by source
+
+    # Delay before a failed page is requested again, or a paused sync asks the scheduler again
+    retry_ms = 60000
+
+    def __init__(self, worker, path):
+        super().__init__()
+        self.worker = worker  # Requests go through Worker.call, so they count against its budget
+        self.scheduler = worker.scheduler
+        self.path = path
+        self.sync = None
+        self.timer = None  # Created on the pool thread by start
+
+    @pyqtSlot()
+    def start(self):
+        try:
+            index = LibraryIndex(self.path)
+        except sqlite3.Error as e:
+            print(f"Library search is unavailable: {e}")
+            return
+        self.sync = LibrarySync(index, self.worker.call)
+        self.timer = QTimer()
+        self.timer.setSingleShot(True)
+        self.timer.setTimerType(Qt.CoarseTimer)
+        self.timer.timeout.connect(self.step)
+        self.timer.start(library_sync_delay_ms)
+
+    def step(self):
+        if self.worker.sp is None or not self.scheduler.allows_deferred_request():
+            self.timer.start(self.retry_ms)
+            return
+        try:
+            finished = self.sync.step()
+        except spotipy.exceptions.SpotifyException as e:
+            # The failed page is requested again, the sync does not start over
+            if e.http_status == 429:
+                # Polls wait out the same Retry-After, and library pages wait for polls to succeed again
+                self.timer.start(self.scheduler.on_error(e.headers.get('Retry-After') if e.headers else None))
+            else:
+                self.timer.start(self.retry_ms)
+            return
+        except Exception:
+            self.timer.start(self.retry_ms)
+            return
+        if finished:
+            self.library_synced_signal.emit(self.sync.index.counts())
+            self.timer.start(library_sync_interval_ms)
+        else:
+            # Paced like polls, so a long sync cannot burst into the account's rate limit
+            self.timer.start(self.scheduler.budget_interval_ms())
+
+    @pyqtSlot()
+    def stop(self):
+        if self.sync is not None:
+            self.timer.stop()
+            self.sync.index.close()
+
+
+class Worker(QObject):
+    """
+    Own the Spotify client and run every Web API call on the worker thread.
+
+    Polls are scheduled by a PollScheduler; playback commands arrive through
+    execute_command and their outcome is sent back with signals. sp is either
+    a spotipy client or a zero-argument callable that builds and
+    authenticates one on the worker thread.
+    """
+    # Define signals to send data back to the main thread
+    state_signal = pyqtSignal(object)  # PlaybackState
+    error_signal = pyqtSignal(str)  # Connectivity lost, the display shows it instead of the track
+    notice_signal = pyqtSignal(str)  # Worth logging, but playback is still followed
+    budget_signal = pyqtSignal(dict)
+    command_result_signal = pyqtSignal(str, object)
+    command_error_signal = pyqtSignal(str, str)
+    queue_signal = pyqtSignal(list)
+    logged_in_signal = pyqtSignal(str)
+    auth_error_signal = pyqtSignal(str)
+    client_ready_signal = pyqtSignal(object)  # The client's auth manager
+    token_error_signal = pyqtSignal(str)
+    recently_played_signal = pyqtSignal(list, object, object)  # Tracks, requested cursor, cursor of the next page
+    recently_played_error_signal = pyqtSignal(str)
+    library_synced_signal = pyqtSignal(dict)  # Indexed items by source
+
+    # Delay used when a poll is requested right after a user action
+    poll_soon_delay_ms = 300
+    # Backoff of a failed liked-state lookup, which only that lookup retries
+    liked_retry_ms = 5000
+    liked_max_retry_ms = 15 * 60 * 1000
+
+    def __init__(self, sp, hourly_budget=hourly_request_budget, library_path=None):
+        super().__init__()
+        self.sp = None if callable(sp) else sp
+        self.client_factory = sp if callable(sp) else None
+        self.current_track_id = None  # Keep track of the current track ID
+        self.timer = None  # Created on the worker thread by start
+        self.poll_due = time.monotonic()
+        self.start_delay_ms = 0  # Offsets the first poll, set by WorkerPool to stagger accounts
+        self.scheduler = PollScheduler(hourly_budget=hourly_budget)
+        self.liked_cache = LikedCache()
+        self.queue_track_id = None  # Track during which the queue was last fetched
+        self.queue_fetched_at = 0
+        self.upcoming = []  # Tracks of that queue
+        self.liked_failures = 0  # Liked-state lookups failed in a row
+        self.liked_retry_at = 0.0  # Monotonic time after which a failed lookup may be made again
+        self.follow_up_429 = None  # Rate-limited queue or liked lookup, backs off the polls once the poll is done
+        self.skip_context = None  # (context URI, track ID) while skips can start the target in the context
+        # Syncs the library into library_path, if given; whoever adds the worker to the pool adds it too
+        self.library_worker = LibraryWorker(self, library_path) if library_path else None
+        if self.library_worker is not None:
+            self.library_worker.library_synced_signal.connect(self.library_synced_signal)
+        self.command_handlers = {
+            'set_playing': self.command_set_playing,
+            'set_shuffle': self.command_set_shuffle,
+            'set_liked': self.command_set_liked,
+            'skip': self.command_skip,
+            'play': self.command_play,
+        }
+
+    @pyqtSlot()
+    def start(self):
+        self.timer = QTimer()
+        self.timer.setSingleShot(True)  # Rescheduled after every poll
+        self.timer.timeout.connect(self.fetch_track_data)
+        if self.client_factory is not None and not self.connect_client():
+            return
+        self.schedule_poll(self.start_delay_ms)
+
+    def schedule_poll(self, delay_ms):
+        self.poll_due = time.monotonic() + delay_ms / 1000
+        self.timer.start(delay_ms)
+
+    def connect_client(self):
+        """
+        Build the Spotify client and test authentication, off the GUI thread.
+        """
+        try:
+            self.sp = self.client_factory()
+            user = self.call('current_user')
+        except Exception as e:
+            self.auth_error_signal.emit(str(e))
+            return False
+        self.logged_in_signal.emit(user['display_name'] or user['id'])
+        auth_manager = getattr(self.sp, 'auth_manager', None)
+        if hasattr(auth_manager, 'refresh_access_token'):
+            self.client_ready_signal.emit(auth_manager)
+        return True
+
+    def call(self, method, *args, **kwargs):
+        """
+        Call a spotipy method and count it against the request budget.
+        """
+        self.scheduler.record_request()
+        return getattr(self.sp, method)(*args, **kwargs)
+
+    @timed('poll_duration_ms')
+    def fetch_track_data(self):
+        # How late the timer fired compared to when the scheduler wanted the poll
+        metrics.observe('poll_jitter_ms', max(time.monotonic() - self.poll_due, 0) * 1000)
+        wait_ms = self.scheduler.retry_after_remaining_ms()
+        if wait_ms:
+            # Another request of this account, e.g. a library page, was told to back off
+            self.schedule_poll(wait_ms)
+            return
+        try:
+            # current_playback carries the item, progress, is_playing and shuffle state in one call
+            requested_at = time.monotonic()
+            current_track = self.call('current_playback')
+            self.skip_context = None
+            if current_track and current_track['item'] is not None:
+                # Assume the server sampled progress halfway through the round trip
+                current_track['sampled_at'] = (requested_at + time.monotonic()) / 2
+                track_id = current_track['item']['id']
+                context = current_track.get('context') or {}
+                # Only album and playlist contexts can be started at a track, and only unshuffled keep the order
+                if context.get('type') in ('album', 'playlist') and not current_track['shuffle_state']:
+                    self.skip_context = (context['uri'], track_id)
+                if track_id != self.current_track_id:
+                    self.current_track_id = track_id
+                    self.prefetch_upcoming(track_id)
+                else:
+                    self.retry_liked_lookup(track_id)
+                    # Refresh the queue once more near the end in case it was edited meanwhile
+                    remaining_ms = current_track['item']['duration_ms'] - (current_track['progress_ms'] or 0)
+                    if (remaining_ms <= prefetch_threshold_ms and self.queue_track_id == track_id
+                            and time.monotonic() - self.queue_fetched_at > prefetch_threshold_ms / 1000):
+                        self.prefetch_upcoming(track_id)
+                current_track['is_liked'] = bool(self.liked_cache.get(track_id))
+        except spotipy.exceptions.SpotifyOauthError as e:
+            # The token could not be refreshed; playback itself may be fine, so keep the last state
+            delay = self.scheduler.on_error()
+            self.token_error_signal.emit(str(e))
+        except spotipy.exceptions.SpotifyException as e:
+            retry_after = e.headers.get('Retry-After') if e.http_status == 429 and e.headers else None
+            delay = self.scheduler.on_error(retry_after)
+            if e.http_status != 429:
+                # Rate limiting is not a connection problem, just wait it out
+                self.error_signal.emit(str(e))
+        except Exception as e:
+            delay = self.scheduler.on_error()
+            # Emit the error signal instead of printing
+            self.error_signal.emit(str(e))
+        else:
+            delay = self.scheduler.on_success(current_track)
+            delay = self.back_off_follow_up() or delay
+            if current_track is not None and current_track['item'] is not None:
+                self.state_signal.emit(PlaybackState.from_track(current_track))
+            else:
+                # Clear track info if no track is playing
+                self.state_signal.emit(PlaybackState(track_name='No track playing', sampled_at=time.monotonic()))
+
+        self.budget_signal.emit(self.scheduler.budget())
+        self.schedule_poll(delay)
+
+    def prefetch_upcoming(self, track_id):
+        """
+        Fetch the upcoming queue, announce it for art prefetching and look up
+        the liked state of the current and queued tracks in one batch.
+
+        Neither lookup is allowed to fail the poll that triggered it; a failed
+        liked lookup is made again by retry_liked_lookup.
+        """
+        self.queue_track_id = track_id
+        self.queue_fetched_at = time.monotonic()
+        upcoming = []
+        try:
+            queue = self.call('queue')
+            if queue:
+                upcoming = [item for item in queue['queue'] if item and item.get('type', 'track') == 'track']
+        except Exception as e:
+            # The queue is only an optimisation, the current track is looked up regardless
+            self.follow_up_failed("Could not fetch the queue", e)
+        self.upcoming = upcoming
+
+        self.look_up_liked([track_id] + [item['id'] for item in upcoming])
+        if upcoming:
+            for item in upcoming:
+                item['is_liked'] = bool(self.liked_cache.get(item['id']))
+            self.queue_signal.emit(upcoming)
+
+    def look_up_liked(self, track_ids):
+        """
+        Look up the liked state of those tracks that are not cached yet; returns False if that failed.
+        """
+        track_ids = self.liked_cache.missing(track_ids)
+        if not track_ids:
+            return True
+        try:
+            self.liked_cache.update(track_ids, self.call('current_user_saved_tracks_contains', track_ids))
+        except Exception as e:
+            self.follow_up_failed("Could not look up liked tracks", e)
+            # Backs off across tracks too, so a lasting failure like a missing scope costs little
+            self.liked_failures += 1
+            backoff_ms = min(self.liked_retry_ms * 2 ** (self.liked_failures - 1), self.liked_max_retry_ms)
+            self.liked_retry_at = time.monotonic() + backoff_ms / 1000
+            return False
+        self.liked_failures = 0
+        return True
+
+    def retry_liked_lookup(self, track_id):
+        """
+        Look up the liked state of the current track again if it failed before and the backoff has passed.
+        """
+        if self.liked_cache.get(track_id) is None and time.monotonic() >= self.liked_retry_at:
+            self.look_up_liked([track_id] + [item['id'] for item in self.upcoming])
+
+    def follow_up_failed(self, message, e):
+        print(f"{message}: {e}")
+        if isinstance(e, spotipy.exceptions.SpotifyException) and e.http_status == 429:
+            self.follow_up_429 = e
+
+    def back_off_follow_up(self):
+        """
+        Pass a 429 of a queue or liked lookup to the scheduler; returns the delay until the next poll, or None.
+        """
+        e, self.follow_up_429 = self.follow_up_429, None
+        if e is None:
+            return None
+        return self.scheduler.on_error(e.headers.get('Retry-After') if e.headers else None)
+
+    @pyqtSlot()
+    def poll_soon(self):
+        """
+        Bring the next poll forward, e.g. after a playback command.
+        """
+        if self.timer.remainingTime() > self.poll_soon_delay_ms:
+            self.schedule_poll(self.poll_soon_delay_ms)
+
+    @pyqtSlot(bool)
+    def set_background(self, background):
+        """
+        Drop to heartbeat polls while nothing shows the state, and catch up at once when it is shown again.
+        """
+        if background == self.scheduler.background:
+            return
+        self.scheduler.background = background
+        if self.timer is None:
+            return  # start has not run yet
+        # Heartbeat polls only need to be accurate to the second, which lets the OS batch the wakeups
+        self.timer.setTimerType(Qt.VeryCoarseTimer if background else Qt.CoarseTimer)
+        if not background and self.scheduler.error_count == 0 and self.timer.remainingTime() > 0:
+            self.schedule_poll(0)
+
+    @pyqtSlot(str, object)
+    def execute_command(self, command, args):
+        """
+        Run a playback command queued from the GUI thread.
+        """
+        handler = self.command_handlers.get(command)
+        if self.sp is None:
+            self.command_error_signal.emit(command, "Not connected to Spotify yet.")
+            return
+        if handler is None:
+            self.command_error_signal.emit(command, f"Unknown command: {command}")
+            return
+        try:
+            result = handler(args)
+        except spotipy.exceptions.SpotifyException as e:
+            self.command_error_signal.emit(command, f"Spotify API Error in {command}: {e}")
+        except Exception as e:
+            self.command_error_signal.emit(command, f"Error in {command}: {e}")
+        else:
+            self.command_result_signal.emit(command, result)
+            self.poll_soon()
+
+    @pyqtSlot(object)
+    def fetch_recently_played(self, before):
+        """
+        Fetch a page of recently played tracks older than the cursor before, or the newest page.
+        """
+        if self.sp is None:
+            self.recently_played_error_signal.emit("Not connected to Spotify yet.")
+            return
+        try:
+            page = self.call('current_user_recently_played', limit=track_list_page_size, before=before)
+        except spotipy.exceptions.SpotifyException as e:
+            self.recently_played_error_signal.emit(f"Spotify API Error in recently played: {e}")
+            return
+        except Exception as e:
+            self.recently_played_error_signal.emit(f"Error in recently played: {e}")
+            return
+        tracks = [dict(item['track'], played_at=item['played_at']) for item in page['items'] if item.get('track')]
+        cursor = (page.get('cursors') or {}).get('before') if page.get('next') else None
+        self.recently_played_signal.emit(tracks, before, cursor)
+
+    def command_set_playing(self, is_playing):
+        # The GUI already knows the state it wants, so there is no lookup first
+        if is_playing:
+            self.call('start_playback')
+        else:
+            self.call('pause_playback')
+        return {'is_playing': is_playing}
+
+    def command_set_shuffle(self, shuffle_state):
+        self.call('shuffle', shuffle_state)
+        return {'shuffle_state': shuffle_state}
+
+    def command_set_liked(self, args):
+        track_id, is_liked = args
+        if is_liked:
+            self.call('current_user_saved_tracks_add', [track_id])
+        else:
+            self.call('current_user_saved_tracks_delete', [track_id])
+        self.liked_cache.set(track_id, is_liked)
+        return {'is_liked': is_liked}
+
+    def command_skip(self, count):
+        """
+        Skip count tracks forward, or backward for a negative count.
+
+        A skip forward by several tracks is one request when the last poll
+        saw an unshuffled album or playlist and the queue was fetched during
+        the same track: the context is started at the target from the queue.
+        Tracks the user queued stay queued instead of being skipped. Backward
+        skips, other contexts, and targets the context turns out not to
+        contain take one request per track.
+        """
+        target = self.skip_target(count)
+        if target is not None:
+            try:
+                self.call('start_playback', context_uri=self.skip_context[0], offset={'uri': target})
+                return {}
+            except spotipy.exceptions.SpotifyException as e:
+                if e.http_status == 429:
+                    raise
+                # E.g. the target is a track the user queued, which is not in the context
+        method = 'next_track' if count > 0 else 'previous_track'
+        for _ in range(abs(count)):
+            self.call(method)
+        return {}
+
+    def skip_target(self, count):
+        # URI of the track count tracks ahead if starting it in the context can replace count skips
+        if count < 2 or self.skip_context is None or self.queue_track_id != self.skip_context[1]:
+            return None
+        return self.upcoming[count - 1].get('uri') if len(self.upcoming) >= count else None
+
+    def command_play(self, uri):
+        # A track plays on its own, an album or playlist as the playback context
+        if uri.startswith('spotify:track:'):
+            self.call('start_playback', uris=[uri])
+        else:
+            self.call('start_playback', context_uri=uri)
+        return {'is_playing': True}
+
+    @pyqtSlot()
+    def stop(self):
+        self.timer.stop()
+
+
+class MprisError(Exception):
+    """
+    A D-Bus call to the media player failed.
+    """
+
+
+class MprisWorker(Worker):
+    """
+    Follow the local Spotify client over MPRIS instead of polling the Web API.
+
+    The player's PropertiesChanged and Seeked signals are turned into
+    PlaybackStates as they arrive, and playback commands go to the player
+    over D-Bus. The Web API is only called for what MPRIS lacks: the liked
+    state and queue on track changes, the recently played list, and shuffle
+    if the player does not expose it. While no player is on the session bus
+    it polls like Worker, and it switches over as soon as one appears.
+
+    MPRIS only sees the client on this machine, not playback on the
+    account's other devices.
+    """
+    object_path = '/org/mpris/MediaPlayer2'
+    player_interface = 'org.mpris.MediaPlayer2.Player'
+    properties_interface = 'org.freedesktop.DBus.Properties'
+    call_timeout_ms = 2000
+
+    def __init__(self, sp, hourly_budget=hourly_request_budget, library_path=None):
+        super().__init__(sp, hourly_budget, library_path)
+        self.bus = None
+        self.player = None  # Bus name of the player being followed, None while polling
+        self.properties = {}  # Last known org.mpris.MediaPlayer2.Player properties
+        self.sampled_at = 0.0  # Monotonic time at which the Position property was valid
+        self.shuffle_state = False  # From the Web API, for players without a Shuffle property
+
+    @staticmethod
+    def is_player(name):
+        return name == mpris_bus_name or name.startswith(mpris_bus_name + '.')
+
+    @pyqtSlot()
+    def start(self):
+        # Connects the Web API client and schedules the first poll, which attach cancels
+        super().start()
+        if self.sp is None:
+            return
+        self.bus = QtDBus.QDBusConnection.sessionBus()
+        if not self.bus.isConnected():
+            self.notice_signal.emit("No D-Bus session bus, polling the Web API instead.")
+            return
+        self.bus.connect('org.freedesktop.DBus', '/org/freedesktop/DBus', 'org.freedesktop.DBus',
+                         'NameOwnerChanged', self.handle_name_owner_changed)
+        reply = self.bus.interface().registeredServiceNames()
+        players = sorted(name for name in reply.value() if self.is_player(name)) if reply.isValid() else []
+        if players:
+            self.attach(players[0])
+
+    def attach(self, name):
+        """
+        Follow the player at bus name name from now on, instead of polling.
+        """
+        self.timer.stop()
+        self.player = name
+        self.bus.connect(name, self.object_path, self.properties_interface, 'PropertiesChanged',
+                         self.handle_properties_changed)
+        self.bus.connect(name, self.object_path, self.player_interface, 'Seeked', self.handle_seeked)
+        if 'Shuffle' not in self.read_properties():
+            try:
+                playback = self.call('current_playback')
+                self.shuffle_state = bool(playback and playback['shuffle_state'])
+            except Exception:
+                pass  # Shown as off until the next shuffle command
+        self.publish()
+
+    def detach(self):
+        self.bus.disconnect(self.player, self.object_path, self.properties_interface, 'PropertiesChanged',
+                            self.handle_properties_changed)
+        self.bus.disconnect(self.player, self.object_path, self.player_interface, 'Seeked', self.handle_seeked)
+        self.player = None
+        self.properties = {}
+
+    def dbus_call(self, interface, method, *args):
+        """
+        Call a method on the player and return the reply's arguments, raising MprisError on failure.
+        """
+        message = QtDBus.QDBusMessage.createMethodCall(self.player, self.object_path, interface, method)
+        message.setArguments(list(args))
+        reply = self.bus.call(message, QtDBus.QDBus.Block, self.call_timeout_ms)
+        if reply.type() == QtDBus.QDBusMessage.ErrorMessage:
+            raise MprisError(f"{reply.errorName()}: {reply.errorMessage()}")
+        return reply.arguments()
+
+    def read_properties(self):
+        """
+        Replace the cached properties with the player's current ones, keeping them on failure.
+        """
+        try:
+            properties = self.dbus_call(self.properties_interface, 'GetAll', self.player_interface)[0]
+        except MprisError as e:
+            self.notice_signal.emit(f"Cannot read the player's properties: {e}")
+        else:
+            self.properties = properties
+            self.sampled_at = time.monotonic()
+        return self.properties
+
+    def read_position(self):
+        # Players do not signal Position changes, they only advance in time
+        try:
+            self.properties['Position'] = self.dbus_call(self.properties_interface, 'Get', self.player_interface,
+                                                         'Position')[0]
+            self.sampled_at = time.monotonic()
+        except MprisError:
+            pass  # Keep the last position, the clock extrapolates it
+
+    def publish(self):
+        """
+        Emit the cached properties as a PlaybackState, then look up liked state and queue on track changes.
+        """
+        metadata = self.properties.get('Metadata') or {}
+        if not metadata.get('xesam:title'):
+            self.state_signal.emit(PlaybackState(track_name='No track playing', sampled_at=time.monotonic()))
+            return
+        state = PlaybackState.from_mpris(self.properties, self.liked_cache, self.shuffle_state, self.sampled_at)
+        # The track is shown first, the Web API round trip for the liked state follows
+        self.state_signal.emit(state)
+        if not state.track_id:
+            self.current_track_id = state.track_id
+            return
+        if state.track_id != self.current_track_id:
+            self.current_track_id = state.track_id
+            self.prefetch_upcoming(state.track_id)
+        elif self.liked_cache.get(state.track_id) is None:
+            self.retry_liked_lookup(state.track_id)
+        else:
+            return
+        if self.back_off_follow_up() is None and self.liked_cache.get(state.track_id) is not None:
+            # Nothing polls while a player is followed, so lookups that went through end a backoff instead
+            self.scheduler.on_success(None)
+        self.budget_signal.emit(self.scheduler.budget())
+        is_liked = self.liked_cache.get(state.track_id)
+        if is_liked is not None and is_liked != state.is_liked:
+            self.state_signal.emit(state._replace(is_liked=is_liked))
+
+    @pyqtSlot('QDBusMessage')
+    def handle_properties_changed(self, message):
+        interface, changed, invalidated = message.arguments()
+        if interface != self.player_interface:
+            return
+        if invalidated:
+            self.read_properties()
+        else:
+            self.properties.update(changed)
+            if 'Position' in changed:
+                self.sampled_at = time.monotonic()
+            else:
+                self.read_position()
+        self.publish()
+
+    @pyqtSlot('qlonglong')
+    def handle_seeked(self, position_us):
+        self.properties['Position'] = position_us
+        self.sampled_at = time.monotonic()
+        self.publish()
+
+    @pyqtSlot(str, str, str)
+    def handle_name_owner_changed(self, name, old_owner, new_owner):
+        if not self.is_player(name):
+            return
+        if new_owner and self.player is None:
+            self.attach(name)
+        elif not new_owner and name == self.player:
+            # The client quit; playback may go on elsewhere, which only the Web API sees
+            self.detach()
+            self.schedule_poll(0)
+
+    def fetch_track_data(self):
+        if self.player is None:
+            super().fetch_track_data()
+        else:
+            # Only reached through poll_soon, to confirm a command with a fresh snapshot
+            self.read_properties()
+            self.publish()
+
+    @pyqtSlot()
+    def poll_soon(self):
+        if self.player is not None and not self.timer.isActive():
+            self.schedule_poll(self.poll_soon_delay_ms)
+        else:
+            super().poll_soon()
+
+    def command_set_playing(self, is_playing):
+        if self.player is None:
+            return super().command_set_playing(is_playing)
+        self.dbus_call(self.player_interface, 'Play' if is_playing else 'Pause')
+        return {'is_playing': is_playing}
+
+    def command_set_shuffle(self, shuffle_state):
+        if self.player is None or 'Shuffle' not in self.properties:
+            # Spotify's client does not implement the optional Shuffle property
+            self.shuffle_state = shuffle_state
+            return super().command_set_shuffle(shuffle_state)
+        self.dbus_call(self.properties_interface, 'Set', self.player_interface, 'Shuffle',
+                       QtDBus.QDBusVariant(shuffle_state))
+        return {'shuffle_state': shuffle_state}
+
+    def command_skip(self, count):
+        if self.player is None:
+            return super().command_skip(count)
+        # Calls to the local player, not Web API requests, so one per track costs nothing
+        method = 'Next' if count > 0 else 'Previous'
+        for _ in range(abs(count)):
+            self.dbus_call(self.player_interface, method)
+        return {}
+
+    @pyqtSlot()
+    def stop(self):
+        if self.bus is not None:
+            self.bus.disconnect('org.freedesktop.DBus', '/org/freedesktop/DBus', 'org.freedesktop.DBus',
+                                'NameOwnerChanged', self.handle_name_owner_changed)
+            if self.player is not None:
+                self.detach()
+        super().stop()
+
+
+# Playback sources by the name used in playback_source and the display config
+playback_sources = {
+    'web': Worker,
+    'mpris': MprisWorker,
+}
+
+
+def create_worker(sp, hourly_budget=hourly_request_budget, source=None, library_path=None):
+    """
+    Build the worker for a playback source, playback_source by default, syncing the library into library_path.
+    """
+    source = source or playback_source
+    if source not in playback_sources:
+        raise ValueError(f"Unknown playback source: {source}")
+    if source == 'mpris' and QtDBus is None:
+        print("PyQt5 has no D-Bus support here, polling the Web API instead")
+        source = 'web'
+    return playback_sources[source](sp, hourly_budget, library_path)
+
+
+class WorkerPool:
+    """
+    The threads hosting the workers and token managers of every display.
+
+    Members are QObjects with start and stop slots. With a size, each is
+    moved to the thread with the fewest members, so the thread count stays
+    fixed however many accounts there are, and workers get staggered first
+    polls so that accounts sharing a thread do not poll in lockstep.
+    Without one, every member gets a thread of its own unless it is added
+    alongside another, e.g. an account's token manager next to its worker.
+    """
+
+    def __init__(self, size=poll_threads, stagger_ms=0):
+        self.size = size
+        self.threads = [QThread() for _ in range(max(size, 1))] if size is not None else []
+        self.stagger_ms = stagger_ms
+        self.members = {}  # QObject -> QThread
+        self.staggered = 0
+
+    def add(self, member, staggered=False, alongside=None):
+        if alongside in self.members:
+            thread = self.members[alongside]
+        elif self.size is None:
+            thread = QThread()
+            self.threads.append(thread)
+        else:
+            thread = min(self.threads, key=lambda t: sum(1 for other in self.members.values() if other is t))
+        if staggered:
+            member.start_delay_ms = self.staggered * self.stagger_ms
+            self.staggered += 1
+        member.moveToThread(thread)
+        self.members[member] = thread
+        if not thread.isRunning():
+            thread.start()
+        QMetaObject.invokeMethod(member, 'start', Qt.QueuedConnection)
+
+    def remove(self, member):
+        thread = self.members.pop(member, None)
+        if thread is None:
+            return
+        if thread.isRunning():
+            # Timers must be stopped from the thread that owns them
+            QMetaObject.invokeMethod(member, 'stop', Qt.BlockingQueuedConnection)
+        member.deleteLater()
+        if self.size is None and thread not in self.members.values():
+            thread.quit()
+            thread.wait()
+            self.threads.remove(thread)
+
+    def stop(self):
+        for member in list(self.members):
+            self.remove(member)
+        for thread in self.threads:
+            thread.quit()
+            thread.wait()
+
+
+@timed('art_decode_ms')
+def decode_art(data, size, thumbnail_size=palette_sample_size):
+    """
+    Decode image bytes straight to display size, plus a thumbnail for palette extraction.
+
+    Safe to call from any thread. With a scaled size set, the JPEG decoder
+    skips most of the work of a full-resolution decode. Returns
+    (image, thumbnail) as premultiplied QImages, or (None, None) for invalid data.
+    """
+    buffer = QBuffer()
+    buffer.setData(data)
+    buffer.open(QIODevice.ReadOnly)
+    reader = QImageReader(buffer)
+    reader.setQuality(100)  # Ask the decoder for smooth rather than fast scaling
+    original = reader.size()
+    if original.isValid():
+        reader.setScaledSize(original.scaled(size, size, Qt.KeepAspectRatio))
+    image = reader.read()
+    if image.isNull():
+        return None, None
+    if image.width() != size and image.height() != size:
+        # Formats whose decoder ignores the scaled size
+        image = image.scaled(size, size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+    image = image.convertToFormat(QImage.Format_ARGB32_Premultiplied)
+    thumbnail = image.scaled(thumbnail_size, thumbnail_size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+    return image, thumbnail
+
+
+class AlbumArtCache(QObject):
+    """
+    Two-tier album art cache.
+
+    Ready-to-display pixmaps are kept in a bounded in-memory LRU, and the
+    downloaded image files in a size-capped on-disk store keyed by image ID.
+    Only misses in both tiers go to the network. Reading, downloading and
+    decoding all happen on the cache's thread pool; the GUI thread only turns
+    the finished, display-sized image into a pixmap.
+    """
+    art_ready_signal = pyqtSignal(str, QPixmap)
+    art_error_signal = pyqtSignal(str, str)
+    # Emitted from the pool threads, delivered to the cache on the GUI thread
+    load_done_signal = pyqtSignal(str, str, int, QImage, QImage)  # Image ID, URL, bytes downloaded, image, thumbnail
+    load_failed_signal = pyqtSignal(str, str, str)
+    load_cancelled_signal = pyqtSignal(str)
+
+    def __init__(self, transport, directory=None, max_entries=album_art_memory_entries,
+                 max_disk_bytes=album_art_disk_bytes, size=album_art_size, download=True, parent=None):
+        super().__init__(parent)
+        self.transport = transport
+        self.download = download  # False when a playback daemon downloads the files (see add_file)
+        self.directory = directory or os.path.join(cache_dir, 'album_art')
+        self.max_entries = max_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.size = size
+        self.pixmaps = OrderedDict()  # Image ID -> scaled QPixmap, most recently used last
+        self.thumbnails = {}  # Image ID -> small QImage for palette extraction, evicted with its pixmap
+        self.pending = {}  # Image ID -> queued or running ArtLoadTask
+        self.wanted = {}  # Owner -> URLs it still needs, when several displays share the cache
+        self.stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0, 'cancelled': 0,
+                      'bytes_downloaded': 0}
+
+        os.makedirs(self.directory, exist_ok=True)
+        self.disk_usage = sum(entry.stat().st_size for entry in os.scandir(self.directory) if entry.is_file())
+
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(art_download_threads)
+        self.load_done_signal.connect(self.handle_load_done)
+        self.load_failed_signal.connect(self.handle_load_failed)
+        self.load_cancelled_signal.connect(self.handle_load_cancelled)
+
+    @staticmethod
+    def image_id(url):
+        """
+        Derive a file-safe cache key from an album art URL.
+        """
+        image_id = url.rstrip('/').rsplit('/', 1)[-1]
+        if re.fullmatch(r'[A-Za-z0-9_-]{1,128}', image_id):
+            return image_id
+        return hashlib.sha1(url.encode('utf-8')).hexdigest()
+
+    def path(self, image_id):
+        return os.path.join(self.directory, image_id)
+
+    def request(self, url):
+        """
+        Return the pixmap for url if it is in memory, otherwise start loading it
+        from disk or the network.
+
+        Loaded images are announced through art_ready_signal.
+        """
+        image_id = self.image_id(url)
+
+        pixmap = self.pixmaps.get(image_id)
+        if pixmap is not None:
+            self.pixmaps.move_to_end(image_id)
+            self.stats['memory_hits'] += 1
+            return pixmap
+
+        task = self.pending.get(image_id)
+        if task is None:
+            self.start_load(ArtLoadTask(self, image_id, url))
+        else:
+            task.cancelled = False  # Wanted again before the load gave up
+        return None
+
+    def thumbnail(self, url, pixmap):
+        """
+        Return the small image palettes are extracted from, falling back to the pixmap itself.
+        """
+        thumbnail = self.thumbnails.get(self.image_id(url))
+        return thumbnail if thumbnail is not None else pixmap.toImage()
+
+    def add_file(self, url, path):
+        """
+        Announce an image that another process, the playback daemon, stored on disk.
+        """
+        image_id = self.image_id(url)
+        pixmap = self.pixmaps.get(image_id)
+        if pixmap is not None:
+            self.art_ready_signal.emit(url, pixmap)
+        else:
+            self.start_load(ArtLoadTask(self, image_id, url, path))
+
+    def start_load(self, task):
+        self.pending[task.image_id] = task
+        self.pool.start(task)
+
+    def cancel_stale(self, keep_urls, owner=None):
+        """
+        Abandon downloads whose URL is no longer wanted, e.g. after a track change.
+
+        With a shared cache every display passes itself as owner, and only
+        URLs that no owner wants any more are cancelled.
+        """
+        self.wanted[owner] = set(keep_urls)
+        self.cancel_unwanted()
+
+    def release(self, owner):
+        """
+        Forget the URLs a closed display wanted and cancel the downloads nobody else needs.
+        """
+        self.wanted.pop(owner, None)
+        self.cancel_unwanted()
+
+    def cancel_unwanted(self):
+        keep_urls = set().union(*self.wanted.values())
+        for image_id, task in list(self.pending.items()):
+            if task.url not in keep_urls:
+                task.cancelled = True
+                if self.pool.tryTake(task):
+                    # Never started, so no signal will come back for it
+                    del self.pending[image_id]
+
+    def handle_load_done(self, image_id, url, downloaded, image, thumbnail):
+        self.pending.pop(image_id, None)
+        if downloaded:
+            self.stats['misses'] += 1
+            self.stats['bytes_downloaded'] += downloaded
+            self.disk_usage += downloaded
+            if self.disk_usage > self.max_disk_bytes:
+                self.evict_disk()
+        else:
+            self.stats['disk_hits'] += 1
+        pixmap = QPixmap.fromImage(image)
+        self.pixmaps[image_id] = pixmap
+        self.thumbnails[image_id] = thumbnail
+        while len(self.pixmaps) > self.max_entries:
+            evicted, _ = self.pixmaps.popitem(last=False)
+            self.thumbnails.pop(evicted, None)
+        self.art_ready_signal.emit(url, pixmap)
+
+    def handle_load_failed(self, image_id, url, error_message):
+        self.pending.pop(image_id, None)
+        self.art_error_signal.emit(url, error_message)
+
+    def handle_load_cancelled(self, image_id):
+        self.pending.pop(image_id, None)
+        self.stats['cancelled'] += 1
+
+    def stop(self):
+        for task in self.pending.values():
+            task.cancelled = True
+        self.pool.clear()
+        self.pool.waitForDone()
+
+    def write_file(self, image_id, data):
+        """
+        Store downloaded image bytes; called from the pool threads.
+        """
+        path = self.path(image_id)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+    def remove_from_disk(self, image_id):
+        try:
+            size = os.path.getsize(self.path(image_id))
+            os.remove(self.path(image_id))
+        except OSError:
+            return
+        self.disk_usage -= size
+
+    def evict_disk(self):
+        """
+        Delete the least recently used files until the store fits its size cap.
+        """
+        entries = sorted((entry for entry in os.scandir(self.directory) if entry.is_file()),
+                         key=lambda entry: entry.stat().st_mtime)
+        self.disk_usage = sum(entry.stat().st_size for entry in entries)
+        for entry in entries:
+            if self.disk_usage <= self.max_disk_bytes:
+                break
+            self.remove_from_disk(entry.name)
+            self.stats['evictions'] += 1
+
+
+class ArtLoadTask(QRunnable):
+    """
+    Load one album art image from the disk cache, or download it, and decode it at display size.
+    """
+
+    def __init__(self, cache, image_id, url, path=None):
+        super().__init__()
+        # The cache keeps a reference so the task can still be cancelled or taken back from the pool
+        self.setAutoDelete(False)
+        self.cache = cache
+        self.image_id = image_id
+        self.url = url
+        self.path = path or cache.path(image_id)
+        self.cancelled = False
+
+    def read_cached(self):
+        """
+        Return the decoded cached file, or None when there is none or it is corrupt.
+        """
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        image, thumbnail = decode_art(data, self.cache.size)
+        if image is None:
+            # Corrupt file, drop it so it gets downloaded again
+            with contextlib.suppress(OSError):
+                os.remove(self.path)
+            return None
+        with contextlib.suppress(OSError):
+            os.utime(self.path)  # Refresh the modification time used for LRU eviction
+        return image, thumbnail
+
+    def run(self):
+        try:
+            if self.cancelled:
+                raise DownloadCancelled(self.url)
+            downloaded = 0
+            decoded = self.read_cached()
+            if decoded is None:
+                if not self.cache.download:
+                    # The playback daemon announces the file once it has downloaded it
+                    raise DownloadCancelled(self.url)
+                data = self.cache.transport.fetch(self.url, lambda: self.cancelled)
+                decoded = decode_art(data, self.cache.size)
+                if decoded[0] is None:
+                    raise ValueError("Invalid image data")
+                with contextlib.suppress(OSError):
+                    self.cache.write_file(self.image_id, data)
+                downloaded = len(data)
+        except DownloadCancelled:
+            self.cache.load_cancelled_signal.emit(self.image_id)
+        except Exception as e:
+            self.cache.load_failed_signal.emit(self.image_id, self.url, str(e))
+        else:
+            self.cache.load_done_signal.emit(self.image_id, self.url, downloaded, *decoded)
+
+
+class ArtPrefetcher(QObject):
+    """
+    Warm the album art cache for upcoming tracks in the background.
+
+    Downloads are limited to max_concurrent at a time and paced so that the
+    average rate stays under max_kbps.
+    """
+    # Emitted for every prefetched image that is now in the memory cache
+    prefetched_signal = pyqtSignal(str, QPixmap)
+
+    def __init__(self, art_cache, max_concurrent=prefetch_max_concurrent, max_kbps=prefetch_max_kbps, parent=None):
+        super().__init__(parent)
+        self.art_cache = art_cache
+        self.max_concurrent = max_concurrent
+        self.max_kbps = max_kbps
+        self.waiting = []  # URLs still to prefetch, in queue order
+        self.active = set()  # URLs being downloaded
+        self.bytes_seen = art_cache.stats['bytes_downloaded']
+        self.art_cache.art_ready_signal.connect(self.handle_ready)
+        self.art_cache.art_error_signal.connect(self.handle_error)
+
+        self.pace_timer = QTimer(self)
+        self.pace_timer.setSingleShot(True)
+        self.pace_timer.timeout.connect(self.pump)
+
+    def prefetch(self, urls):
+        """
+        Replace the pending prefetch list with urls.
+        """
+        self.waiting = [url for url in urls if url not in self.active]
+        if not self.pace_timer.isActive():
+            self.pump()
+
+    def pump(self):
+        while self.waiting and len(self.active) < self.max_concurrent:
+            url = self.waiting.pop(0)
+            pixmap = self.art_cache.request(url)
+            if pixmap is not None:
+                self.prefetched_signal.emit(url, pixmap)
+            else:
+                self.active.add(url)
+
+    def handle_ready(self, url, pixmap):
+        if url in self.active:
+            self.prefetched_signal.emit(url, pixmap)
+            self.finish(url)
+
+    def handle_error(self, url, error_message):
+        if url in self.active:
+            self.finish(url)
+
+    def finish(self, url):
+        self.active.discard(url)
+
+        # Pace the next download by the bytes fetched since the previous one
+        downloaded = self.art_cache.stats['bytes_downloaded'] - self.bytes_seen
+        self.bytes_seen = self.art_cache.stats['bytes_downloaded']
+        delay = int(downloaded * 8 / self.max_kbps) if self.max_kbps else 0  # kbit/s == bit/ms
+        self.pace_timer.start(delay)
+
+
+def image_array(image):
+    """
+    Return a zero-copy (height, width, 3) RGB NumPy view of a QImage.
+
+    The returned array is only valid while the converted image is alive, so
+    the image is returned alongside it.
+    """
+    image = image.convertToFormat(QImage.Format_RGB32)
+    width, height = image.width(), image.height()
+    bits = image.constBits()
+    bits.setsize(image.bytesPerLine() * height)
+    pixels = np.frombuffer(bits, dtype=np.uint8).reshape(height, image.bytesPerLine())
+    pixels = pixels[:, :width * 4].reshape(height, width, 4)
+    # Format_RGB32 is stored as 0xffRRGGBB, i.e. B, G, R, A on little-endian machines
+    if sys.byteorder == 'little':
+        return pixels[..., 2::-1], image
+    return pixels[..., 1:], image
+
+
+def relative_luminance(rgb):
+    """
+    WCAG relative luminance of an (..., 3) array of 0-255 RGB values.
+    """
+    channels = np.asarray(rgb, dtype=np.float64) / 255
+    linear = np.where(channels <= 0.03928, channels / 12.92, ((channels + 0.055) / 1.055) ** 2.4)
+    return linear @ np.array([0.2126, 0.7152, 0.0722])
+
+
+def contrast_ratio(color_a, color_b):
+    """
+    WCAG contrast ratio between two QColors, from 1 to 21.
+    """
+    luminances = relative_luminance([[color_a.red(), color_a.green(), color_a.blue()],
+                                     [color_b.red(), color_b.green(), color_b.blue()]])
+    lighter, darker = max(luminances), min(luminances)
+    return (lighter + 0.05) / (darker + 0.05)
+
+
+def extract_palette(image, clusters=palette_clusters, sample_size=palette_sample_size, iterations=8):
+    """
+    Pick background, accent and text colors from album art.
+
+    The image is downsampled, seeded with the most common colors of a coarse
+    histogram and refined with a few vectorized k-means iterations. The
+    largest cluster becomes the background; text colors are checked against
+    it for WCAG contrast.
+    """
+    pixels, image = image_array(image)
+    step = max(1, max(pixels.shape[:2]) // sample_size)
+    samples = pixels[::step, ::step].reshape(-1, 3).astype(np.float32)
+
+    # Seed the clusters with the most frequent colors of a 16x16x16 histogram
+    quantized = samples.astype(np.int32) // 16
+    bins = quantized[:, 0] * 256 + quantized[:, 1] * 16 + quantized[:, 2]
+    histogram = np.bincount(bins, minlength=4096)
+    seeds = np.argsort(histogram)[::-1][:clusters]
+    seeds = seeds[histogram[seeds] > 0]
+    centers = np.stack([seeds // 256, seeds // 16 % 16, seeds % 16], axis=1).astype(np.float32) * 16 + 8
+
+    for _ in range(iterations):
+        distances = ((samples[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2)
+        labels = distances.argmin(axis=1)
+        counts = np.bincount(labels, minlength=len(centers))
+        sums = np.stack([np.bincount(labels, weights=samples[:, channel], minlength=len(centers))
+                         for channel in range(3)], axis=1)
+        filled = counts > 0
+        centers[filled] = sums[filled] / counts[filled, None]
+
+    colors = [QColor(*(int(round(value)) for value in center)) for center in centers]
+    weights = counts / counts.sum()
+
+    # The most common color is the background
+    background = colors[int(weights.argmax())]
+
+    # The accent is the most saturated, reasonably common color that stands out from the background
+    accent = None
+    best_score = 0
+    for color, weight in zip(colors, weights):
+        score = color.hsvSaturationF() * color.valueF() * np.sqrt(weight)
+        if color != background and contrast_ratio(color, background) >= 1.5 and score > best_score:
+            accent, best_score = color, score
+    if accent is None:
+        accent = background.lighter(150) if background.lightness() < 128 else background.darker(150)
+
+    # Panels keep the original shading: the content panel is toned down, the bottom panel darker still
+    top = background.lighter(60)
+    bottom = background.darker(300)
+
+    def readable(candidates, minimum):
+        for candidate in candidates:
+            if contrast_ratio(candidate, top) >= minimum:
+                return candidate
+        return max(candidates, key=lambda candidate: contrast_ratio(candidate, top))
+
+    white, black = QColor('#FFFFFF'), QColor('#121212')
+    text = readable([white, black], 4.5)
+    secondary = readable([accent, QColor('#B3B3B3'), QColor('#404040')], 3.0)
+
+    return {
+        'top': top.name(),
+        'bottom': bottom.name(),
+        'accent': accent.name(),
+        'text': text.name(),
+        'secondary': secondary.name(),
+    }
+
+
+class PaletteTask(QRunnable):
+    """
+    Run extract_palette for one album on the palette engine's thread pool.
+    """
+
+    def __init__(self, engine, url, image):
+        super().__init__()
+        self.engine = engine
+        self.url = url
+        self.image = image
+
+    @timed('palette_extract_ms')
+    def run(self):
+        try:
+            theme = extract_palette(self.image)
+        except Exception as e:
+            self.engine.task_failed_signal.emit(self.url, str(e))
+        else:
+            self.engine.task_done_signal.emit(self.url, theme)
+
+
+class PaletteEngine(QObject):
+    """
+    Extract album palettes off the GUI thread and memoize them per album URL.
+    """
+    palette_ready_signal = pyqtSignal(str, dict)
+    # Emitted from worker threads, delivered to the engine on the GUI thread
+    task_done_signal = pyqtSignal(str, dict)
+    task_failed_signal = pyqtSignal(str, str)
+
+    def __init__(self, max_entries=album_art_memory_entries, parent=None):
+        super().__init__(parent)
+        self.max_entries = max_entries
+        self.palettes = OrderedDict()  # Album art URL -> theme colors
+        self.pending = set()
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(1)
+        self.task_done_signal.connect(self.handle_task_done)
+        self.task_failed_signal.connect(self.handle_task_failed)
+
+    def request(self, url, image):
+        """
+        Return the memoized palette for url, or start extracting it from image
+        (ideally the art cache's thumbnail) and return None.
+        """
+        palette = self.palettes.get(url)
+        if palette is not None:
+            self.palettes.move_to_end(url)
+            return palette
+        if url not in self.pending:
+            self.pending.add(url)
+            self.pool.start(PaletteTask(self, url, image))
+        return None
+
+    def handle_task_done(self, url, palette):
+        self.pending.discard(url)
+        self.add(url, palette)
+
+    def add(self, url, palette):
+        """
+        Memoize and announce a palette, whether extracted here or received from the playback daemon.
+        """
+        self.palettes[url] = palette
+        while len(self.palettes) > self.max_entries:
+            self.palettes.popitem(last=False)
+        self.palette_ready_signal.emit(url, palette)
+
+    def handle_task_failed(self, url, error_message):
+        self.pending.discard(url)
+
+    def stop(self):
+        self.pool.clear()
+        self.pool.waitForDone()
+
+
+def set_text_color(widget, color):
+    """
+    Change a widget's text color through its QPalette instead of a stylesheet.
+    """
+    palette = widget.palette()
+    if palette.color(QPalette.WindowText) != color:
+        palette.setColor(QPalette.WindowText, color)
+        widget.setPalette(palette)
+
+
+class ThemedPanel(QWidget):
+    """
+    Panel that paints its own background color with optionally rounded corners.
+
+    The rounded outline is cached and only rebuilt on resize, and changing
+    the color just schedules a repaint, without any stylesheet polish.
+    """
+
+    def __init__(self, parent=None, top_radius=0, bottom_radius=0):
+        super().__init__(parent)
+        self.top_radius = top_radius
+        self.bottom_radius = bottom_radius
+        self.color = QColor(Qt.transparent)
+        self.path = QPainterPath()
+
+    def set_color(self, color):
+        if color != self.color:
+            self.color = QColor(color)
+            self.update()
+
+    def resizeEvent(self, event):
+        self.path = self.rounded_path(self.width(), self.height())
+        super().resizeEvent(event)
+
+    def rounded_path(self, width, height):
+        top, bottom = self.top_radius, self.bottom_radius
+        path = QPainterPath()
+        path.moveTo(0, top)
+        if top:
+            path.arcTo(0, 0, 2 * top, 2 * top, 180, -90)
+        path.lineTo(width - top, 0)
+        if top:
+            path.arcTo(width - 2 * top, 0, 2 * top, 2 * top, 90, -90)
+        path.lineTo(width, height - bottom)
+        if bottom:
+            path.arcTo(width - 2 * bottom, height - 2 * bottom, 2 * bottom, 2 * bottom, 0, -90)
+        path.lineTo(bottom, height)
+        if bottom:
+            path.arcTo(0, height - 2 * bottom, 2 * bottom, 2 * bottom, 270, -90)
+        path.closeSubpath()
+        return path
+
+    def paintEvent(self, event):
+        metrics.inc('repaints_total', widget=self.objectName() or 'panel')
+        if self.color.alpha() == 0:
+            return
+        painter = QPainter(self)
+        if self.top_radius or self.bottom_radius:
+            painter.setRenderHint(QPainter.Antialiasing)
+            painter.fillPath(self.path, self.color)
+        else:
+            painter.fillRect(event.rect(), self.color)
+
+
+class ThemeTransition(QObject):
+    """
+    Blend from one theme to the next in a fixed number of frames.
+
+    apply is called with an intermediate theme on every frame; with a
+    duration of 0 the target theme is applied straight away.
+    """
+
+    def __init__(self, apply, duration_ms=theme_transition_ms, fps=theme_transition_fps, parent=None):
+        super().__init__(parent)
+        self.apply = apply
+        self.frame_count = max(1, duration_ms * fps // 1000)
+        self.enabled = duration_ms > 0
+        self.current = None  # Theme currently on screen
+        self.start_theme = self.end_theme = None
+        self.frame = 0
+        self.timer = QTimer(self)
+        self.timer.setInterval(1000 // fps)
+        self.timer.timeout.connect(self.step)
+
+    def start(self, theme, animate=True):
+        if not animate or not self.enabled or self.current is None:
+            self.timer.stop()
+            self.show(theme)
+            return
+        self.start_theme = self.current
+        self.end_theme = theme
+        self.frame = 0
+        self.timer.start()
+
+    def step(self):
+        self.frame += 1
+        if self.frame >= self.frame_count:
+            self.timer.stop()
+            self.show(self.end_theme)
+            return
+        t = self.frame / self.frame_count
+        self.show({key: self.blend(self.start_theme[key], value, t) for key, value in self.end_theme.items()})
+
+    def finish(self):
+        """
+        Jump straight to the end of a running transition.
+        """
+        if self.timer.isActive():
+            self.timer.stop()
+            self.show(self.end_theme)
+
+    @staticmethod
+    def blend(start, end, t):
+        start, end = QColor(start), QColor(end)
+        return QColor(
+            round(start.red() + (end.red() - start.red()) * t),
+            round(start.green() + (end.green() - start.green()) * t),
+            round(start.blue() + (end.blue() - start.blue()) * t),
+        ).name()
+
+    def show(self, theme):
+        self.current = theme
+        self.apply(theme)
+
+
+class PlaybackClock:
+    """
+    Extrapolate the playback position between polls from the last snapshot.
+
+    Small disagreements between a new snapshot and the running clock are
+    ignored so that polling noise does not make the position jitter.
+    """
+
+    def __init__(self, tolerance_ms=300):
+        self.tolerance_ms = tolerance_ms
+        self.progress_ms = 0
+        self.duration_ms = 0
+        self.is_playing = False
+        self.anchor = time.monotonic()  # Monotonic time at which progress_ms was valid
+
+    def position_ms(self, now=None):
+        if not self.is_playing:
+            return self.progress_ms
+        now = time.monotonic() if now is None else now
+        return int(min(self.progress_ms + (now - self.anchor) * 1000, self.duration_ms))
+
+    def sync(self, progress_ms, duration_ms, is_playing, sampled_at):
+        """
+        Re-anchor the clock on a new snapshot.
+        """
+        now = time.monotonic()
+        reported_ms = progress_ms + (now - sampled_at) * 1000 if is_playing else progress_ms
+        if (is_playing and self.is_playing and duration_ms == self.duration_ms
+                and abs(reported_ms - self.position_ms(now)) < self.tolerance_ms):
+            return
+        self.progress_ms = progress_ms
+        self.duration_ms = duration_ms
+        self.is_playing = is_playing
+        self.anchor = sampled_at
+
+    def set_playing(self, is_playing):
+        """
+        Start or stop the clock at the current position, e.g. after play/pause.
+        """
+        now = time.monotonic()
+        self.progress_ms = self.position_ms(now)
+        self.anchor = now
+        self.is_playing = is_playing
+
+
+class ProgressWidget(QWidget):
+    """
+    Slim progress bar that only repaints the strip between the old and new fill edge.
+    """
+
+    def __init__(self, parent=None, color=QColor('white'), background=QColor('#505050')):
+        super().__init__(parent)
+        self.color = color
+        self.background = background
+        self.fraction = 0.0
+        self.fill_width = 0
+
+    def set_fraction(self, fraction):
+        fraction = min(max(fraction, 0.0), 1.0)
+        self.fraction = fraction
+        fill_width = round(self.width() * fraction)
+        if fill_width == self.fill_width:
+            return
+        # Repaint just the strip that changed, plus the rounded cap
+        left = min(fill_width, self.fill_width) - self.height()
+        right = max(fill_width, self.fill_width) + self.height()
+        self.fill_width = fill_width
+        self.update(QRect(left, 0, right - left, self.height()))
+
+    def resizeEvent(self, event):
+        self.fill_width = round(self.width() * self.fraction)
+        super().resizeEvent(event)
+
+    def paintEvent(self, event):
+        metrics.inc('repaints_total', widget='progress')
+        painter = QPainter(self)
+        painter.setRenderHint(QPainter.Antialiasing)
+        painter.setPen(Qt.NoPen)
+        painter.setClipRect(event.rect())
+        radius = self.height() / 2
+        painter.setBrush(self.background)
+        painter.drawRoundedRect(self.rect(), radius, radius)
+        if self.fill_width:
+            painter.setBrush(self.color)
+            painter.drawRoundedRect(QRect(0, 0, self.fill_width, self.height()), radius, radius)
+
+
+def format_time(ms):
+    return f"{ms // 1000 // 60:02}:{ms // 1000 % 60:02}"
+
+
+class PlaybackState(NamedTuple):
+    """
+    Everything the window displays about playback, as plain comparable values.
+    """
+    track_id: str = None
+    album_url: str = None
+    album_name: str = ''
+    track_name: str = ''
+    artist_name: str = ''
+    current_time: str = '00:00'  # Only shown when there is no track; otherwise the clock drives it
+    end_time: str = '00:00'
+    progress_ms: int = 0
+    duration_ms: int = 0
+    is_playing: bool = False
+    is_liked: bool = False
+    shuffle_state: bool = False
+    sampled_at: float = 0.0  # Monotonic time at which progress_ms was valid
+
+    @classmethod
+    def from_track(cls, current_track):
+        """
+        Build the view state from a current_playback response.
+        """
+        item = current_track['item']
+        progress_ms = current_track['progress_ms'] or 0
+        return cls(
+            # Local files cannot be liked
+            track_id=None if item['is_local'] else item['id'],
+            album_url=item['album']['images'][0]['url'] if item['album']['images'] else None,
+            album_name=item['album']['name'],
+            track_name=item['name'],
+            artist_name=item['artists'][0]['name'],
+            end_time=format_time(item['duration_ms']),
+            progress_ms=progress_ms,
+            duration_ms=item['duration_ms'],
+            is_playing=current_track['is_playing'],
+            is_liked=current_track['is_liked'],
+            shuffle_state=current_track['shuffle_state'],
+            sampled_at=current_track.get('sampled_at') or time.monotonic(),
+        )
+
+    @classmethod
+    def from_mpris(cls, properties, liked_cache, shuffle_state, sampled_at):
+        """
+        Build the view state from MPRIS player properties, whose times are in microseconds.
+        """
+        metadata = properties.get('Metadata') or {}
+        # Spotify reports spotify:track:<id> or /com/spotify/track/<id>; ads and local files have no ID
+        track_path = metadata.get('mpris:trackid') or ''
+        track_path = track_path.path() if hasattr(track_path, 'path') else str(track_path)
+        match = re.search(r'(?:spotify:|/com/spotify/)track[:/](\w+)$', track_path)
+        track_id = match.group(1) if match else None
+        # Older clients link art on open.spotify.com, the Web API and the art cache use i.scdn.co
+        album_url = (metadata.get('mpris:artUrl') or '').replace('https://open.spotify.com/image/',
+                                                                  'https://i.scdn.co/image/')
+        artists = metadata.get('xesam:artist') or ['']
+        duration_ms = int(metadata.get('mpris:length') or 0) // 1000
+        return cls(
+            track_id=track_id,
+            album_url=album_url or None,
+            album_name=metadata.get('xesam:album') or '',
+            track_name=metadata.get('xesam:title') or '',
+            artist_name=artists[0] if isinstance(artists, list) else str(artists),
+            end_time=format_time(duration_ms),
+            progress_ms=min(int(properties.get('Position') or 0) // 1000, duration_ms),
+            duration_ms=duration_ms,
+            is_playing=properties.get('PlaybackStatus') == 'Playing',
+            is_liked=bool(liked_cache.get(track_id)),
+            shuffle_state=bool(properties.get('Shuffle', shuffle_state)),
+            sampled_at=sampled_at,
+        )
+
+
+class TrackRow(NamedTuple):
+    """
+    One row of the track list, reduced to what the delegate paints.
+    """
+    track_id: str = None
+    name: str = ''
+    artist_name: str = ''
+    thumbnail_url: str = None
+    played_at: str = None  # Only set for recently played tracks
+    uri: str = None
+
+    @classmethod
+    def from_track(cls, track):
+        images = track['album']['images']
+        return cls(
+            track_id=track.get('id'),
+            uri=track.get('uri'),
+            name=track['name'],
+            artist_name=', '.join(artist['name'] for artist in track['artists']),
+            # Spotify lists the sizes largest first; the smallest is plenty for a thumbnail
+            thumbnail_url=images[-1]['url'] if images else None,
+            played_at=track.get('played_at'),
+        )
+
+
+class IconCache:
+    """
+    Render every button icon state once, so switching icons never re-renders a glyph.
+    """
+    icon_specs = {
+        'play': ('fa.play', 'white'),
+        'pause': ('fa.pause', 'white'),
+        'heart': ('fa.heart', 'red'),
+        'heart-o': ('fa.heart-o', 'white'),
+        'random': ('fa.random', 'white'),
+        'random-on': ('fa.random', 'green'),
+        'step-backward': ('fa.step-backward', 'white'),
+        'step-forward': ('fa.step-forward', 'white'),
+        'list': ('fa.list-ul', 'white'),
+    }
+
+    def __init__(self, size=QSize(30, 30)):
+        self.icons = {}
+        for name, (glyph, color) in self.icon_specs.items():
+            self.icons[name] = QIcon(qta.icon(glyph, color=color).pixmap(size))
+
+    def __getitem__(self, name):
+        return self.icons[name]
+
+
+class TrackListModel(QAbstractListModel):
+    """
+    The up-next or recently-played tracks, for a QListView.
+
+    The view only asks for the data of the rows it paints, so thumbnails are
+    requested from thumbnail_cache for visible rows only. When the view
+    scrolls near the end, fetchMore asks for the next page through
+    fetch_requested_signal; pages come back through add_page. A failed
+    fetch is retried with exponential backoff, after which the next
+    scroll tries again.
+    """
+    fetch_requested_signal = pyqtSignal(object)  # Cursor of the page, None for the newest
+    ArtistRole = Qt.UserRole
+
+    retry_ms = 2000  # Doubled after every failure in a row
+    max_retries = 5
+
+    def __init__(self, thumbnail_cache, parent=None):
+        super().__init__(parent)
+        self.thumbnail_cache = thumbnail_cache
+        self.rows = []
+        self.rows_by_url = {}  # Thumbnail URL -> indexes of the rows showing it
+        self.cursor = None  # Cursor of the next older page, None when there is none
+        self.fetching = False
+        self.requested = None  # Cursor of the last fetch, retried if it fails
+        self.failures = 0
+        self.retry_timer = QTimer(self)
+        self.retry_timer.setSingleShot(True)
+        self.retry_timer.timeout.connect(self.retry)
+        self.thumbnail_cache.art_ready_signal.connect(self.handle_thumbnail_ready)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def data(self, index, role=Qt.DisplayRole):
+        row = self.rows[index.row()]
+        if role == Qt.DisplayRole:
+            return row.name
+        if role == self.ArtistRole:
+            return row.artist_name
+        if role == Qt.DecorationRole and row.thumbnail_url:
+            return self.thumbnail_cache.request(row.thumbnail_url)
+        return None
+
+    def canFetchMore(self, parent=QModelIndex()):
+        # While a retry is pending, scrolling does not fetch on top of it
+        return (not parent.isValid() and self.cursor is not None and not self.fetching
+                and not self.retry_timer.isActive())
+
+    def fetchMore(self, parent=QModelIndex()):
+        self.fetch(self.cursor)
+
+    def refresh(self):
+        """
+        Fetch the newest page, e.g. after a track change; add_page merges it in on top.
+        """
+        if not self.fetching:
+            self.fetch(None)
+
+    def fetch(self, cursor):
+        self.fetching = True
+        self.requested = cursor
+        self.retry_timer.stop()
+        self.fetch_requested_signal.emit(cursor)
+
+    def set_tracks(self, tracks):
+        self.set_rows([TrackRow.from_track(track) for track in tracks])
+
+    def set_rows(self, rows):
+        if rows == self.rows:
+            return
+        self.beginResetModel()
+        self.rows = rows
+        self.index_urls()
+        self.endResetModel()
+
+    def add_page(self, tracks, before, cursor):
+        """
+        Add a page fetched for the cursor before, and remember cursor for the next one.
+        """
+        self.fetching = False
+        self.failures = 0
+        rows = [TrackRow.from_track(track) for track in tracks]
+        if before is not None:
+            position = len(self.rows)
+            self.cursor = cursor
+        else:
+            # The newest page: only what was played since the last refresh is new
+            position = 0
+            if self.rows:
+                rows = list(itertools.takewhile(lambda row: row.played_at != self.rows[0].played_at, rows))
+            else:
+                self.cursor = cursor
+        if not rows:
+            return
+        self.beginInsertRows(QModelIndex(), position, position + len(rows) - 1)
+        self.rows[position:position] = rows
+        self.index_urls()
+        self.endInsertRows()
+
+    def fetch_failed(self):
+        self.fetching = False
+        self.failures += 1
+        if self.failures <= self.max_retries:
+            self.retry_timer.start(self.retry_ms * 2 ** (self.failures - 1))
+
+    def retry(self):
+        if not self.fetching:
+            self.fetch(self.requested)
+
+    def index_urls(self):
+        self.rows_by_url = {}
+        for i, row in enumerate(self.rows):
+            self.rows_by_url.setdefault(row.thumbnail_url, []).append(i)
+
+    def visible_urls(self, first, last):
+        return {row.thumbnail_url for row in self.rows[first:last + 1] if row.thumbnail_url}
+
+    def handle_thumbnail_ready(self, url, pixmap):
+        rows = self.rows_by_url.get(url)
+        if rows:
+            self.dataChanged.emit(self.index(rows[0]), self.index(rows[-1]), [Qt.DecorationRole])
+
+
+class TrackDelegate(QStyledItemDelegate):
+    """
+    Paint a track row, thumbnail, title and artist, straight from the model.
+
+    There are no widgets per row: the view reuses the delegate for every
+    visible row, and all rows have the same height.
+    """
+    padding = 4
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.title_font = QFont('Arial Rounded MT Bold', 11)
+        self.artist_font = QFont('Arial Rounded MT Bold', 9)
+        self.title_metrics = QFontMetrics(self.title_font)
+        self.artist_metrics = QFontMetrics(self.artist_font)
+        self.text_color = QColor('white')
+        self.secondary_color = QColor('#B3B3B3')
+        self.placeholder_color = QColor(255, 255, 255, 30)
+        self.selection_color = QColor(255, 255, 255, 25)
+        self.row_height = track_thumbnail_size + 2 * self.padding
+
+    def set_colors(self, text, secondary):
+        self.text_color = QColor(text)
+        self.secondary_color = QColor(secondary)
+
+    def sizeHint(self, option, index):
+        return QSize(option.rect.width(), self.row_height)
+
+    def paint(self, painter, option, index):
+        rect = option.rect
+        if option.state & QStyle.State_Selected:
+            painter.fillRect(rect, self.selection_color)
+        thumbnail = QRect(rect.left() + self.padding, rect.top() + self.padding,
+                          track_thumbnail_size, track_thumbnail_size)
+        pixmap = index.data(Qt.DecorationRole)
+        if pixmap is not None:
+            # Decoded at thumbnail size, so it is drawn without scaling
+            painter.drawPixmap(thumbnail.topLeft(), pixmap)
+        else:
+            painter.fillRect(thumbnail, self.placeholder_color)
+
+        left = thumbnail.right() + 2 * self.padding
+        width = rect.right() - left - self.padding
+        half = track_thumbnail_size // 2
+        painter.setFont(self.title_font)
+        painter.setPen(self.text_color)
+        painter.drawText(QRect(left, thumbnail.top(), width, half), Qt.AlignLeft | Qt.AlignVCenter,
+                         self.title_metrics.elidedText(index.data(Qt.DisplayRole), Qt.ElideRight, width))
+        painter.setFont(self.artist_font)
+        painter.setPen(self.secondary_color)
+        painter.drawText(QRect(left, thumbnail.top() + half, width, half), Qt.AlignLeft | Qt.AlignVCenter,
+                         self.artist_metrics.elidedText(index.data(TrackListModel.ArtistRole), Qt.ElideRight, width))
+
+
+class TrackListPanel(QWidget):
+    """
+    The up-next and recently-played lists, switched with two tabs above one list view.
+
+    Thumbnails that are still loading for rows scrolled out of view are
+    cancelled once scrolling pauses.
+    """
+
+    def __init__(self, thumbnail_cache, parent=None):
+        super().__init__(parent)
+        self.thumbnail_cache = thumbnail_cache
+        self.queue_model = TrackListModel(thumbnail_cache, self)
+        self.recent_model = TrackListModel(thumbnail_cache, self)
+        self.recent_stale = True  # Refresh recently played the next time it is shown
+        self.setFixedWidth(track_list_width)
+
+        self.tabs_layout = QHBoxLayout()
+        self.tabs_layout.setSpacing(6)
+        self.tab_group = QButtonGroup(self)
+        for tab_id, title in enumerate(['Up next', 'Recently played']):
+            tab = QPushButton(title, self)
+            tab.setCheckable(True)
+            tab.setFont(QFont('Arial Rounded MT Bold', 10))
+            tab.setStyleSheet("background-color: transparent; border: none; padding: 2px 6px;")
+            self.tab_group.addButton(tab, tab_id)
+            self.tabs_layout.addWidget(tab)
+        self.tabs_layout.addStretch()
+        self.tab_group.button(0).setChecked(True)
+        self.tab_group.buttonClicked[int].connect(self.show_tab)
+        self.text_color = QColor('white')
+        self.secondary_color = QColor('#B3B3B3')
+        self.update_tab_colors()
+
+        self.delegate = TrackDelegate(self)
+        self.view = QListView(self)
+        self.view.setItemDelegate(self.delegate)
+        self.view.setUniformItemSizes(True)  # Row heights are never measured one by one
+        self.view.setVerticalScrollMode(QAbstractItemView.ScrollPerPixel)
+        self.view.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        self.view.setSelectionMode(QAbstractItemView.NoSelection)
+        self.view.setFocusPolicy(Qt.NoFocus)
+        self.view.setFrameShape(QFrame.NoFrame)
+        self.view.setStyleSheet("QListView { background-color: transparent; }")
+        self.view.verticalScrollBar().setStyleSheet("""
+            QScrollBar:vertical { background: transparent; width: 6px; }
+            QScrollBar::handle:vertical { background: rgba(255, 255, 255, 60); border-radius: 3px; min-height: 20px; }
+            QScrollBar::add-line:vertical, QScrollBar::sub-line:vertical { height: 0px; }
+            QScrollBar::add-page:vertical, QScrollBar::sub-page:vertical { background: none; }
+        """)
+        self.view.setModel(self.queue_model)
+
+        self.scroll_timer = QTimer(self)
+        self.scroll_timer.setSingleShot(True)
+        self.scroll_timer.setInterval(150)
+        self.scroll_timer.timeout.connect(self.cancel_hidden_thumbnails)
+        self.view.verticalScrollBar().valueChanged.connect(self.scroll_timer.start)
+
+        self.panel_layout = QVBoxLayout(self)
+        self.panel_layout.setContentsMargins(0, 0, 0, 0)
+        self.panel_layout.setSpacing(6)
+        self.panel_layout.addLayout(self.tabs_layout)
+        self.panel_layout.addWidget(self.view)
+
+    def update_tab_colors(self):
+        for tab in self.tab_group.buttons():
+            color = self.text_color if tab.isChecked() else self.secondary_color
+            palette = tab.palette()
+            if palette.color(QPalette.ButtonText) != color:
+                palette.setColor(QPalette.ButtonText, color)
+                tab.setPalette(palette)
+
+    def show_tab(self, tab_id):
+        self.update_tab_colors()
+        model = self.queue_model if tab_id == 0 else self.recent_model
+        if self.view.model() is not model:
+            self.view.setModel(model)
+        self.refresh_if_stale()
+        self.scroll_timer.start()
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.refresh_if_stale()
+
+    def hideEvent(self, event):
+        super().hideEvent(event)
+        self.thumbnail_cache.cancel_stale(set(), owner=self)
+
+    def track_changed(self):
+        # The previous track is now the most recently played one
+        self.recent_stale = True
+        self.refresh_if_stale()
+
+    def refresh_if_stale(self):
+        if self.recent_stale and self.isVisible() and self.view.model() is self.recent_model:
+            self.recent_stale = False
+            self.recent_model.refresh()
+
+    def cancel_hidden_thumbnails(self):
+        """
+        Keep only the thumbnail loads of the rows currently in view.
+        """
+        model = self.view.model()
+        first = self.view.indexAt(QPoint(0, 0)).row()
+        last = self.view.indexAt(QPoint(0, self.view.viewport().height() - 1)).row()
+        if first < 0:
+            keep_urls = set()
+        else:
+            keep_urls = model.visible_urls(first, last if last >= 0 else model.rowCount() - 1)
+        self.thumbnail_cache.cancel_stale(keep_urls, owner=self)
+
+    def set_theme(self, theme):
+        self.text_color = QColor(theme['text'])
+        self.secondary_color = QColor(theme['secondary'])
+        self.update_tab_colors()
+        self.delegate.set_colors(theme['text'], theme['secondary'])
+        self.view.viewport().update()
+
+
+class CommandPalette(ThemedPanel):
+    """
+    Type-ahead search over the local library index, opened with Ctrl+K.
+
+    Every keystroke is one local FTS query, with no network round trip.
+    Up and Down move the selection, Enter or a click plays the selected
+    item through play_requested_signal, and Escape closes the palette.
+    """
+    play_requested_signal = pyqtSignal(str)  # Spotify URI
+
+    def __init__(self, thumbnail_cache, library_path, parent=None):
+        super().__init__(parent, top_radius=10, bottom_radius=10)
+        self.thumbnail_cache = thumbnail_cache
+        self.library_path = library_path
+        self.index = None  # Opened on first use, from the GUI thread
+        self.set_color(QColor(18, 18, 18, 235))
+        self.model = TrackListModel(thumbnail_cache, self)
+
+        self.search_edit = QLineEdit(self)
+        self.search_edit.setFont(QFont('Arial Rounded MT Bold', 13))
+        self.search_edit.setPlaceholderText("Search your library")
+        self.search_edit.setStyleSheet("QLineEdit { background-color: rgba(255, 255, 255, 25); color: white; "
+                                       "border: none; border-radius: 6px; padding: 4px 8px; }")
+        self.search_edit.textChanged.connect(self.search)
+        self.search_edit.installEventFilter(self)
+
+        self.delegate = TrackDelegate(self)
+        self.view = QListView(self)
+        self.view.setItemDelegate(self.delegate)
+        self.view.setUniformItemSizes(True)
+        self.view.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        self.view.setVerticalScrollBarPolicy(Qt.ScrollBarAlwaysOff)  # Never more rows than fit
+        self.view.setFocusPolicy(Qt.NoFocus)  # Keys stay in the search field
+        self.view.setFrameShape(QFrame.NoFrame)
+        self.view.setStyleSheet("QListView { background-color: transparent; }")
+        self.view.setModel(self.model)
+        self.view.clicked.connect(self.play)
+
+        self.palette_layout = QVBoxLayout(self)
+        self.palette_layout.setContentsMargins(10, 10, 10, 10)
+        self.palette_layout.setSpacing(6)
+        self.palette_layout.addWidget(self.search_edit)
+        self.palette_layout.addWidget(self.view)
+        self.setVisible(False)
+
+    def open(self):
+        if self.index is None:
+            try:
+                self.index = LibraryIndex(self.library_path)
+            except sqlite3.Error as e:
+                self.search_edit.setPlaceholderText(f"Library unavailable: {e}")
+        self.search_edit.clear()
+        self.search('')
+        self.setVisible(True)
+        self.raise_()
+        self.search_edit.setFocus()
+
+    @timed('gui_slot_ms', slot='library_search')
+    def search(self, text):
+        if self.index is None:
+            return
+        started = time.perf_counter()
+        rows = self.index.search(text)
+        metrics.observe('library_search_ms', (time.perf_counter() - started) * 1000)
+        self.model.set_rows(rows)
+        if rows:
+            self.view.setCurrentIndex(self.model.index(0))
+
+    def refresh(self):
+        # The library changed under the results, e.g. after a sync
+        if self.isVisible():
+            self.search(self.search_edit.text())
+
+    def eventFilter(self, watched, event):
+        if event.type() == QEvent.KeyPress:
+            key = event.key()
+            if key in (Qt.Key_Up, Qt.Key_Down):
+                row = self.view.currentIndex().row() + (1 if key == Qt.Key_Down else -1)
+                if 0 <= row < self.model.rowCount():
+                    self.view.setCurrentIndex(self.model.index(row))
+                return True
+            if key in (Qt.Key_Return, Qt.Key_Enter):
+                if self.view.currentIndex().isValid():
+                    self.play(self.view.currentIndex())
+                return True
+            if key == Qt.Key_Escape or (key == Qt.Key_K and event.modifiers() & Qt.ControlModifier):
+                self.setVisible(False)
+                return True
+        return super().eventFilter(watched, event)
+
+    def play(self, index):
+        uri = self.model.rows[index.row()].uri
+        self.setVisible(False)
+        self.play_requested_signal.emit(uri)
+
+    def hideEvent(self, event):
+        super().hideEvent(event)
+        self.thumbnail_cache.cancel_stale(set(), owner=self)
+
+    def set_theme(self, theme):
+        self.delegate.set_colors(theme['text'], theme['secondary'])
+        self.view.viewport().update()
 
 
-class Worker(QObject):
-    # Define signals to send data back to the main thread
-    track_data_signal = pyqtSignal(dict)
+class PowerMonitor(QObject):
+    """
+    Tell whether a window can be seen, and count wakeups while it can and cannot.
+
+    A window is hidden while it is closed or minimized, while it is not
+    exposed (covered by other windows, on platforms that report it) and
+    while the screen saver is active, which is read from D-Bus where
+    available. Wakeups are the voluntary context switches of the whole
+    process, tallied per mode of this window.
+    """
+    visibility_changed_signal = pyqtSignal(bool)
+
+    monitors = weakref.WeakSet()  # Every window's monitor, to tell when all of them are hidden
+    screen_saver_services = [
+        ('org.freedesktop.ScreenSaver', '/org/freedesktop/ScreenSaver'),
+        ('org.gnome.ScreenSaver', '/org/gnome/ScreenSaver'),
+    ]
+
+    def __init__(self, window):
+        super().__init__(window)
+        self.window = window
+        self.visible = True
+        self.screen_saver_active = False
+        self.exposure_watched = False
+        self.mode_started = time.monotonic()
+        self.mode_wakeups = process_wakeups()
+        self.wakeup_totals = {'visible': [0, 0.0], 'hidden': [0, 0.0]}  # Mode -> [wakeups, seconds]
+        self.monitors.add(self)
+        window.installEventFilter(self)
+        if QtDBus is not None and QtDBus.QDBusConnection.sessionBus().isConnected():
+            for service, path in self.screen_saver_services:
+                QtDBus.QDBusConnection.sessionBus().connect(
+                    service, path, service, 'ActiveChanged', self.handle_screen_saver)
+
+    @classmethod
+    def all_hidden(cls):
+        return all(not monitor.visible for monitor in cls.monitors)
+
+    def eventFilter(self, watched, event):
+        kind = event.type()
+        if kind == QEvent.Show and not self.exposure_watched:
+            # Exposure is reported to the native window, which exists once the widget is shown
+            self.window.windowHandle().installEventFilter(self)
+            self.exposure_watched = True
+        elif kind in (QEvent.Hide, QEvent.WindowStateChange, QEvent.Expose) and not sip.isdeleted(self.window):
+            self.update()  # The native window still sends events while the widget is being destroyed
+        return False
+
+    @pyqtSlot(bool)
+    def handle_screen_saver(self, active):
+        self.screen_saver_active = active
+        self.update()
+
+    def update(self):
+        handle = self.window.windowHandle()
+        visible = (self.window.isVisible() and not self.window.isMinimized() and not self.screen_saver_active
+                   and (handle is None or handle.isExposed()))
+        if visible != self.visible:
+            self.account()
+            self.visible = visible
+            self.visibility_changed_signal.emit(visible)
+
+    def account(self):
+        """
+        Add the wakeups since the last call to the current mode.
+        """
+        now = time.monotonic()
+        wakeups = process_wakeups()
+        if wakeups is not None:
+            totals = self.wakeup_totals['visible' if self.visible else 'hidden']
+            totals[0] += wakeups - self.mode_wakeups
+            totals[1] += now - self.mode_started
+        self.mode_started = now
+        self.mode_wakeups = wakeups
+
+    def wakeup_rates(self):
+        """
+        Return the average wakeups per second while visible and while hidden.
+        """
+        self.account()
+        return {mode: wakeups / seconds for mode, (wakeups, seconds) in self.wakeup_totals.items() if seconds}
+
+
+class CommandPipeline(QObject):
+    """
+    Apply playback commands optimistically and send them to the worker in coalesced batches.
+
+    Toggles that cancel out within the coalescing window are dropped and
+    repeated skips become one skip-by-N, so skips that cancel out are never
+    sent. The worker makes a skip-by-N a single request where the playback
+    context allows it (see Worker.command_skip). Optimistic values stay in the
+    overlay until a snapshot taken after the last command finished confirms
+    them; a failed command drops the overlay so the confirmed state returns.
+    """
+    command_signal = pyqtSignal(str, object)
+
+    # Boolean state field -> worker command that sets it
+    field_commands = {
+        'is_playing': 'set_playing',
+        'shuffle_state': 'set_shuffle',
+        'is_liked': 'set_liked',
+    }
+
+    def __init__(self, coalesce_ms=command_coalesce_ms, parent=None):
+        super().__init__(parent)
+        self.pending = {}  # (field, track ID or None) -> (value before the first tap, target value)
+        self.pending_skip = 0  # Net number of tracks to skip, negative for previous
+        self.skip_offset = 0  # Tracks skipped since the last confirmed snapshot
+        self.overlay = {}  # Field -> optimistic value awaiting confirmation
+        self.in_flight = 0
+        self.confirm_after = None  # Snapshots sampled before this time are stale
+
+        self.flush_timer = QTimer(self)
+        self.flush_timer.setSingleShot(True)
+        self.flush_timer.setInterval(coalesce_ms)
+        self.flush_timer.timeout.connect(self.flush)
+
+    def toggle(self, field, current_value, track_id=None):
+        """
+        Flip a boolean field and return the optimistic value.
+
+        track_id is the track a like belongs to, so taps on different tracks never cancel out.
+        """
+        key = (field, track_id)
+        target = not current_value
+        original = self.pending[key][0] if key in self.pending else current_value
+        if target == original:
+            # Double tap: the two toggles cancel out
+            del self.pending[key]
+        else:
+            self.pending[key] = (original, target)
+        self.overlay[field] = target
+        self.schedule()
+        return target
+
+    def skip(self, count):
+        """
+        Queue a skip and return the net offset from the last confirmed track.
+        """
+        self.pending_skip += count
+        self.skip_offset += count
+        self.schedule()
+        return self.skip_offset
+
+    def schedule(self):
+        # The window starts at the first tap, so a burst never delays a command by more than coalesce_ms
+        if not self.flush_timer.isActive():
+            self.flush_timer.start()
+
+    def flush(self):
+        for (field, track_id), (original, target) in self.pending.items():
+            args = (track_id, target) if field == 'is_liked' else target
+            self.send(self.field_commands[field], args)
+        self.pending.clear()
+        if self.pending_skip:
+            self.send('skip', self.pending_skip)
+            self.pending_skip = 0
+
+    def send(self, command, args):
+        self.in_flight += 1
+        self.confirm_after = None
+        self.command_signal.emit(command, args)
+
+    def busy(self):
+        return bool(self.pending or self.pending_skip or self.in_flight or self.flush_timer.isActive())
+
+    def handle_result(self, command, result):
+        self.in_flight -= 1
+        if self.in_flight == 0:
+            self.confirm_after = time.monotonic()
+
+    def handle_error(self, command, error_message):
+        """
+        Roll back: forget every optimistic value so the next render shows confirmed state.
+        """
+        self.in_flight -= 1
+        self.overlay.clear()
+        self.skip_offset = 0
+        if self.in_flight == 0:
+            self.confirm_after = time.monotonic()
+
+    def reconcile(self, state):
+        """
+        Merge a snapshot with optimistic state.
+
+        Returns the state to display, or None if the snapshot is stale
+        because a skip has not been confirmed yet.
+        """
+        stale = self.busy() or (self.confirm_after is not None and state.sampled_at < self.confirm_after)
+        if not stale:
+            self.overlay.clear()
+            self.skip_offset = 0
+            self.confirm_after = None
+            return state
+        if self.skip_offset:
+            return None
+        return state._replace(**self.overlay)
+
+
+# Keys each message type must carry, and their types: the requests subscribers send the daemon and
+# the messages the daemon publishes. Anything else is dropped, so no local client can crash the other end
+daemon_requests = {
+    'command': {'command': str, 'args': object},
+    'poll_soon': {},
+    'recently_played': {'before': object},
+    'background': {'background': bool},
+}
+daemon_messages = {
+    'state': {'changes': dict},
+    'queue': {'tracks': list},
+    'palette': {'url': str, 'palette': dict},
+    'art': {'url': str, 'path': str},
+    'art_error': {'url': str, 'message': str},
+    'budget': {'budget': dict},
+    'error': {'message': str},
+    'token_error': {'message': str},
+    'logged_in': {'name': str},
+    'command_result': {'command': str, 'result': object},
+    'command_error': {'command': str, 'message': str},
+    'recently_played': {'tracks': list, 'before': object, 'cursor': object},
+    'recently_played_error': {'message': str},
+}
+
+
+def valid_message(message, schema):
+    """
+    Whether message is an object of a type in schema that has every key of that type, with the right types.
+    """
+    if not isinstance(message, dict) or not isinstance(message.get('type'), str) or message['type'] not in schema:
+        return False
+    return all(key in message and isinstance(message[key], kind) for key, kind in schema[message['type']].items())
+
+
+def send_message(socket, message):
+    socket.write(json.dumps(message, separators=(',', ':')).encode('utf-8') + b'\n')
+
+
+def read_messages(socket, buffer):
+    """
+    Append what socket has received to buffer and return the complete newline-delimited JSON messages.
+    """
+    buffer += bytes(socket.readAll())
+    messages = []
+    while True:
+        end = buffer.find(b'\n')
+        if end < 0:
+            return messages
+        line = bytes(buffer[:end])
+        del buffer[:end + 1]
+        if line.strip():
+            try:
+                messages.append(json.loads(line))
+            except RecursionError:
+                raise ValueError("Message nested too deeply")
+
+
+class PlaybackDaemon(QObject):
+    """
+    Headless poller that publishes playback state to local subscribers.
+
+    One worker follows playback (see create_worker) and each change goes out
+    as newline-delimited JSON over a QLocalServer (a Unix domain socket, or a
+    named pipe on Windows):
+    diffs of the PlaybackState, the queue, and album art as file paths in the
+    shared disk cache together with their palettes. Any number of --subscribe
+    windows can then share a single upstream poll stream, which drops to
+    heartbeat polls while none of them is shown.
+
+    sampled_at is a monotonic timestamp; the monotonic clock is system-wide,
+    so it stays meaningful in the subscriber processes on the same machine.
+    """
+    command_signal = pyqtSignal(str, object)
+    background_signal = pyqtSignal(bool)
+    recently_played_signal = pyqtSignal(object)  # Cursor of the requested page
+    published_art_entries = 16  # Art messages replayed to new subscribers
+
+    def __init__(self, sp, services, socket_name=daemon_socket_name, parent=None):
+        super().__init__(parent)
+        self.services = services
+        self.socket_name = socket_name
+        self.state = None
+        self.upcoming_tracks = []
+        self.logged_in = None
+        self.budget = None
+        self.published_art = OrderedDict()  # Album art URL -> (palette message, art message)
+        self.waiting_for_palette = set()
+        self.command_origins = deque()  # Subscriber of each command, results come back in order
+        self.recently_played_origins = deque()  # Likewise for recently played pages
+        self.subscribers = {}  # QLocalSocket -> read buffer
+        self.hidden_subscribers = set()
+        self.token_manager = None
+
+        self.worker = create_worker(sp, library_path=library_file)
+        self.worker.state_signal.connect(self.handle_state)
+        self.worker.error_signal.connect(lambda message: self.publish({'type': 'error', 'message': message}))
+        self.worker.notice_signal.connect(print)
+        self.worker.budget_signal.connect(self.handle_budget)
+        self.worker.command_result_signal.connect(self.handle_command_result)
+        self.worker.command_error_signal.connect(self.handle_command_error)
+        self.worker.queue_signal.connect(self.handle_queue)
+        self.worker.logged_in_signal.connect(self.handle_logged_in)
+        self.worker.auth_error_signal.connect(self.handle_auth_error)
+        self.worker.client_ready_signal.connect(self.start_token_manager)
+        self.worker.token_error_signal.connect(
+            lambda message: self.publish({'type': 'token_error', 'message': message}))
+        self.command_signal.connect(self.worker.execute_command)
+        self.background_signal.connect(self.worker.set_background)
+        self.worker.recently_played_signal.connect(self.handle_recently_played)
+        self.worker.recently_played_error_signal.connect(self.handle_recently_played_error)
+        self.recently_played_signal.connect(self.worker.fetch_recently_played)
+
+        self.art_cache = services.art_cache
+        self.art_cache.art_ready_signal.connect(self.handle_art_ready)
+        self.art_cache.art_error_signal.connect(
+            lambda url, message: self.publish({'type': 'art_error', 'url': url, 'message': message}))
+        self.palette_engine = services.palette_engine
+        self.palette_engine.palette_ready_signal.connect(self.handle_palette_ready)
+        self.prefetcher = ArtPrefetcher(self.art_cache, parent=self)
+        self.prefetcher.prefetched_signal.connect(self.handle_art_ready)
+
+        self.server = QLocalServer(self)
+        self.server.newConnection.connect(self.handle_connection)
+
+    def start(self):
+        """
+        Listen for subscribers and start polling; returns False if the socket is taken.
+        """
+        probe = QLocalSocket()
+        probe.connectToServer(self.socket_name)
+        if probe.waitForConnected(200):
+            print(f"A playback daemon is already running on {self.socket_name}")
+            return False
+        QLocalServer.removeServer(self.socket_name)  # Left behind by a daemon that crashed
+        if not self.server.listen(self.socket_name):
+            print(f"Cannot listen on {self.socket_name}: {self.server.errorString()}")
+            return False
+        self.services.worker_pool.add(self.worker)
+        if self.worker.library_worker is not None:
+            self.services.worker_pool.add(self.worker.library_worker)
+        self.update_background()
+        return True
+
+    def stop(self):
+        self.server.close()
+        self.services.stop()
+
+    def publish(self, message):
+        data = json.dumps(message, separators=(',', ':')).encode('utf-8') + b'\n'
+        for socket in self.subscribers:
+            socket.write(data)
+
+    def handle_connection(self):
+        while self.server.hasPendingConnections():
+            socket = self.server.nextPendingConnection()
+            self.subscribers[socket] = bytearray()
+            socket.readyRead.connect(lambda socket=socket: self.handle_readable(socket))
+            socket.disconnected.connect(lambda socket=socket: self.handle_disconnected(socket))
+            # Bring the new subscriber up to date
+            if self.logged_in is not None:
+                send_message(socket, {'type': 'logged_in', 'name': self.logged_in})
+            if self.budget is not None:
+                send_message(socket, {'type': 'budget', 'budget': self.budget})
+            if self.state is not None:
+                send_message(socket, {'type': 'state', 'changes': self.state._asdict()})
+            if self.upcoming_tracks:
+                send_message(socket, {'type': 'queue', 'tracks': self.upcoming_tracks})
+            for palette_message, art_message in self.published_art.values():
+                send_message(socket, palette_message)
+                send_message(socket, art_message)
+        self.update_background()
+
+    def handle_disconnected(self, socket):
+        self.subscribers.pop(socket, None)
+        self.hidden_subscribers.discard(socket)
+        socket.deleteLater()
+        self.update_background()
+
+    def update_background(self):
+        # Subscribers count as shown until they report otherwise
+        self.background_signal.emit(all(socket in self.hidden_subscribers for socket in self.subscribers))
+
+    def handle_readable(self, socket):
+        try:
+            messages = read_messages(socket, self.subscribers[socket])
+        except (KeyError, ValueError):
+            socket.abort()
+            return
+        for message in messages:
+            if not valid_message(message, daemon_requests):
+                # Only this subscriber is dropped, the others keep their state stream
+                socket.abort()
+                return
+            kind = message['type']
+            if kind == 'command':
+                self.command_origins.append(socket)
+                self.command_signal.emit(message['command'], message['args'])
+            elif kind == 'poll_soon':
+                QMetaObject.invokeMethod(self.worker, 'poll_soon', Qt.QueuedConnection)
+            elif kind == 'recently_played':
+                self.recently_played_origins.append(socket)
+                self.recently_played_signal.emit(message['before'])
+            elif kind == 'background':
+                if message['background']:
+                    self.hidden_subscribers.add(socket)
+                else:
+                    self.hidden_subscribers.discard(socket)
+                self.update_background()
+
+    def handle_command_result(self, command, result):
+        socket = self.command_origins.popleft() if self.command_origins else None
+        if socket in self.subscribers:
+            send_message(socket, {'type': 'command_result', 'command': command, 'result': result})
+
+    def handle_command_error(self, command, error_message):
+        socket = self.command_origins.popleft() if self.command_origins else None
+        if socket in self.subscribers:
+            send_message(socket, {'type': 'command_error', 'command': command, 'message': error_message})
+
+    def handle_recently_played(self, tracks, before, cursor):
+        socket = self.recently_played_origins.popleft() if self.recently_played_origins else None
+        if socket in self.subscribers:
+            send_message(socket, {'type': 'recently_played', 'tracks': tracks, 'before': before, 'cursor': cursor})
+
+    def handle_recently_played_error(self, error_message):
+        socket = self.recently_played_origins.popleft() if self.recently_played_origins else None
+        if socket in self.subscribers:
+            send_message(socket, {'type': 'recently_played_error', 'message': error_message})
+
+    def handle_state(self, state):
+        old = self.state
+        self.state = state
+        changes = state._asdict() if old is None else {
+            field: value for field, value in state._asdict().items() if getattr(old, field) != value
+        }
+        if changes:
+            self.publish({'type': 'state', 'changes': changes})
+        if state.album_url and (old is None or state.album_url != old.album_url):
+            pixmap = self.art_cache.request(state.album_url)
+            if pixmap is not None:
+                self.handle_art_ready(state.album_url, pixmap)
+
+    def handle_queue(self, upcoming_tracks):
+        self.upcoming_tracks = upcoming_tracks
+        self.publish({'type': 'queue', 'tracks': upcoming_tracks})
+        self.prefetcher.prefetch([track['album']['images'][0]['url']
+                                  for track in upcoming_tracks[:prefetch_depth] if track['album']['images']])
+
+    def handle_budget(self, budget):
+        self.budget = budget
+        self.publish({'type': 'budget', 'budget': budget})
+
+    def handle_logged_in(self, display_name):
+        print(f"Logged in as {display_name}")
+        self.logged_in = display_name
+        self.publish({'type': 'logged_in', 'name': display_name})
+
+    def handle_auth_error(self, error_message):
+        print(f"Spotify authentication failed: {error_message}")
+        self.publish({'type': 'error', 'message': f"Spotify authentication failed: {error_message}"})
+
+    def start_token_manager(self, auth_manager):
+        if hasattr(auth_manager.cache_handler, 'refresh_lock'):
+            self.token_manager = TokenManager(auth_manager)
+            self.token_manager.refresh_failed_signal.connect(
+                lambda message: self.publish({'type': 'token_error', 'message': message}))
+            self.services.worker_pool.add(self.token_manager, alongside=self.worker)
+
+    def handle_art_ready(self, url, pixmap):
+        # Subscribers get the palette before the art, so they never extract it themselves
+        if url in self.published_art or url in self.waiting_for_palette:
+            return
+        palette = self.palette_engine.request(url, self.art_cache.thumbnail(url, pixmap))
+        if palette is None:
+            self.waiting_for_palette.add(url)
+        else:
+            self.publish_art(url, palette)
+
+    def handle_palette_ready(self, url, palette):
+        if url in self.waiting_for_palette:
+            self.waiting_for_palette.discard(url)
+            self.publish_art(url, palette)
+
+    def publish_art(self, url, palette):
+        path = self.art_cache.path(self.art_cache.image_id(url))
+        if not os.path.exists(path):
+            return
+        messages = ({'type': 'palette', 'url': url, 'palette': palette}, {'type': 'art', 'url': url, 'path': path})
+        self.published_art[url] = messages
+        while len(self.published_art) > self.published_art_entries:
+            self.published_art.popitem(last=False)
+        for message in messages:
+            self.publish(message)
+
+
+class RemoteWorker(QObject):
+    """
+    Stand-in for Worker that subscribes to a playback daemon instead of polling the API.
+
+    It has Worker's signals and slots, so SpotifyApp works with either.
+    Album art arrives as file paths and palettes through art_file_signal and
+    palette_signal, which main() connects to the shared caches.
+    """
+    state_signal = pyqtSignal(object)  # PlaybackState
     error_signal = pyqtSignal(str)
+    notice_signal = pyqtSignal(str)  # Never emitted, the daemon logs its worker's notices
+    budget_signal = pyqtSignal(dict)
+    command_result_signal = pyqtSignal(str, object)
+    command_error_signal = pyqtSignal(str, str)
+    queue_signal = pyqtSignal(list)
+    logged_in_signal = pyqtSignal(str)
+    auth_error_signal = pyqtSignal(str)
+    client_ready_signal = pyqtSignal(object)  # Never emitted, the daemon refreshes the token
+    token_error_signal = pyqtSignal(str)
+    recently_played_signal = pyqtSignal(list, object, object)
+    recently_played_error_signal = pyqtSignal(str)
+    library_synced_signal = pyqtSignal(dict)  # Never emitted, the daemon syncs the shared library index
+    art_file_signal = pyqtSignal(str, str)
+    art_error_signal = pyqtSignal(str, str)
+    palette_signal = pyqtSignal(str, dict)
 
-    def __init__(self, sp):
+    reconnect_ms = 2000
+
+    def __init__(self, socket_name=daemon_socket_name):
         super().__init__()
-        self.sp = sp
-        self.current_track_id = None  # Keep track of the current track ID
+        self.socket_name = socket_name
+        self.state = None
+        self.buffer = bytearray()
+        self.socket = None  # Created on the worker thread by start
+        self.background = False
+        self.library_worker = None  # The daemon syncs the shared library index
+        self.start_delay_ms = 0  # Set by WorkerPool, nothing to stagger without polling
 
     @pyqtSlot()
     def start(self):
-        self.timer = QTimer()
-        self.timer.setInterval(1000)  # Update every second
-        self.timer.timeout.connect(self.fetch_track_data)
-        self.timer.start()
+        self.socket = QLocalSocket(self)
+        self.socket.readyRead.connect(self.handle_readable)
+        self.socket.connected.connect(self.handle_connected)
+        self.socket.error.connect(self.handle_socket_error)
+        self.socket.disconnected.connect(self.handle_disconnected)
+        self.reconnect_timer = QTimer(self)
+        self.reconnect_timer.setSingleShot(True)
+        self.reconnect_timer.timeout.connect(self.connect_to_daemon)
+        self.connect_to_daemon()
 
-    def fetch_track_data(self):
+    def connect_to_daemon(self):
+        self.buffer = bytearray()
+        self.socket.abort()
+        self.socket.connectToServer(self.socket_name)
+
+    def handle_connected(self):
+        if self.background:
+            send_message(self.socket, {'type': 'background', 'background': True})
+
+    def handle_socket_error(self, error):
+        if error == QLocalSocket.PeerClosedError:
+            return  # Reported through disconnected
+        self.error_signal.emit(f"Playback daemon not reachable: {self.socket.errorString()}")
+        self.reconnect_timer.start(self.reconnect_ms)
+
+    def handle_disconnected(self):
+        self.error_signal.emit("Playback daemon stopped")
+        self.reconnect_timer.start(self.reconnect_ms)
+
+    def handle_readable(self):
         try:
-            current_track = self.sp.current_user_playing_track()
-            if current_track:
-                self.track_data_signal.emit(current_track)
-            else:
-                self.track_data_signal.emit(None)
-        except Exception as e:
-            # Emit the error signal instead of printing
-            self.error_signal.emit(str(e))
+            messages = read_messages(self.socket, self.buffer)
+        except ValueError:
+            self.socket.abort()
+            return
+        for message in messages:
+            if not valid_message(message, daemon_messages) or (
+                    message['type'] == 'state' and not set(message['changes']) <= set(PlaybackState._fields)):
+                continue  # E.g. from a daemon of another version; the next state brings the display up to date
+            kind = message['type']
+            if kind == 'state':
+                self.state = (self.state or PlaybackState())._replace(**message['changes'])
+                self.state_signal.emit(self.state)
+            elif kind == 'queue':
+                self.queue_signal.emit(message['tracks'])
+            elif kind == 'palette':
+                self.palette_signal.emit(message['url'], message['palette'])
+            elif kind == 'art':
+                self.art_file_signal.emit(message['url'], message['path'])
+            elif kind == 'art_error':
+                self.art_error_signal.emit(message['url'], message['message'])
+            elif kind == 'budget':
+                self.budget_signal.emit(message['budget'])
+            elif kind == 'error':
+                self.error_signal.emit(message['message'])
+            elif kind == 'token_error':
+                self.token_error_signal.emit(message['message'])
+            elif kind == 'logged_in':
+                self.logged_in_signal.emit(message['name'])
+            elif kind == 'command_result':
+                self.command_result_signal.emit(message['command'], message['result'])
+            elif kind == 'command_error':
+                self.command_error_signal.emit(message['command'], message['message'])
+            elif kind == 'recently_played':
+                self.recently_played_signal.emit(message['tracks'], message['before'], message['cursor'])
+            elif kind == 'recently_played_error':
+                self.recently_played_error_signal.emit(message['message'])
+
+    def is_connected(self):
+        # Before start has run there is no socket, and while reconnecting it is not connected
+        return self.socket is not None and self.socket.state() == QLocalSocket.ConnectedState
+
+    @pyqtSlot(str, object)
+    def execute_command(self, command, args):
+        # Like Worker before it has a client, the command fails and the GUI rolls it back
+        if not self.is_connected():
+            self.command_error_signal.emit(command, "Not connected to the playback daemon.")
+            return
+        send_message(self.socket, {'type': 'command', 'command': command, 'args': args})
+
+    @pyqtSlot(object)
+    def fetch_recently_played(self, before):
+        if not self.is_connected():
+            self.recently_played_error_signal.emit("Not connected to the playback daemon.")
+            return
+        send_message(self.socket, {'type': 'recently_played', 'before': before})
+
+    @pyqtSlot()
+    def poll_soon(self):
+        # The daemon sends a fresh state to every new subscriber anyway
+        if self.is_connected():
+            send_message(self.socket, {'type': 'poll_soon'})
+
+    @pyqtSlot(bool)
+    def set_background(self, background):
+        # The daemon slows down once none of its subscribers is shown
+        self.background = background
+        if self.is_connected():
+            send_message(self.socket, {'type': 'background', 'background': background})
 
+    @pyqtSlot()
     def stop(self):
-        self.timer.stop()
+        if self.socket is None:
+            return
+        self.reconnect_timer.stop()
+        self.socket.abort()
+
+
+class SharedServices:
+    """
+    Everything the displays in one process share.
+
+    That is the HTTP transport, the album art and palette caches, the
+    rendered icons and the threads the poll workers and library syncs run on. Track list
+    thumbnails are always downloaded by the process showing them.
+    """
+
+    def __init__(self, transport=None, poll_threads=poll_threads, stagger_ms=0, download_art=True):
+        self.transport = transport or HttpTransport()
+        self.art_cache = AlbumArtCache(self.transport, download=download_art)
+        self.thumbnail_cache = AlbumArtCache(
+            self.transport, os.path.join(cache_dir, 'thumbnails'), max_entries=track_thumbnail_memory_entries,
+            max_disk_bytes=track_thumbnail_disk_bytes, size=track_thumbnail_size)
+        self.palette_engine = PaletteEngine()
+        self.worker_pool = WorkerPool(poll_threads, stagger_ms)
+        self.icons = None
+
+    def load_icons(self):
+        if self.icons is None:
+            self.icons = IconCache()
+        return self.icons
+
+    def stop(self):
+        self.worker_pool.stop()
+        self.palette_engine.stop()
+        self.art_cache.stop()
+        self.thumbnail_cache.stop()
 
 
 class SpotifyApp(QWidget):
-    def __init__(self, sp):
+    background_signal = pyqtSignal(bool)  # Whether the window is hidden, for the worker's poll rate
+
+    def __init__(self, sp, transport=None, services=None, name=None, hourly_budget=hourly_request_budget,
+                 worker=None, source=None):
         super().__init__()
-        self.sp = sp
+        self.startup_times = {}  # Milestone -> ms since startup_started
+        # Caches and threads shared with the other displays of this process, if any
+        self.owns_services = services is None
+        self.services = services or SharedServices(transport)
+        # Shared with the spotipy client when main() builds it
+        self.transport = self.services.transport
+        self.name = name  # Display name from the config, keeps per-display files apart
         self.initUI()
         self.current_album_url = None  # Track current album art URL
+        self.view_state = None  # PlaybackState currently rendered
+        self.confirmed_state = None  # Last PlaybackState reported by the API
+        self.commands = CommandPipeline(parent=self)
+        self.clock = PlaybackClock()
+        self.progress_timer = QTimer(self)  # Coarse, so the OS can batch its ticks with other timers
+        self.progress_timer.timeout.connect(self.update_progress)
         self.connection_error = False  # Track connection status
+        self.hidden = False  # Set by the power monitor while the window cannot be seen
+        self.pending_state = None  # Latest state received while hidden, shown on re-show
 
-        # Set up the worker thread
-        self.thread = QThread()
-        self.worker = Worker(self.sp)
-        self.worker.moveToThread(self.thread)
-        self.thread.started.connect(self.worker.start)
-        self.thread.finished.connect(self.worker.deleteLater)
-        self.worker.track_data_signal.connect(self.handle_track_data)
+        # Set up the worker for the playback source, or a RemoteWorker fed by the playback daemon;
+        # it runs on the shared worker pool once the first frame is painted
+        self.worker = worker or create_worker(sp, hourly_budget, source, self.library_path())
+        self.worker.state_signal.connect(self.handle_state)
         self.worker.error_signal.connect(self.handle_error)
-        self.thread.start()
+        self.worker.notice_signal.connect(print)  # Nothing the display needs to show
+        self.worker.budget_signal.connect(self.handle_budget)
+        self.worker.command_result_signal.connect(self.commands.handle_result)
+        self.worker.command_error_signal.connect(self.handle_command_error)
+        self.worker.queue_signal.connect(self.handle_queue)
+        self.worker.logged_in_signal.connect(self.handle_logged_in)
+        self.worker.auth_error_signal.connect(self.handle_auth_error)
+        self.worker.client_ready_signal.connect(self.start_token_manager)
+        self.worker.token_error_signal.connect(self.handle_token_error)
+        self.worker.recently_played_signal.connect(self.track_list.recent_model.add_page)
+        self.worker.recently_played_error_signal.connect(self.handle_recently_played_error)
+        self.track_list.recent_model.fetch_requested_signal.connect(self.worker.fetch_recently_played)
+        self.worker.library_synced_signal.connect(self.command_palette.refresh)
+        self.command_palette.play_requested_signal.connect(self.play_uri)
+        self.commands.command_signal.connect(self.worker.execute_command)
+        self.background_signal.connect(self.worker.set_background)
+        self.poll_budget = {}  # Last request budget reported by the worker
+        self.token_manager = None  # Background token refresh, started once logged in
+        self.token_error = False
+
+        # Paint the last known track straight away; the worker thread starts after the first frame
+        self.load_last_state()
+        if debug_overlay:
+            self.toggle_debug_overlay()
+
+        # Stop rendering and slow polling down while the window cannot be seen
+        self.power_monitor = PowerMonitor(self)
+        if power_saving:
+            self.power_monitor.visibility_changed_signal.connect(self.handle_visibility)
 
         # Variables for window dragging
         self.offset = None
 
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        metrics.inc('repaints_total', widget='window')
+        if 'first_frame' not in self.startup_times:
+            self.mark_startup('first_frame')
+            # Defer everything that is not needed for the first frame
+            QTimer.singleShot(0, self.finish_startup)
+
+    def finish_startup(self):
+        self.load_icons()
+        self.services.worker_pool.add(self.worker, staggered=True)
+        if self.worker.library_worker is not None:
+            self.services.worker_pool.add(self.worker.library_worker)
+
+    def mark_startup(self, milestone):
+        # Shown on the debug overlay and exported as startup_ms, nothing is printed
+        self.startup_times[milestone] = (time.monotonic() - startup_started) * 1000
+        metrics.observe('startup_ms', self.startup_times[milestone], milestone=milestone)
+
+    def load_icons(self):
+        self.icons = self.services.load_icons()
+        state = self.view_state or PlaybackState()
+        self.previous_button.setIcon(self.icons['step-backward'])  # Backward icon
+        self.next_button.setIcon(self.icons['step-forward'])  # Forward icon
+        self.play_pause_button.setIcon(self.icons['pause'] if state.is_playing else self.icons['play'])
+        self.like_button.setIcon(self.icons['heart'] if state.is_liked else self.icons['heart-o'])
+        self.shuffle_button.setIcon(self.icons['random-on'] if state.shuffle_state else self.icons['random'])
+        self.track_list_button.setIcon(self.icons['list'])
+
+    def last_state_path(self):
+        if self.name is None:
+            return last_state_file
+        return os.path.join(cache_dir, f"last_state_{self.name}.json")
+
+    def library_path(self):
+        if self.name is None:
+            return library_file
+        return os.path.join(cache_dir, f"library_{self.name}.sqlite3")
+
+    def load_last_state(self):
+        """
+        Show the snapshot persisted by the previous run, including its cached art and colors.
+        """
+        try:
+            with open(self.last_state_path()) as f:
+                saved = json.load(f)
+            fields = {field: saved['state'][field] for field in PlaybackState._fields if field in saved['state']}
+            state = PlaybackState(**fields)._replace(is_playing=False, sampled_at=time.monotonic())
+        except (OSError, ValueError, KeyError, TypeError):
+            return
+        if state.album_url and saved.get('theme'):
+            # Seed the palette memo so the art below is themed without running the palette engine
+            self.palette_engine.palettes[state.album_url] = saved['theme']
+        self.show_state(state)
+
+    def save_last_state(self):
+        state = self.confirmed_state
+        if state is None or not state.album_url:
+            return
+        saved = {
+            'state': state._replace(progress_ms=0, sampled_at=0.0)._asdict(),
+            'theme': self.palette_engine.palettes.get(state.album_url),
+        }
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            with open(self.last_state_path() + '.tmp', 'w') as f:
+                json.dump(saved, f)
+            os.replace(self.last_state_path() + '.tmp', self.last_state_path())
+        except OSError:
+            pass
+
+    def handle_logged_in(self, display_name):
+        print(f"Logged in as {display_name}")
+
+    def handle_auth_error(self, error_message):
+        QMessageBox.critical(self, "Authentication Error", f"Spotify authentication failed: {error_message}")
+        self.close()
+
+    def start_token_manager(self, auth_manager):
+        if not hasattr(auth_manager.cache_handler, 'refresh_lock'):
+            return  # Only the shared token store can coordinate refreshes
+        self.token_manager = TokenManager(auth_manager)
+        self.token_manager.refreshed_signal.connect(self.handle_token_refreshed)
+        self.token_manager.refresh_failed_signal.connect(self.handle_token_error)
+        self.services.worker_pool.add(self.token_manager, alongside=self.worker)
+
+    def handle_token_refreshed(self, latency_ms):
+        metrics.observe('token_refresh_ms', latency_ms)
+        if self.token_error:
+            self.token_error = False
+            if not self.connection_error:
+                self.hide_error_message()
+
+    def handle_token_error(self, error_message):
+        # Unlike a connection error the current track stays on screen
+        self.token_error = True
+        if not self.connection_error:
+            self.show_error_message(f"Token refresh failed: {error_message}")
+
     def closeEvent(self, event):
-        # Stop the worker thread when the application is closed
-        self.worker.stop()
-        self.thread.quit()
-        self.thread.wait()
+        self.save_last_state()
+        # Stop this display's worker; the other displays keep the shared services running
+        self.services.worker_pool.remove(self.worker)
+        if self.worker.library_worker is not None:
+            self.services.worker_pool.remove(self.worker.library_worker)
+        if self.token_manager is not None:
+            self.services.worker_pool.remove(self.token_manager)
+        self.art_cache.release(self)
+        self.services.thumbnail_cache.release(self.track_list)
+        self.services.thumbnail_cache.release(self.command_palette)
+        if self.owns_services:
+            self.services.stop()
         event.accept()
 
     def initUI(self):
@@ -111,9 +3843,9 @@ class SpotifyApp(QWidget):
         self.move(x, y)
 
         # *** New Top Bar for Window Controls ***
-        self.top_bar = QWidget(self)
+        self.top_bar = ThemedPanel(self, top_radius=15)  # Painted with rounded top corners
+        self.top_bar.setObjectName('top_bar')
         self.top_bar.setFixedHeight(22)  # Height for window controls
-        self.top_bar.setStyleSheet("background-color: transparent;")  # Background color
 
         self.top_bar_layout = QHBoxLayout(self.top_bar)
         self.top_bar_layout.setContentsMargins(10, 8, 10, 0)  # Left, Top, Right, Bottom
@@ -122,6 +3854,15 @@ class SpotifyApp(QWidget):
         # Spacer to push the close button to the right
         self.top_bar_layout.addStretch()
 
+        # *** Track List Button ***
+        self.track_list_button = QPushButton(self.top_bar)
+        self.track_list_button.setFixedSize(14, 14)
+        self.track_list_button.setIconSize(QSize(12, 12))
+        self.track_list_button.setStyleSheet("background-color: transparent; border: none;")
+        self.track_list_button.setToolTip("Up next and recently played")
+        self.track_list_button.clicked.connect(self.toggle_track_list)
+        self.top_bar_layout.addWidget(self.track_list_button)
+
         # *** Close Button ***
         self.close_button = QPushButton(self.top_bar)
         self.close_button.setFixedSize(11, 11)  # Size similar to macOS close button
@@ -150,7 +3891,8 @@ class SpotifyApp(QWidget):
         self.error_label.setVisible(False)  # Hidden by default
 
         # *** Main Content Panel (Album Art and Track Info) ***
-        self.content_panel = QWidget(self)
+        self.content_panel = ThemedPanel(self)
+        self.content_panel.setObjectName('content_panel')
         self.content_layout = QHBoxLayout(self.content_panel)
         self.content_layout.setSpacing(10)
 
@@ -167,21 +3909,21 @@ class SpotifyApp(QWidget):
 
         self.album_name_label = QLabel('', self.content_panel)
         self.album_name_label.setFont(QFont('Arial Rounded MT Bold', 14))
-        self.album_name_label.setStyleSheet("color: white;")
+        set_text_color(self.album_name_label, QColor('white'))
         self.album_name_label.setAlignment(Qt.AlignLeft)
         self.album_name_label.setWordWrap(True)
         self.album_name_label.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Preferred)
 
         self.track_name_label = QLabel('', self.content_panel)
         self.track_name_label.setFont(QFont('Arial Rounded MT Bold', 28, QFont.Bold))
-        self.track_name_label.setStyleSheet("color: white;")
+        set_text_color(self.track_name_label, QColor('white'))
         self.track_name_label.setAlignment(Qt.AlignLeft)
         self.track_name_label.setWordWrap(True)
         self.track_name_label.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Preferred)
 
         self.artist_name_label = QLabel('', self.content_panel)
         self.artist_name_label.setFont(QFont('Arial Rounded MT Bold', 14))
-        self.artist_name_label.setStyleSheet("color: white;")
+        set_text_color(self.artist_name_label, QColor('white'))
         self.artist_name_label.setAlignment(Qt.AlignLeft)
         self.artist_name_label.setWordWrap(True)
         self.artist_name_label.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Preferred)
@@ -191,15 +3933,32 @@ class SpotifyApp(QWidget):
         self.track_info_layout.addWidget(self.artist_name_label)
         self.track_info_layout.addStretch()
 
+        # Up next and recently played, hidden until opened from the top bar
+        self.track_list = TrackListPanel(self.services.thumbnail_cache, self.content_panel)
+        self.track_list.setVisible(False)
+
         self.content_layout.addWidget(self.album_art_label)
         self.content_layout.addLayout(self.track_info_layout)
+        self.content_layout.addWidget(self.track_list)
+
+        # *** Album art cache (memory and disk) with network fallback ***
+        self.art_cache = self.services.art_cache
+        self.art_cache.art_ready_signal.connect(self.handle_art_ready)
+        self.art_cache.art_error_signal.connect(self.handle_art_error)
+        self.upcoming_tracks = []  # Next tracks in the playback queue
+
+        # *** Palette extraction off the GUI thread, memoized per album ***
+        self.palette_engine = self.services.palette_engine
+        self.palette_engine.palette_ready_signal.connect(self.handle_palette_ready)
+        self.theme_transition = ThemeTransition(self.paint_theme, parent=self)
 
-        # *** Network manager for image loading ***
-        self.network_manager = QNetworkAccessManager(self)
-        self.network_manager.finished.connect(self.update_album_art)
+        # *** Prefetch art for upcoming tracks so track changes are cache hits ***
+        self.prefetcher = ArtPrefetcher(self.art_cache, parent=self)
+        self.prefetcher.prefetched_signal.connect(self.prefetch_palette)
 
         # *** Bottom Panel (Progress Bar and Controls) ***
-        self.bottom_panel = QWidget(self)
+        self.bottom_panel = ThemedPanel(self, bottom_radius=15)  # Painted with rounded bottom corners
+        self.bottom_panel.setObjectName('bottom_panel')
         self.bottom_layout = QVBoxLayout(self.bottom_panel)
         self.bottom_layout.setContentsMargins(10, 10, 10, 10)
         self.bottom_layout.setSpacing(10)
@@ -208,63 +3967,47 @@ class SpotifyApp(QWidget):
         self.time_labels_layout = QHBoxLayout()
         self.current_time_label = QLabel('00:00', self.bottom_panel)
         self.current_time_label.setFont(QFont('Arial Rounded MT Bold', 10))
-        self.current_time_label.setStyleSheet("color: white;")
+        set_text_color(self.current_time_label, QColor('white'))
         self.end_time_label = QLabel('00:00', self.bottom_panel)
         self.end_time_label.setFont(QFont('Arial Rounded MT Bold', 10))
-        self.end_time_label.setStyleSheet("color: white;")
+        set_text_color(self.end_time_label, QColor('white'))
         self.time_labels_layout.addWidget(self.current_time_label)
         self.time_labels_layout.addStretch()
         self.time_labels_layout.addWidget(self.end_time_label)
 
         # Progress bar (full width, slim)
-        self.progress_bar = QProgressBar(self.bottom_panel)
-        self.progress_bar.setStyleSheet("""
-            QProgressBar {
-                color: transparent;
-                border: none;
-                border-radius: 2px;
-                background-color: #505050;
-            }
-            QProgressBar::chunk {
-                background-color: white;
-                border-radius: 2px;
-            }
-        """)
+        self.progress_bar = ProgressWidget(self.bottom_panel)
         self.progress_bar.setFixedHeight(4)  # Slim progress bar
 
-        # Control buttons with FontAwesome icons
+        # Control buttons with FontAwesome icons, rendered once right after the first frame
+        self.icons = None
         self.controls_layout = QHBoxLayout()
         self.controls_layout.setSpacing(20)
         self.controls_layout.setContentsMargins(10, 10, 10, 10)
 
         self.shuffle_button = QPushButton(self.bottom_panel)
-        self.shuffle_button.setIcon(qta.icon('fa.random', color='white'))  # Shuffle icon
         self.shuffle_button.setIconSize(QSize(30, 30))
-        self.shuffle_button.setStyleSheet("background-color: transparent;")
+        self.shuffle_button.setStyleSheet("background-color: transparent; border: none;")
         self.shuffle_button.clicked.connect(self.toggle_shuffle)
 
         self.previous_button = QPushButton(self.bottom_panel)
-        self.previous_button.setIcon(qta.icon('fa.step-backward', color='white'))  # Backward icon
         self.previous_button.setIconSize(QSize(30, 30))
-        self.previous_button.setStyleSheet("background-color: transparent;")
+        self.previous_button.setStyleSheet("background-color: transparent; border: none;")
         self.previous_button.clicked.connect(self.previous_track)
 
         self.play_pause_button = QPushButton(self.bottom_panel)
-        self.play_pause_button.setIcon(qta.icon('fa.play', color='white'))
         self.play_pause_button.setIconSize(QSize(30, 30))
-        self.play_pause_button.setStyleSheet("background-color: transparent;")
+        self.play_pause_button.setStyleSheet("background-color: transparent; border: none;")
         self.play_pause_button.clicked.connect(self.toggle_play_pause)
 
         self.next_button = QPushButton(self.bottom_panel)
-        self.next_button.setIcon(qta.icon('fa.step-forward', color='white'))  # Forward icon
         self.next_button.setIconSize(QSize(30, 30))
-        self.next_button.setStyleSheet("background-color: transparent;")
+        self.next_button.setStyleSheet("background-color: transparent; border: none;")
         self.next_button.clicked.connect(self.next_track)
 
         self.like_button = QPushButton(self.bottom_panel)
-        self.like_button.setIcon(qta.icon('fa.heart-o', color='white'))  # Unliked heart icon
         self.like_button.setIconSize(QSize(30, 30))
-        self.like_button.setStyleSheet("background-color: transparent;")
+        self.like_button.setStyleSheet("background-color: transparent; border: none;")
         self.like_button.clicked.connect(self.like_unlike_track)
 
         # Add buttons to controls layout
@@ -290,6 +4033,74 @@ class SpotifyApp(QWidget):
 
         self.setLayout(self.main_layout)
 
+        # *** Command Palette (Ctrl+K), laid over the content panel ***
+        self.command_palette = CommandPalette(self.services.thumbnail_cache, self.library_path(), self)
+
+        # *** Debug Overlay (F12) ***
+        self.debug_label = QLabel(self)
+        self.debug_label.setFont(QFont('Monospace', 8))
+        self.debug_label.setStyleSheet("color: #B3FFB3; background-color: rgba(0, 0, 0, 190); padding: 4px;")
+        self.debug_label.move(8, 26)
+        self.debug_label.setVisible(False)
+        self.debug_timer = QTimer(self)
+        self.debug_timer.setInterval(1000)
+        self.debug_timer.timeout.connect(self.update_debug_overlay)
+
+    def keyPressEvent(self, event):
+        if event.key() == Qt.Key_F12:
+            self.toggle_debug_overlay()
+        elif event.key() == Qt.Key_K and event.modifiers() & Qt.ControlModifier:
+            self.toggle_command_palette()
+        else:
+            super().keyPressEvent(event)
+
+    def toggle_debug_overlay(self):
+        if self.debug_label.isVisible():
+            self.debug_timer.stop()
+            self.debug_label.setVisible(False)
+            return
+        metrics.enable()  # Collection stays on once the overlay has been opened
+        self.update_debug_overlay()
+        self.debug_label.setVisible(True)
+        self.debug_label.raise_()
+        self.debug_timer.start()
+
+    def update_debug_overlay(self):
+        """
+        Summarize the metrics as count / mean / max lines on the overlay.
+        """
+        def row(title, summary):
+            count, mean, peak = summary
+            return f"{title[:22]:<22} {count:>5} {mean:>7.1f} {peak:>7.1f}"
+
+        lines = [f"{'ms':<22} {'n':>5} {'mean':>7} {'max':>7}"]
+        for labels, summary in sorted(metrics.summary('http_request_duration_ms').items()):
+            lines.append(row(dict(labels)['endpoint'], summary))
+        for name, title in [('poll_jitter_ms', 'poll jitter'), ('poll_duration_ms', 'poll'),
+                            ('art_decode_ms', 'art decode'), ('palette_extract_ms', 'palette'),
+                            ('token_refresh_ms', 'token refresh'), ('library_search_ms', 'library search'),
+                            ('gui_stall_ms', 'GUI stalls')]:
+            for summary in metrics.summary(name).values():
+                lines.append(row(title, summary))
+        for labels, summary in sorted(metrics.summary('gui_slot_ms').items()):
+            lines.append(row(dict(labels)['slot'], summary))
+        repaints = ', '.join(f"{dict(labels)['widget']} {count}"
+                             for labels, count in sorted(metrics.counter('repaints_total').items()))
+        lines.append(f"repaints: {repaints}")
+        if self.startup_times:
+            lines.append("startup: " + ', '.join(f"{milestone.replace('_', ' ')} {ms:.0f} ms"
+                                                 for milestone, ms in self.startup_times.items()))
+        rss = resident_memory_bytes()
+        if rss is not None:
+            lines.append(f"RSS: {rss / 2**20:.1f} MiB")
+        if self.poll_budget:
+            lines.append(f"API requests: {self.poll_budget['requests_last_hour']}/{self.poll_budget['hourly_budget']} per hour")
+        rates = self.power_monitor.wakeup_rates()
+        if rates:
+            lines.append("wakeups/s: " + ', '.join(f"{mode} {rate:.1f}" for mode, rate in sorted(rates.items())))
+        self.debug_label.setText('\n'.join(lines))
+        self.debug_label.adjustSize()
+
     def show_error_message(self, message):
         """
         Display an error message using the error label.
@@ -305,45 +4116,57 @@ class SpotifyApp(QWidget):
 
     # Define functions for like and shuffle functionality
     def like_unlike_track(self):
-        try:
-            current_track = self.sp.current_user_playing_track()
-            if current_track and current_track['item'] and not current_track['item']['is_local']:
-                track_id = current_track['item']['id']
+        state = self.view_state
+        # Local files cannot be liked
+        if state is None or not state.track_id:
+            return
+        self.show_state(state._replace(is_liked=self.commands.toggle('is_liked', state.is_liked, state.track_id)))
 
-                # Check if the track is already liked
-                is_liked = self.sp.current_user_saved_tracks_contains([track_id])[0]
+    def toggle_shuffle(self):
+        state = self.view_state or PlaybackState()
+        self.show_state(state._replace(shuffle_state=self.commands.toggle('shuffle_state', state.shuffle_state)))
 
-                if is_liked:
-                    # If liked, remove from liked tracks
-                    self.sp.current_user_saved_tracks_delete([track_id])
-                    self.like_button.setIcon(qta.icon('fa.heart-o', color='white'))  # Unliked icon
-                else:
-                    # If not liked, add to liked tracks
-                    self.sp.current_user_saved_tracks_add([track_id])
-                    self.like_button.setIcon(qta.icon('fa.heart', color='red'))  # Liked icon
-        except Exception as e:
-            # Show error message box instead of printing
-            self.show_error_message(f"Error in like_unlike_track: {e}")
+    def toggle_play_pause(self):
+        state = self.view_state or PlaybackState()
+        self.show_state(state._replace(is_playing=self.commands.toggle('is_playing', state.is_playing)))
 
-    def toggle_shuffle(self):
-        try:
-            current_playback = self.sp.current_playback()
-            if current_playback:
-                current_state = current_playback['shuffle_state']
-                self.sp.shuffle(not current_state)
-                # Update the shuffle button icon
-                if not current_state:
-                    self.shuffle_button.setIcon(qta.icon('fa.random', color='green'))  # Shuffle enabled
-                else:
-                    self.shuffle_button.setIcon(qta.icon('fa.random', color='white'))  # Shuffle disabled
-            else:
-                self.show_error_message("No active playback found.")
-        except spotipy.exceptions.SpotifyException as e:
-            self.show_error_message(f"Spotify API Error in toggle_shuffle: {e}")
-        except Exception as e:
-            self.show_error_message(f"Error in toggle_shuffle: {e}")
+    def previous_track(self):
+        self.skip_track(-1)
+
+    def next_track(self):
+        self.skip_track(1)
 
-    def handle_track_data(self, current_track):
+    def skip_track(self, count):
+        """
+        Skip optimistically, showing the target track straight from the prefetched queue when known.
+        """
+        offset = self.commands.skip(count)
+        base = self.confirmed_state or PlaybackState()
+        if 0 < offset <= len(self.upcoming_tracks):
+            item = self.upcoming_tracks[offset - 1]
+            state = PlaybackState.from_track({
+                'item': item,
+                'progress_ms': 0,
+                'is_playing': True,
+                'is_liked': item.get('is_liked', False),
+                'shuffle_state': base.shuffle_state,
+                'sampled_at': time.monotonic(),
+            })
+        else:
+            # Unknown target (going back, or past the known queue): restart the progress display
+            state = (self.view_state or base)._replace(progress_ms=0, sampled_at=time.monotonic())
+        overlay = {field: value for field, value in self.commands.overlay.items() if field != 'is_liked'}
+        self.show_state(state._replace(**overlay))
+
+    def handle_command_error(self, command, error_message):
+        self.commands.handle_error(command, error_message)
+        self.show_error_message(error_message)
+        # Roll back to the last state confirmed by the API
+        if self.confirmed_state is not None:
+            self.show_state(self.confirmed_state)
+
+    @timed('gui_slot_ms', slot='handle_state')
+    def handle_state(self, state):
         # Reset connection error flag since data was fetched successfully
         if self.connection_error:
             # Optionally notify the user that the connection has been restored
@@ -351,136 +4174,222 @@ class SpotifyApp(QWidget):
             QTimer.singleShot(3000, self.hide_error_message)  # Hide after 3 seconds
         self.connection_error = False
 
-        if current_track is not None and current_track['item'] is not None:
-            track_id = current_track['item']['id']
-            is_playing = current_track['is_playing']
-            duration_ms = current_track['item']['duration_ms']
-            progress_ms = current_track['progress_ms']
-            album_url = current_track['item']['album']['images'][0]['url']
-            album_name = current_track['item']['album']['name']
-            # **Only fetch album art if it has changed**
-            if album_url != self.current_album_url:
-                self.current_album_url = album_url
-                request = QNetworkRequest(QUrl(album_url))
-                self.network_manager.get(request)
-            # Update track info
-            self.album_name_label.setText(album_name)
-            self.track_name_label.setText(current_track['item']['name'])
-            self.artist_name_label.setText(current_track['item']['artists'][0]['name'])
-            self.current_time_label.setText(f"{progress_ms // 1000 // 60:02}:{progress_ms // 1000 % 60:02}")
-            self.end_time_label.setText(f"{duration_ms // 1000 // 60:02}:{duration_ms // 1000 % 60:02}")
-
-            # Update progress bar
-            self.progress_bar.setMaximum(duration_ms)
-            self.progress_bar.setValue(progress_ms)
-
-            # Update play/pause button icon
-            if is_playing:
-                self.play_pause_button.setIcon(qta.icon('fa.pause', color='white'))  # Pause icon
-            else:
-                self.play_pause_button.setIcon(qta.icon('fa.play', color='white'))  # Play icon
+        if self.confirmed_state is None or state.track_id != self.confirmed_state.track_id:
+            self.track_list.recent_stale = True  # The previous track is now the most recently played
+        self.confirmed_state = state
+        if 'live_data' not in self.startup_times:
+            self.mark_startup('live_data')
 
-            # Update like button icon
-            is_liked = self.sp.current_user_saved_tracks_contains([track_id])[0]
-            if is_liked:
-                self.like_button.setIcon(qta.icon('fa.heart', color='red'))  # Liked icon
-            else:
-                self.like_button.setIcon(qta.icon('fa.heart-o', color='white'))  # Unliked icon
+        # Keep optimistic changes on screen until the API confirms them
+        state = self.commands.reconcile(state)
+        if state is not None and self.hidden:
+            self.pending_state = state
+        elif state is not None:
+            self.show_state(state)
+            self.track_list.refresh_if_stale()
 
-            # **Retrieve and update shuffle status**
-            try:
-                current_playback = self.sp.current_playback()
-                if current_playback:
-                    shuffle_state = current_playback['shuffle_state']
-                    if shuffle_state:
-                        self.shuffle_button.setIcon(qta.icon('fa.random', color='green'))  # Shuffle enabled
-                    else:
-                        self.shuffle_button.setIcon(qta.icon('fa.random', color='white'))  # Shuffle disabled
-                else:
-                    self.show_error_message("No active playback found.")
-            except spotipy.exceptions.SpotifyException as e:
-                self.show_error_message(f"Spotify API Error in handle_track_data when checking shuffle state: {e}")
-            except Exception as e:
-                self.show_error_message(f"Error in handle_track_data when checking shuffle state: {e}")
+    def show_state(self, state):
+        # **Only fetch album art if it has changed**
+        if state.album_url != self.current_album_url:
+            self.current_album_url = state.album_url
+            # Drop downloads for art that is neither on screen nor queued for prefetching
+            self.art_cache.cancel_stale({state.album_url} | self.prefetcher.active | set(self.prefetcher.waiting),
+                                        owner=self)
+            pixmap = self.art_cache.request(state.album_url) if state.album_url else None
+            if pixmap is not None:
+                self.update_album_art(state.album_url, pixmap)
+        self.render_state(state)
+
+    def render_state(self, state):
+        """
+        Diff state against what is on screen and only touch the widgets that changed.
+        """
+        old = self.view_state
+        self.view_state = state
+        changed = set(state._fields) if old is None else {
+            field for field in state._fields if getattr(state, field) != getattr(old, field)
+        }
+        if not changed:
+            return
+
+        # Update track info
+        if 'album_name' in changed:
+            self.album_name_label.setText(state.album_name)
+        if 'track_name' in changed:
+            self.track_name_label.setText(state.track_name)
+        if 'artist_name' in changed:
+            self.artist_name_label.setText(state.artist_name)
+        if 'end_time' in changed:
+            self.end_time_label.setText(state.end_time)
+
+        # Re-anchor the playback clock; it drives the progress bar between polls
+        if 'sampled_at' in changed or 'duration_ms' in changed:
+            self.clock.sync(state.progress_ms, state.duration_ms, state.is_playing, state.sampled_at)
+        elif 'is_playing' in changed:
+            self.clock.set_playing(state.is_playing)
+        self.update_progress()
+        self.start_progress_timer()
+
+        # Update button icons from the pre-rendered cache
+        if self.icons is None:
+            return  # load_icons applies the current state once they exist
+        if 'is_playing' in changed:
+            self.play_pause_button.setIcon(self.icons['pause'] if state.is_playing else self.icons['play'])
+        if 'is_liked' in changed:
+            self.like_button.setIcon(self.icons['heart'] if state.is_liked else self.icons['heart-o'])
+        if 'shuffle_state' in changed:
+            self.shuffle_button.setIcon(self.icons['random-on'] if state.shuffle_state else self.icons['random'])
 
-            # Load album art asynchronously using QNetworkAccessManager
-            request = QNetworkRequest(QUrl(album_url))
-            self.network_manager.get(request)
+    def start_progress_timer(self):
+        if self.clock.is_playing and self.clock.duration_ms and not self.hidden:
+            if not self.progress_timer.isActive():
+                self.progress_timer.start(self.progress_interval_ms())
         else:
-            if not self.connection_error:
-                # Clear track info if no track is playing and no connection error
-                self.album_name_label.setText('')
-                self.track_name_label.setText('No track playing')
-                self.artist_name_label.setText('')
-                self.current_time_label.setText('00:00')
-                self.end_time_label.setText('00:00')
-                self.progress_bar.setValue(0)
-                self.play_pause_button.setIcon(qta.icon('fa.play', color='white'))  # Reset to play icon
-
-    def update_album_art(self, reply):
-        if reply.error() == reply.NoError:
-            image_data = reply.readAll()
-            image = QImage()
-            image.loadFromData(image_data)
-            # Create a shadow effect for the album art
-            shadow = QGraphicsDropShadowEffect()
-            shadow.setBlurRadius(20)
-            shadow.setXOffset(10)
-            shadow.setYOffset(5)
-            shadow.setColor(QColor(0, 0, 0, 190))
-            self.album_art_label.setGraphicsEffect(shadow)
-            self.album_art_label.setPixmap(QPixmap(image).scaled(190, 190, Qt.KeepAspectRatio))
-
-            # Now, sample color from the image
-            width = image.width()
-            height = image.height()
-            center_color = QColor(image.pixel(width // 2, height // 2))
-
-            # Adjust the color to be darker for the bottom panel
-            darker_color = center_color.darker(300)  # Factor >100 makes it darker
-            color_string_bottom = darker_color.name()  # Hex color code
-
-            # Adjust the color to be lighter for the content panel (previously top panel)
-            lighter_color = center_color.lighter(60)  # Factor >100 makes it lighter
-            color_string_top = lighter_color.name()
-
-            # Set the background colors of the panels
-            self.content_panel.setStyleSheet(f" background-color: {color_string_top}; ")
-            self.bottom_panel.setStyleSheet(f"background-color: {color_string_bottom}; border-top-left-radius: 0px; border-top-right-radius: 0px; border-bottom-left-radius: 15px; border-bottom-right-radius: 15px;")
-            self.top_bar.setStyleSheet(f"background-color: {color_string_top}; border-top-left-radius: 15px; border-top-right-radius: 15px; border-bottom-left-radius: 0px; border-bottom-right-radius: 0px;")  # Background color with rounded top corners
-
-            # Convert the top panel's background color to a QColor object
-            top_color = QColor(color_string_top)
-
-            # Get RGB values
-            r = top_color.red()
-            g = top_color.green()
-            b = top_color.blue()
-
-            # Calculate perceived brightness (standard formula)
-            brightness = (r * 299 + g * 587 + b * 114) / 1000
-            # Decide if the background is light or dark
-            if brightness < 80:
-                background_is_dark = True
-            else:
-                background_is_dark = False
-            # Base gray color
-            base_gray = QColor('#2B2B2B')
-            if background_is_dark:
-                # Background is dark, lighten the gray color
-                adjusted_gray = base_gray.lighter(300)  # Adjust the factor as needed
-            else:
-                # Background is light, darken the gray color
-                adjusted_gray = base_gray.darker(200)   # Adjust the factor as needed
+            self.progress_timer.stop()
+
+    def progress_interval_ms(self):
+        """
+        Tick about once per pixel of progress, but no faster than the display refreshes.
+        """
+        refresh_rate = QApplication.primaryScreen().refreshRate()
+        frame_ms = 1000 / refresh_rate if refresh_rate > 0 else 1000 / 60
+        ms_per_pixel = self.clock.duration_ms / max(self.progress_bar.width(), 1)
+        # Tick at least every 250 ms so the time label stays close to the second boundary
+        return int(max(frame_ms, min(ms_per_pixel, 250)))
 
-            # Get the hex code of the adjusted gray color
-            text_color = adjusted_gray.name()
-            self.album_name_label.setStyleSheet(f"color: {text_color};")
+    def update_progress(self):
+        """
+        Show the clock's position on the progress bar and the current time label.
+        """
+        if self.clock.duration_ms:
+            position_ms = self.clock.position_ms()
+            current_time = format_time(position_ms)
+            self.progress_bar.set_fraction(position_ms / self.clock.duration_ms)
         else:
+            current_time = self.view_state.current_time
+            self.progress_bar.set_fraction(0)
+        if self.current_time_label.text() != current_time:
+            self.current_time_label.setText(current_time)
+
+    @timed('gui_slot_ms', slot='handle_queue')
+    def handle_queue(self, upcoming_tracks):
+        """
+        Warm the art cache and theme colors for the next tracks in the queue.
+        """
+        self.upcoming_tracks = upcoming_tracks
+        self.track_list.queue_model.set_tracks(upcoming_tracks)
+        if not self.hidden:
+            self.prefetcher.prefetch([track['album']['images'][0]['url']
+                                      for track in upcoming_tracks[:prefetch_depth] if track['album']['images']])
+
+    def handle_visibility(self, visible):
+        """
+        Suspend rendering while the window cannot be seen and catch up as soon as it can.
+        """
+        self.hidden = not visible
+        self.background_signal.emit(self.hidden)
+        if metrics.stall_detector is not None:
+            metrics.stall_detector.set_paused(PowerMonitor.all_hidden())
+        if self.hidden:
+            self.progress_timer.stop()
+            self.debug_timer.stop()
+            self.theme_transition.finish()
+            return
+
+        # Show what arrived meanwhile with the clock's position straight away; the worker
+        # polls for fresh state at the same time
+        state, self.pending_state = self.pending_state, None
+        if state is not None:
+            self.show_state(state)
+        if self.view_state is not None:
+            self.update_progress()
+        self.start_progress_timer()
+        self.handle_queue(self.upcoming_tracks)
+        self.track_list.refresh_if_stale()
+        if self.debug_label.isVisible():
+            self.update_debug_overlay()
+            self.debug_timer.start()
+
+    def handle_art_ready(self, url, pixmap):
+        # Ignore art that finished loading after the track already changed
+        if url == self.current_album_url:
+            self.update_album_art(url, pixmap)
+
+    def handle_art_error(self, url, error_message):
+        if url == self.current_album_url:
             # Instead of showing a QMessageBox, display the error in the error label
-            self.show_error_message(f"Error loading image: {reply.errorString()}")
+            self.show_error_message(f"Error loading image: {error_message}")
+
+    @timed('gui_slot_ms', slot='update_album_art')
+    def update_album_art(self, url, pixmap):
+        # Create a shadow effect for the album art
+        shadow = QGraphicsDropShadowEffect()
+        shadow.setBlurRadius(20)
+        shadow.setXOffset(10)
+        shadow.setYOffset(5)
+        shadow.setColor(QColor(0, 0, 0, 190))
+        self.album_art_label.setGraphicsEffect(shadow)
+        self.album_art_label.setPixmap(pixmap)
+
+        # The colors follow once the palette engine has them, usually straight from its cache
+        theme = self.palette_engine.request(url, self.art_cache.thumbnail(url, pixmap))
+        if theme is not None:
+            self.apply_theme(theme)
+
+    def prefetch_palette(self, url, pixmap):
+        self.palette_engine.request(url, self.art_cache.thumbnail(url, pixmap))
+
+    def handle_palette_ready(self, url, theme):
+        if url == self.current_album_url:
+            self.apply_theme(theme)
+
+    def apply_theme(self, theme):
+        self.theme_transition.start(theme, animate=not self.hidden)
+        # Remember the new track and its colors for the next cold start
+        if self.confirmed_state is not None and self.confirmed_state.album_url == self.current_album_url:
+            self.save_last_state()
+
+    @timed('gui_slot_ms', slot='paint_theme')
+    def paint_theme(self, theme):
+        # Set the background colors of the panels; they repaint themselves without a style recompute
+        self.content_panel.set_color(QColor(theme['top']))
+        self.bottom_panel.set_color(QColor(theme['bottom']))
+        self.top_bar.set_color(QColor(theme['top']))
+        set_text_color(self.album_name_label, QColor(theme['secondary']))
+        set_text_color(self.track_name_label, QColor(theme['text']))
+        set_text_color(self.artist_name_label, QColor(theme['text']))
+        self.track_list.set_theme(theme)
+        self.command_palette.set_theme(theme)
+
+    def handle_budget(self, budget):
+        self.poll_budget = budget
 
-        reply.deleteLater()
+    def toggle_track_list(self):
+        """
+        Show or hide the track list; the window grows to the left, away from the screen edge.
+        """
+        showing = not self.track_list.isVisible()
+        width = track_list_width + self.content_layout.spacing()
+        if not showing:
+            width = -width
+        self.track_list.setVisible(showing)
+        self.setFixedSize(self.width() + width, self.height())
+        self.move(self.x() - width, self.y())
+
+    def toggle_command_palette(self):
+        if self.command_palette.isVisible():
+            self.command_palette.setVisible(False)
+        else:
+            self.command_palette.setGeometry(self.content_panel.geometry())
+            self.command_palette.open()
+
+    def play_uri(self, uri):
+        # Confirmed by the poll the command triggers, like the other playback commands
+        self.commands.send('play', uri)
+
+    def handle_recently_played_error(self, error_message):
+        self.track_list.recent_model.fetch_failed()
+        self.show_error_message(error_message)
 
     def handle_error(self, error_message):
         if not self.connection_error:
@@ -489,39 +4398,10 @@ class SpotifyApp(QWidget):
             self.connection_error = True  # Set the connection error flag
             # Update UI to show no internet connection
             self.current_album_url = None
-            self.track_name_label.setText("No internet connection")
-            self.album_name_label.setText('')
-            self.artist_name_label.setText('')
-            self.current_time_label.setText('--:--')
-            self.end_time_label.setText('--:--')
-            self.progress_bar.setValue(0)
-            self.play_pause_button.setIcon(qta.icon('fa.play', color='white'))  # Reset to play icon
+            self.render_state(PlaybackState(track_name="No internet connection",
+                                            current_time='--:--', end_time='--:--'))
             self.album_art_label.clear()
 
-    def toggle_play_pause(self):
-        try:
-            current_track = self.sp.current_user_playing_track()
-            if current_track and current_track['is_playing']:
-                self.sp.pause_playback()
-            else:
-                self.sp.start_playback()
-        except spotipy.SpotifyException as e:
-            self.show_error_message(f"Spotify API Error: {e}")
-        except Exception as e:
-            self.show_error_message(f"Error: {e}")
-
-    def previous_track(self):
-        try:
-            self.sp.previous_track()
-        except Exception as e:
-            self.show_error_message(f"Error: {e}")
-
-    def next_track(self):
-        try:
-            self.sp.next_track()
-        except Exception as e:
-            self.show_error_message(f"Error: {e}")
-
     # *** Close Application Function ***
     def close_application(self):
         self.close()
@@ -545,28 +4425,143 @@ class SpotifyApp(QWidget):
         return 0 <= pos.y() <= self.top_bar.height()
 
 
+def load_display_config(path):
+    """
+    Read a multi-display config and return (poll threads, displays).
+
+    The file holds a JSON object with a "displays" list. Each display runs
+    in its own window for its own account and may set "name", "client_id",
+    "client_secret", "redirect_uri", "hourly_request_budget", "playback_source",
+    "screen" (index) and "position" ([x, y]). Missing settings fall back to the
+    values at the top of this file.
+    """
+    with open(path) as f:
+        config = json.load(f)
+    defaults = {'client_id': client_id, 'client_secret': client_secret, 'redirect_uri': redirect_uri,
+                'hourly_request_budget': hourly_request_budget, 'playback_source': playback_source}
+    displays = [{**defaults, 'name': f"display{i + 1}", **display} for i, display in enumerate(config['displays'])]
+    return config.get('poll_threads', poll_threads), displays
+
+
+def client_factory(display, transport):
+    """
+    Return a callable that builds the spotipy client for one display's account.
+    """
+    token_path = os.path.join(cache_dir, f"token_{display['name']}.json") if display['name'] else None
+
+    def create_client():
+        # Runs on the worker thread, so authentication never delays the first frame
+        auth_manager = spotipy.oauth2.SpotifyOAuth(client_id=display['client_id'],
+                                                   client_secret=display['client_secret'],
+                                                   redirect_uri=display['redirect_uri'],
+                                                   scope=scope,
+                                                   cache_handler=create_token_store(token_path),
+                                                   requests_session=transport.session)
+        # The transport's retry policy leaves 429 to the poll scheduler instead of blocking in urllib3
+        return spotipy.Spotify(auth_manager=auth_manager, requests_session=transport.session)
+
+    return create_client
+
+
+def place_window(window, display):
+    if 'position' in display:
+        window.move(*display['position'])
+    elif 'screen' in display:
+        screens = QApplication.screens()
+        geometry = screens[display['screen'] % len(screens)].availableGeometry()
+        window.move(geometry.x() + geometry.width() - window.width(),
+                    geometry.y() + geometry.height() - window.height())
+
+
+def default_display():
+    return {'name': None, 'client_id': client_id, 'client_secret': client_secret, 'redirect_uri': redirect_uri,
+            'hourly_request_budget': hourly_request_budget, 'playback_source': playback_source}
+
+
+def run_daemon(app, socket_name):
+    """
+    Poll Spotify without a window and publish the playback state until interrupted.
+    """
+    transport = HttpTransport()
+    services = SharedServices(transport)
+    daemon = PlaybackDaemon(client_factory(default_display(), transport), services, socket_name)
+    if not daemon.start():
+        return 1
+
+    # Let Ctrl+C and SIGTERM stop the event loop. Python only runs signal handlers once the
+    # interpreter gets control back, so the signal's byte on a socket pair wakes the event loop
+    # instead of a polling timer
+    import socket
+    wakeup_reader, wakeup_writer = socket.socketpair()
+    wakeup_writer.setblocking(False)
+    signal.set_wakeup_fd(wakeup_writer.fileno())
+    notifier = QSocketNotifier(wakeup_reader.fileno(), QSocketNotifier.Read)
+    notifier.activated.connect(lambda: wakeup_reader.recv(64))
+    signal.signal(signal.SIGINT, lambda *args: app.quit())
+    signal.signal(signal.SIGTERM, lambda *args: app.quit())
+
+    print(f"Publishing playback state on {daemon.server.fullServerName()}")
+    exit_code = app.exec_()
+    daemon.stop()
+    return exit_code
+
+
 def main():
-    app = QApplication(sys.argv)
+    parser = argparse.ArgumentParser(description="Spotify Mini Carthing")
+    parser.add_argument('--config', help="JSON file listing the accounts and displays to run in this process")
+    parser.add_argument('--daemon', action='store_true',
+                        help="poll Spotify without a window and publish the playback state to local subscribers")
+    parser.add_argument('--subscribe', action='store_true',
+                        help="show the playback state published by a running --daemon instead of polling Spotify")
+    parser.add_argument('--socket', default=daemon_socket_name, help="local socket name used by --daemon and --subscribe")
+    args, qt_args = parser.parse_known_args()
 
-    # Perform Spotify authentication before creating the app
-    auth_manager = SpotifyOAuth(client_id=client_id,
-                                client_secret=client_secret,
-                                redirect_uri=redirect_uri,
-                                scope=scope)
-    sp = spotipy.Spotify(auth_manager=auth_manager)
+    if args.daemon:
+        # Album art is still decoded into pixmaps for the palette, which needs a GUI platform
+        os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+        app = QGuiApplication(sys.argv[:1] + qt_args)
+        sys.exit(run_daemon(app, args.socket))
 
-    # Test authentication
-    try:
-        user = sp.current_user()
-        print(f"Logged in as {user['display_name']}")
-    except spotipy.exceptions.SpotifyException as e:
-        # Instead of showing QMessageBox here, you can use a temporary window or print to console
-        QMessageBox.critical(None, "Authentication Error", f"Spotify authentication failed: {e}")
-        sys.exit()
-
-    spotify_app = SpotifyApp(sp)
-    spotify_app.show()
-    sys.exit(app.exec_())
+    app = QApplication(sys.argv[:1] + qt_args)
+
+    if metrics_port or debug_overlay:
+        metrics.enable()
+    if metrics_port:
+        start_metrics_server(metrics_port)
+
+    if args.subscribe:
+        # The daemon polls, downloads art and extracts palettes; this window only displays them
+        services = SharedServices(HttpTransport(), download_art=False)
+        worker = RemoteWorker(args.socket)
+        worker.art_file_signal.connect(services.art_cache.add_file)
+        worker.art_error_signal.connect(services.art_cache.art_error_signal)
+        worker.palette_signal.connect(services.palette_engine.add)
+        window = SpotifyApp(None, services=services, worker=worker)
+        window.show()
+        exit_code = app.exec_()
+        services.stop()
+        sys.exit(exit_code)
+
+    if args.config:
+        threads, displays = load_display_config(args.config)
+    else:
+        threads, displays = poll_threads, [default_display()]
+
+    # One pooled HTTP transport for the API clients, token refreshes and album art, and one
+    # set of caches and poll threads for every display; first polls are spread over a poll interval
+    transport = HttpTransport(pool_size=max(http_pool_size, (threads or len(displays)) + art_download_threads))
+    services = SharedServices(transport, threads, stagger_ms=PollScheduler().playing_interval_ms // len(displays))
+
+    windows = []
+    for display in displays:
+        window = SpotifyApp(client_factory(display, transport), services=services, name=display['name'],
+                            hourly_budget=display['hourly_request_budget'], source=display['playback_source'])
+        place_window(window, display)
+        window.show()
+        windows.append(window)
+    exit_code = app.exec_()
+    services.stop()
+    sys.exit(exit_code)
 
 
 if __name__ == '__main__':
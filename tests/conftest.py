@@ -0,0 +1,80 @@
+import os
+import sys
+import shutil
+import threading
+import subprocess
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PyQt5.QtCore import QEventLoop, QTimer  # noqa: E402
+from PyQt5.QtWidgets import QApplication  # noqa: E402
+
+import benchmark  # noqa: E402
+import main  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def qapp():
+    return QApplication.instance() or QApplication([])
+
+
+@pytest.fixture
+def wait_until(qapp):
+    """
+    Run the event loop until condition() is true or timeout_ms has passed, and return condition().
+    """
+
+    def wait(condition, timeout_ms=3000):
+        loop = QEventLoop()
+        poll = QTimer()
+        poll.timeout.connect(lambda: condition() and loop.quit())
+        poll.start(10)
+        QTimer.singleShot(timeout_ms, loop.quit)
+        if not condition():
+            loop.exec_()
+        poll.stop()
+        return condition()
+
+    return wait
+
+
+@pytest.fixture(scope='session')
+def session_bus():
+    """
+    Start a private D-Bus session bus and return its address.
+
+    The process connects to its session bus only once, so no test may use
+    QDBusConnection.sessionBus() without this fixture.
+    """
+    if main.QtDBus is None or shutil.which('dbus-daemon') is None:
+        pytest.skip("needs QtDBus and dbus-daemon")
+    bus = subprocess.Popen(['dbus-daemon', '--session', '--nofork', '--print-address'],
+                           stdout=subprocess.PIPE, text=True)
+    address = bus.stdout.readline().strip()
+    os.environ['DBUS_SESSION_BUS_ADDRESS'] = address
+    yield address
+    bus.kill()
+    bus.wait()
+
+
+@pytest.fixture
+def fake_api(qapp):
+    """
+    Serve the benchmark's fake Spotify Web API and return (player, spotipy client for it).
+
+    Nothing changes on its own: tracks are ten minutes long and there is no script.
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), benchmark.FakeSpotifyHandler)
+    server.daemon_threads = True
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    server.player = benchmark.FakePlayer({'track_ms': 600000, 'events': []}, base_url)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    sp = main.spotipy.Spotify(auth='test-token', requests_session=main.HttpTransport().session)
+    sp.prefix = f"{base_url}/v1/"
+    yield server.player, sp
+    server.shutdown()
+    server.server_close()
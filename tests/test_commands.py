@@ -0,0 +1,127 @@
+import time
+
+import main
+
+
+def flushed(pipeline):
+    sent = []
+    pipeline.command_signal.connect(lambda command, args: sent.append((command, args)))
+    # What the coalescing timer would do at the end of the window
+    pipeline.flush_timer.stop()
+    pipeline.flush()
+    return sent
+
+
+def test_repeated_skips_become_one_command(qapp):
+    pipeline = main.CommandPipeline()
+    assert [pipeline.skip(1) for _ in range(3)] == [1, 2, 3]
+    assert flushed(pipeline) == [('skip', 3)]
+
+
+def test_taps_that_cancel_out_are_not_sent(qapp):
+    pipeline = main.CommandPipeline()
+    pipeline.skip(1)
+    pipeline.skip(-1)
+    assert pipeline.toggle('is_playing', True) is False
+    assert pipeline.toggle('is_playing', False) is True
+    pipeline.toggle('is_liked', False, track_id='a')
+    assert flushed(pipeline) == [('set_liked', ('a', True))]
+
+
+def test_likes_of_different_tracks_are_all_sent(qapp):
+    pipeline = main.CommandPipeline()
+    pipeline.toggle('is_liked', False, track_id='a')
+    pipeline.skip(1)
+    # Not a double tap: B is a different track, liked or not
+    pipeline.toggle('is_liked', True, track_id='b')
+    pipeline.toggle('is_liked', False, track_id='c')
+    assert flushed(pipeline) == [('set_liked', ('a', True)), ('set_liked', ('b', False)),
+                                 ('set_liked', ('c', True)), ('skip', 1)]
+
+
+def test_optimistic_state_is_kept_until_a_later_snapshot_confirms_it(qapp):
+    pipeline = main.CommandPipeline()
+    pipeline.toggle('is_playing', True)
+    flushed(pipeline)
+    before = main.PlaybackState(track_name='Track', is_playing=True, sampled_at=time.monotonic())
+
+    # Sampled while the command was in flight: the tap wins
+    assert pipeline.reconcile(before).is_playing is False
+
+    pipeline.handle_result('set_playing', {'is_playing': False})
+    assert pipeline.reconcile(before).is_playing is False
+    after = before._replace(is_playing=False, sampled_at=time.monotonic())
+    assert pipeline.reconcile(after) is after
+    assert pipeline.overlay == {}
+
+
+def test_failed_command_rolls_back(qapp):
+    pipeline = main.CommandPipeline()
+    pipeline.toggle('shuffle_state', False)
+    pipeline.skip(1)
+    flushed(pipeline)
+    pipeline.handle_error('set_shuffle', 'failed')
+    pipeline.handle_result('skip', {})
+    state = main.PlaybackState(track_name='Track', shuffle_state=False, sampled_at=time.monotonic())
+    assert pipeline.reconcile(state) is state
+
+
+class SkipClient:
+    """
+    A spotipy.Spotify stand-in playing track 0 of a playlist, recording the skip requests.
+    """
+
+    def __init__(self, context_type='playlist', shuffle_state=False, offsets_found=True):
+        self.context = {'type': context_type, 'uri': 'spotify:playlist:mix'}
+        self.shuffle_state = shuffle_state
+        self.offsets_found = offsets_found
+        self.calls = []
+
+    def current_playback(self):
+        return {'item': {'id': 't0', 'name': 'Track 0', 'is_local': False, 'duration_ms': 200000,
+                         'artists': [{'name': 'Artist'}], 'album': {'name': 'Album', 'images': []}},
+                'progress_ms': 0, 'is_playing': True, 'shuffle_state': self.shuffle_state, 'context': self.context}
+
+    def queue(self):
+        return {'queue': [{'id': f"t{n}", 'uri': f"spotify:track:t{n}", 'type': 'track'} for n in range(1, 6)]}
+
+    def current_user_saved_tracks_contains(self, track_ids):
+        return [False for _ in track_ids]
+
+    def start_playback(self, context_uri, offset):
+        self.calls.append(('start_playback', context_uri, offset['uri']))
+        if not self.offsets_found:
+            raise main.spotipy.exceptions.SpotifyException(404, -1, 'Not found')
+
+    def next_track(self):
+        self.calls.append('next_track')
+
+    def previous_track(self):
+        self.calls.append('previous_track')
+
+
+def skipped(client, count):
+    worker = main.Worker(client)
+    worker.start()
+    worker.fetch_track_data()
+    client.calls.clear()
+    worker.command_skip(count)
+    worker.stop()
+    return client.calls
+
+
+def test_skip_by_n_starts_the_target_in_the_context(qapp):
+    assert skipped(SkipClient(), 3) == [('start_playback', 'spotify:playlist:mix', 'spotify:track:t3')]
+    assert skipped(SkipClient(context_type='album'), 2) == [('start_playback', 'spotify:playlist:mix',
+                                                             'spotify:track:t2')]
+
+
+def test_skip_by_n_falls_back_to_one_request_per_track(qapp):
+    assert skipped(SkipClient(), 1) == ['next_track']
+    assert skipped(SkipClient(), -2) == ['previous_track'] * 2
+    assert skipped(SkipClient(), 6) == ['next_track'] * 6  # Beyond the known queue
+    assert skipped(SkipClient(shuffle_state=True), 2) == ['next_track'] * 2
+    assert skipped(SkipClient(context_type='artist'), 2) == ['next_track'] * 2
+    # The target was not in the context, e.g. a track the user queued
+    assert skipped(SkipClient(offsets_found=False), 2) == [
+        ('start_playback', 'spotify:playlist:mix', 'spotify:track:t2'), 'next_track', 'next_track']
@@ -0,0 +1,93 @@
+import pytest
+
+import main
+
+
+class FakeSocket:
+
+    def __init__(self, *chunks):
+        self.chunks = list(chunks)
+
+    def readAll(self):
+        return self.chunks.pop(0) if self.chunks else b''
+
+
+def test_read_messages_keeps_partial_lines_for_the_next_read():
+    socket = FakeSocket(b'{"type": "state", "changes": {}}\n{"type": "que', b'ue", "tracks": []}\n\n')
+    buffer = bytearray()
+
+    assert main.read_messages(socket, buffer) == [{'type': 'state', 'changes': {}}]
+    assert buffer == b'{"type": "que'
+    assert main.read_messages(socket, buffer) == [{'type': 'queue', 'tracks': []}]
+    assert buffer == b''
+
+
+def test_read_messages_rejects_garbage():
+    with pytest.raises(ValueError):
+        main.read_messages(FakeSocket(b'not json\n'), bytearray())
+
+
+@pytest.mark.parametrize('started', [False, True])
+def test_commands_without_a_daemon_fail_instead_of_raising(qapp, started):
+    worker = main.RemoteWorker('spotify_mini_carthing_test_no_daemon')
+    if started:
+        worker.start()  # Nothing listens on the socket, so it stays unconnected
+    errors = []
+    worker.command_error_signal.connect(lambda command, message: errors.append(command))
+
+    worker.execute_command('set_playing', True)
+    worker.poll_soon()
+    worker.set_background(True)
+    worker.stop()
+
+    assert errors == ['set_playing']
+
+
+def test_remote_worker_skips_malformed_messages(qapp):
+    worker = main.RemoteWorker()
+    worker.socket = FakeSocket(b'[]\n{"type": "state"}\n{"type": "state", "changes": {"no_such_field": 1}}\n'
+                               b'{"type": "queue", "tracks": {}}\n{"type": ["state"]}\n'
+                               b'{"type": "state", "changes": {"track_name": "A"}}\n')
+    states = []
+    worker.state_signal.connect(states.append)
+    worker.handle_readable()
+    assert [state.track_name for state in states] == ['A']
+
+
+@pytest.mark.parametrize('line', [
+    b'[]',
+    b'{"type": "command", "command": "skip"}',
+    b'{"type": "command", "command": 1, "args": 1}',
+    b'{"type": "recently_played"}',
+    b'{"type": "background", "background": "yes"}',
+    b'{"type": {}}',
+    b'{"type": "unknown"}',
+    b'[' * 100000,
+])
+def test_daemon_drops_only_the_subscriber_sending_a_malformed_message(fake_api, wait_until, monkeypatch, tmp_path,
+                                                                      line):
+    monkeypatch.setattr(main, 'library_file', str(tmp_path / 'library.sqlite3'))
+    socket_name = f"spotify_mini_carthing_test_{tmp_path.name}"
+    daemon = main.PlaybackDaemon(fake_api[1], main.SharedServices(main.HttpTransport(), download_art=False),
+                                 socket_name)
+    assert daemon.start()
+    good, bad = main.QLocalSocket(), main.QLocalSocket()
+    try:
+        for socket in (good, bad):
+            socket.connectToServer(socket_name)
+            assert socket.waitForConnected(1000)
+        assert wait_until(lambda: len(daemon.subscribers) == 2)
+
+        bad.write(line + b'\n')
+        bad.flush()
+        assert wait_until(lambda: bad.state() == main.QLocalSocket.UnconnectedState)
+        assert len(daemon.subscribers) == 1
+        assert good.state() == main.QLocalSocket.ConnectedState
+        # The daemon still serves the others
+        main.send_message(good, {'type': 'background', 'background': True})
+        good.flush()
+        assert wait_until(lambda: len(daemon.hidden_subscribers) == 1)
+    finally:
+        good.abort()
+        wait_until(lambda: not daemon.subscribers)
+        daemon.stop()
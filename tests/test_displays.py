@@ -0,0 +1,103 @@
+import json
+import time
+
+import spotipy
+from PyQt5.QtCore import QObject, pyqtSlot
+
+import main
+
+
+class Member(QObject):
+
+    @pyqtSlot()
+    def start(self):
+        pass
+
+    @pyqtSlot()
+    def stop(self):
+        pass
+
+
+class FakeClient:
+    """
+    Stands in for spotipy.Spotify: nothing is playing, and every poll takes delay_s.
+    With rate_limited set, polls answer 429 after the delay instead.
+    """
+
+    def __init__(self, delay_s=0, rate_limited=False):
+        self.delay_s = delay_s
+        self.rate_limited = rate_limited
+        self.polls = 0
+
+    def current_playback(self):
+        self.polls += 1
+        time.sleep(self.delay_s)
+        if self.rate_limited:
+            raise spotipy.SpotifyException(429, -1, 'API rate limit exceeded', headers={'Retry-After': '30'})
+        return None
+
+
+def test_display_names_from_config_are_kept(tmp_path):
+    path = tmp_path / 'displays.json'
+    path.write_text(json.dumps({'displays': [{'name': 'desk', 'client_id': 'abc'}, {'screen': 1}]}))
+
+    threads, displays = main.load_display_config(str(path))
+
+    assert threads == main.poll_threads
+    assert [display['name'] for display in displays] == ['desk', 'display2']
+    assert displays[0]['client_id'] == 'abc'
+    assert displays[1]['hourly_request_budget'] == main.hourly_request_budget
+
+
+def test_worker_pool_gives_every_account_a_thread(qapp):
+    pool = main.WorkerPool(None)
+    first, second, token_manager = Member(), Member(), Member()
+    pool.add(first)
+    pool.add(second)
+    pool.add(token_manager, alongside=first)
+
+    assert pool.members[first] is not pool.members[second]
+    assert pool.members[token_manager] is pool.members[first]
+
+    thread = pool.members[first]
+    pool.remove(first)
+    assert thread.isRunning()  # Still hosts the token manager
+    pool.remove(token_manager)
+    assert not thread.isRunning()
+    assert thread not in pool.threads
+    pool.stop()
+
+
+def test_default_pool_keeps_its_threads_however_many_accounts(qapp, tmp_path):
+    pool = main.WorkerPool()
+    workers = [main.Worker(FakeClient(), library_path=str(tmp_path / f"library{n}.sqlite3")) for n in range(6)]
+    for worker in workers:
+        pool.add(worker, staggered=True)
+        pool.add(worker.library_worker)
+    try:
+        assert len(pool.threads) == main.poll_threads
+        assert set(pool.members.values()) == set(pool.threads)
+        # Spread evenly over the fixed threads
+        assert sorted(list(pool.members.values()).count(thread) for thread in pool.threads) == [6, 6]
+    finally:
+        pool.stop()
+
+
+def test_rate_limited_account_does_not_hold_up_the_others(qapp, wait_until):
+    throttled, healthy = FakeClient(delay_s=1, rate_limited=True), FakeClient()
+    workers = [main.Worker(client, hourly_budget=3600000) for client in (throttled, healthy)]
+    for worker in workers:
+        worker.scheduler.idle_interval_ms = 20
+
+    pool = main.WorkerPool(None)
+    for worker in workers:
+        pool.add(worker)
+    try:
+        # The healthy account keeps polling while the throttled one waits on its request
+        assert wait_until(lambda: healthy.polls >= 10, timeout_ms=900)
+        assert throttled.polls == 1
+        # and the throttled one then waits out Retry-After
+        assert wait_until(lambda: workers[0].scheduler.error_count == 1)
+        assert workers[0].scheduler.retry_after_ms == 30000
+    finally:
+        pool.stop()
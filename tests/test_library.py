@@ -0,0 +1,167 @@
+import main
+
+
+def track_entry(n, name, artist, album, added_at):
+    return {
+        'added_at': added_at,
+        'track': {
+            'uri': f"spotify:track:{n}",
+            'name': name,
+            'artists': [{'name': artist}],
+            'album': {'name': album, 'images': []},
+        },
+    }
+
+
+class FakeLibraryClient:
+    """
+    Saved tracks for LibrarySync, newest first like the Web API.
+    """
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.requests = []
+        self.failures = set()  # (method, offset) of requests that time out once
+
+    def __call__(self, method, limit, offset):
+        self.requests.append((method, offset))
+        if (method, offset) in self.failures:
+            self.failures.discard((method, offset))
+            raise main.requests.exceptions.ReadTimeout('timed out')
+        items = self.entries if method == 'current_user_saved_tracks' else []
+        page = items[offset:offset + limit]
+        return {'items': page, 'total': len(items), 'next': offset + limit < len(items) or None}
+
+
+def test_search_matches_word_prefixes_and_ranks_names_first(tmp_path):
+    index = main.LibraryIndex(str(tmp_path / 'library.sqlite3'))
+    index.upsert('track', [
+        main.library_row('track', track_entry(1, 'Harvest Moon', 'Neil Young', 'Harvest Moon', '2024-01-01T00:00:00Z')),
+        main.library_row('track', track_entry(2, 'Old Man', 'Neil Young', 'Harvest', '2024-01-02T00:00:00Z')),
+        main.library_row('track', track_entry(3, 'Moonage Daydream', 'David Bowie', 'Ziggy', '2024-01-03T00:00:00Z')),
+    ])
+
+    assert [row.name for row in index.search('harv')] == ['Harvest Moon', 'Old Man']
+    assert [row.name for row in index.search('neil moo')] == ['Harvest Moon']
+    assert [row.name for row in index.search('')] == ['Moonage Daydream', 'Old Man', 'Harvest Moon']
+    assert index.search('xyz') == []
+    index.close()
+
+
+def test_incremental_sync_stops_at_the_first_known_item(tmp_path):
+    index = main.LibraryIndex(str(tmp_path / 'library.sqlite3'))
+    entries = [track_entry(n, f"Track {n}", 'Artist', 'Album', f"2024-01-01T00:00:{n:02}Z") for n in range(60, 0, -1)]
+    client = FakeLibraryClient(entries)
+    sync = main.LibrarySync(index, client)
+    while not sync.step():
+        pass
+    assert index.counts() == {'track': 60}
+
+    client.entries = [track_entry(61, 'Track 61', 'Artist', 'Album', '2024-01-02T00:00:00Z')] + entries
+    client.requests = []
+    while not sync.step():
+        pass
+    # One page of tracks up to the first known one, then the (empty) albums and playlists
+    assert len(client.requests) == 3
+    assert index.counts() == {'track': 61}
+    index.close()
+
+
+def test_a_failed_page_is_retried_instead_of_starting_over(tmp_path):
+    index = main.LibraryIndex(str(tmp_path / 'library.sqlite3'))
+    entries = [track_entry(n, f"Track {n}", 'Artist', 'Album', f"2024-01-01T00:{n // 60:02}:{n % 60:02}Z")
+               for n in range(120, 0, -1)]
+    client = FakeLibraryClient(entries)
+    client.failures = {('current_user_saved_tracks', 50), ('current_user_saved_tracks', 100)}
+    sync = main.LibrarySync(index, client)
+    finished = False
+    while not finished:
+        try:
+            finished = sync.step()
+        except main.requests.exceptions.ReadTimeout:
+            pass
+
+    tracks = [offset for method, offset in client.requests if method == 'current_user_saved_tracks']
+    assert tracks == [0, 50, 50, 100, 100]
+    assert index.counts() == {'track': 120}
+    index.close()
+
+
+def test_library_pages_wait_for_a_visible_window_and_healthy_polls():
+    scheduler = main.PollScheduler(hourly_budget=100)
+    assert scheduler.allows_deferred_request(now=0)
+
+    scheduler.background = True
+    assert not scheduler.allows_deferred_request(now=0)
+    scheduler.background = False
+
+    scheduler.on_error(retry_after='5')
+    assert not scheduler.allows_deferred_request(now=0)
+    scheduler.on_success(None)
+    assert scheduler.allows_deferred_request(now=0)
+
+    # A quarter of the budget is left to polls and commands
+    for _ in range(75):
+        scheduler.record_request(now=0)
+    assert not scheduler.allows_deferred_request(now=0)
+    assert scheduler.allows_deferred_request(now=3601)
+
+
+class RateLimitedClient:
+    """
+    A spotipy.Spotify stand-in whose library pages get a 429, counting its playback polls.
+    """
+
+    def __init__(self, retry_after):
+        self.retry_after = retry_after
+        self.polls = 0
+
+    def current_user_saved_tracks(self, limit, offset):
+        raise main.spotipy.exceptions.SpotifyException(429, -1, 'Too many requests',
+                                                       headers={'Retry-After': self.retry_after})
+
+    def current_playback(self):
+        self.polls += 1
+        return None
+
+
+def test_a_rate_limited_library_page_holds_back_the_polls(qapp, tmp_path):
+    client = RateLimitedClient('30')
+    worker = main.Worker(client, library_path=str(tmp_path / 'library.sqlite3'))
+    worker.start()
+    library = worker.library_worker
+    library.start()
+
+    library.step()
+    assert worker.scheduler.error_count == 1
+    assert 29000 < worker.scheduler.retry_after_remaining_ms() <= 30000
+    assert 29000 < library.timer.remainingTime() <= 31500  # A coarse timer, within 5%
+
+    worker.fetch_track_data()
+    assert client.polls == 0  # Rescheduled for when Retry-After has passed
+    assert 29 < worker.poll_due - main.time.monotonic() <= 30
+    library.stop()
+    worker.stop()
+
+
+def test_a_retry_after_date_falls_back_to_the_backoff(qapp, tmp_path):
+    client = RateLimitedClient('Wed, 21 Oct 2015 07:28:00 GMT')
+    library = main.LibraryWorker(main.Worker(client), str(tmp_path / 'library.sqlite3'))
+    library.start()
+
+    library.step()
+    assert library.scheduler.error_count == 1
+    assert library.scheduler.retry_after_remaining_ms() == 0
+    assert library.timer.remainingTime() > 0
+    library.stop()
+
+
+def test_library_sync_waits_for_the_worker_to_log_in(qapp, tmp_path):
+    worker = main.Worker(lambda: RateLimitedClient('30'), library_path=str(tmp_path / 'library.sqlite3'))
+    library = worker.library_worker
+    library.start()
+
+    library.step()  # No client before the worker's start has logged in
+    assert library.scheduler.error_count == 0
+    assert library.timer.remainingTime() > library.retry_ms / 2
+    library.stop()
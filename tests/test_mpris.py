@@ -0,0 +1,123 @@
+import time
+
+import pytest
+from PyQt5.QtCore import QObject, pyqtSlot
+
+import benchmark
+import main
+
+
+class Recorder(QObject):
+    """
+    Collects what a worker on another thread emits, delivered on the test's thread.
+    """
+
+    def __init__(self, worker):
+        super().__init__()
+        self.states = []
+        self.errors = []
+        worker.state_signal.connect(self.add_state)
+        worker.error_signal.connect(self.add_error)
+
+    @pyqtSlot(object)
+    def add_state(self, state):
+        self.states.append(state)
+
+    @pyqtSlot(str)
+    def add_error(self, message):
+        self.errors.append(message)
+
+    def shown(self):
+        return self.states[-1].track_name if self.states else None
+
+
+@pytest.fixture
+def fake_client_bus(session_bus, qapp, request):
+    """
+    A connection of its own for the fake Spotify client, as the real client is a separate process.
+    """
+    QDBusConnection = main.QtDBus.QDBusConnection
+    connection = QDBusConnection.connectToBus(session_bus, request.node.name)
+    yield connection
+    connection.unregisterService('org.mpris.MediaPlayer2.spotify')
+    connection.unregisterObject('/org/mpris/MediaPlayer2')
+    QDBusConnection.disconnectFromBus(request.node.name)
+
+
+@pytest.fixture
+def mpris_worker(fake_api, session_bus):
+    """
+    An MprisWorker for the fake API on a thread of its own, not started yet.
+    """
+    pool = main.WorkerPool(None)
+    worker = main.MprisWorker(fake_api[1])
+    recorder = Recorder(worker)
+    yield worker, recorder, lambda: pool.add(worker)
+    pool.stop()
+
+
+def test_track_changes_arrive_without_polling(fake_api, fake_client_bus, mpris_worker, wait_until):
+    player, _ = fake_api
+    client = benchmark.publish_mpris(player, fake_client_bus)
+    worker, recorder, start = mpris_worker
+    start()
+    assert wait_until(lambda: recorder.shown() == 'Track 0')
+
+    with player.lock:
+        player.change_track(1, time.monotonic(), 'script')
+    assert wait_until(lambda: recorder.shown() == 'Track 1')
+
+    assert player.requests['GET me/player'] == 0
+    assert player.requests['GET me/player/queue'] == 2  # Only for the liked state and queue of each track
+    assert recorder.errors == []
+    del client
+
+
+def test_polls_once_the_player_quits(fake_api, fake_client_bus, mpris_worker, wait_until):
+    player, _ = fake_api
+    client = benchmark.publish_mpris(player, fake_client_bus)
+    worker, recorder, start = mpris_worker
+    start()
+    assert wait_until(lambda: recorder.shown() == 'Track 0')
+
+    with player.lock:
+        player.index = 5  # Playback goes on elsewhere, without telling the bus
+    fake_client_bus.unregisterService('org.mpris.MediaPlayer2.spotify')
+
+    assert wait_until(lambda: recorder.shown() == 'Track 5')
+    assert worker.player is None
+    assert player.requests['GET me/player'] == 1
+    del client
+
+
+def test_follows_a_player_that_starts_later(fake_api, fake_client_bus, mpris_worker, wait_until):
+    player, _ = fake_api
+    worker, recorder, start = mpris_worker
+    start()
+    assert wait_until(lambda: recorder.shown() == 'Track 0')
+    assert player.requests['GET me/player'] == 1
+
+    client = benchmark.publish_mpris(player, fake_client_bus)
+    assert wait_until(lambda: worker.player is not None)
+    with player.lock:
+        player.change_track(1, time.monotonic(), 'script')
+    assert wait_until(lambda: recorder.shown() == 'Track 1')
+    assert player.requests['GET me/player'] == 1
+    del client
+
+
+def test_dbus_trouble_is_a_notice_not_a_lost_connection(fake_api, session_bus, qapp, request):
+    QDBusConnection = main.QtDBus.QDBusConnection
+    worker = main.MprisWorker(fake_api[1])
+    worker.bus = QDBusConnection.connectToBus(session_bus, request.node.name)
+    worker.player = 'org.mpris.MediaPlayer2.spotify.gone'
+    worker.properties = {'PlaybackStatus': 'Playing'}
+    errors, notices = [], []
+    worker.error_signal.connect(errors.append)
+    worker.notice_signal.connect(notices.append)
+    try:
+        assert worker.read_properties() == {'PlaybackStatus': 'Playing'}  # The last known ones stay shown
+        assert errors == []
+        assert len(notices) == 1
+    finally:
+        QDBusConnection.disconnectFromBus(request.node.name)
@@ -0,0 +1,28 @@
+from PyQt5.QtGui import QColor, QImage, QPainter
+
+import main
+
+
+def art(background, accent):
+    """
+    Album art that is three quarters background and one quarter accent.
+    """
+    image = QImage(200, 200, QImage.Format_RGB32)
+    image.fill(QColor(background))
+    painter = QPainter(image)
+    painter.fillRect(0, 150, 200, 50, QColor(accent))
+    painter.end()
+    return image
+
+
+def test_most_common_color_becomes_the_background():
+    palette = main.extract_palette(art('#1E3A8A', '#F59E0B'))
+    assert palette['top'] == QColor('#1E3A8A').lighter(60).name()
+    assert palette['accent'] == '#f59e0b'
+
+
+def test_text_stays_readable_on_light_and_dark_art():
+    for background in ('#F8FAFC', '#0F172A', '#808080'):
+        palette = main.extract_palette(art(background, '#DC2626'))
+        assert main.contrast_ratio(QColor(palette['text']), QColor(palette['top'])) >= 4.5
+        assert main.contrast_ratio(QColor(palette['secondary']), QColor(palette['top'])) >= 3.0
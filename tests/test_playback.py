@@ -0,0 +1,34 @@
+import time
+
+import main
+
+
+def test_clock_extrapolates_while_playing():
+    clock = main.PlaybackClock()
+    now = time.monotonic()
+    clock.sync(10000, 200000, True, sampled_at=now - 2)
+    assert 11990 <= clock.position_ms(now) <= 12010
+    assert clock.position_ms(now + 1000) == clock.duration_ms  # Never past the end
+
+    clock.sync(50000, 200000, False, sampled_at=now)
+    assert clock.position_ms(now + 10) == 50000
+
+
+def test_clock_ignores_snapshots_within_tolerance():
+    clock = main.PlaybackClock(tolerance_ms=300)
+    now = time.monotonic()
+    clock.sync(10000, 200000, True, sampled_at=now)
+    anchor = clock.anchor
+    clock.sync(10100, 200000, True, sampled_at=now)  # Polling noise
+    assert clock.anchor == anchor
+    clock.sync(90000, 200000, True, sampled_at=now)  # A seek
+    assert clock.progress_ms == 90000
+
+
+def test_clock_stops_where_it_was_paused():
+    clock = main.PlaybackClock()
+    clock.sync(10000, 200000, True, sampled_at=time.monotonic() - 1)
+    clock.set_playing(False)
+    paused_at = clock.position_ms()
+    assert 10990 <= paused_at <= 11100
+    assert clock.position_ms(time.monotonic() + 5) == paused_at
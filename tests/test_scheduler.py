@@ -0,0 +1,63 @@
+import time
+
+import main
+
+
+def playing(progress_ms, duration_ms=200000):
+    return {'item': {'duration_ms': duration_ms}, 'progress_ms': progress_ms, 'is_playing': True}
+
+
+def test_polls_just_after_the_track_ends():
+    scheduler = main.PollScheduler(hourly_budget=3600000)
+    assert scheduler.on_success(playing(0)) == scheduler.playing_interval_ms
+    assert scheduler.on_success(playing(199000)) == 1000 + scheduler.track_end_margin_ms
+    assert scheduler.on_success(dict(playing(0), is_playing=False)) == scheduler.paused_interval_ms
+    assert scheduler.on_success(None) == scheduler.idle_interval_ms
+
+
+def test_errors_back_off_exponentially_until_a_success():
+    scheduler = main.PollScheduler(hourly_budget=3600000)
+    assert [scheduler.on_error() for _ in range(3)] == [2000, 4000, 8000]
+    for _ in range(10):
+        delay = scheduler.on_error()
+    assert delay == scheduler.max_backoff_ms
+    scheduler.on_success(playing(0))
+    assert scheduler.on_error() == 2000
+
+
+def test_retry_after_wins_over_a_shorter_backoff():
+    scheduler = main.PollScheduler(hourly_budget=3600000)
+    assert scheduler.on_error(retry_after='30') == 30000
+    assert scheduler.budget()['retry_after_ms'] == 30000
+    assert scheduler.on_error(retry_after='not a number') == 4000
+
+
+def test_budget_and_background_bound_the_interval():
+    scheduler = main.PollScheduler(hourly_budget=600)
+    assert scheduler.on_success(playing(199900)) == 6000
+    scheduler.background = True
+    assert scheduler.on_success(playing(0)) == scheduler.background_interval_ms
+
+    for _ in range(3):
+        scheduler.record_request(now=0)
+    assert scheduler.budget(now=1)['remaining'] == 597
+    assert scheduler.budget(now=3601)['remaining'] == 600
+
+
+def test_worker_waits_out_a_429_without_blocking(fake_api, wait_until):
+    player, sp = fake_api
+    player.faults.append(('rate_limit', time.monotonic() + 30, None))
+    worker = main.Worker(sp)
+    errors = []
+    worker.error_signal.connect(errors.append)
+    worker.start()
+
+    started = time.monotonic()
+    worker.fetch_track_data()
+    # The 429 comes straight back instead of urllib3 sleeping through Retry-After
+    assert time.monotonic() - started < 2
+    assert player.statuses['429'] == 1
+    assert worker.scheduler.error_count == 1
+    assert 29 < worker.poll_due - time.monotonic() <= 30
+    assert errors == []  # Rate limiting is not shown as a connection problem
+    worker.stop()
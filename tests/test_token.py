@@ -0,0 +1,28 @@
+import main
+
+
+class FakeAuthManager:
+    """
+    A SpotifyOAuth stand-in over a token store, counting its refreshes.
+    """
+
+    def __init__(self, store):
+        self.cache_handler = store
+        self.refreshes = []
+
+    def refresh_access_token(self, refresh_token):
+        self.refreshes.append(refresh_token)
+
+
+def test_refresh_without_a_stored_token_reports_not_logged_in(qapp, tmp_path):
+    auth_manager = FakeAuthManager(main.create_token_store(str(tmp_path / 'token.json')))
+    manager = main.TokenManager(auth_manager)
+    failures = []
+    manager.refresh_failed_signal.connect(failures.append)
+    manager.start()
+
+    manager.refresh()
+    assert failures == ['not logged in']
+    assert auth_manager.refreshes == []
+    assert manager.timer.remainingTime() > 0  # Tried again after retry_s
+    manager.stop()
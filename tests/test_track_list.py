@@ -0,0 +1,60 @@
+from PyQt5.QtCore import QObject, pyqtSignal
+
+import main
+
+
+class FakeThumbnails(QObject):
+    art_ready_signal = pyqtSignal(str, object)
+
+    def request(self, url):
+        return None
+
+
+def played(n):
+    return {'name': f"Track {n}", 'artists': [{'name': 'Artist'}], 'album': {'images': []}, 'uri': f"spotify:track:{n}",
+            'played_at': f"2024-01-01T00:00:{n:02}Z"}
+
+
+def model_with_requests():
+    model = main.TrackListModel(FakeThumbnails())
+    requests = []
+    model.fetch_requested_signal.connect(requests.append)
+    return model, requests
+
+
+def test_failed_page_is_retried_with_backoff(qapp):
+    model, requests = model_with_requests()
+    model.add_page([played(n) for n in range(50, 40, -1)], None, 'older')
+    model.fetchMore()
+    assert requests == ['older']
+
+    model.fetch_failed()
+    assert model.cursor == 'older'
+    assert not model.canFetchMore()  # Until the retry
+    assert model.retry_timer.interval() == model.retry_ms
+    model.retry_timer.stop()
+    model.retry()
+    model.fetch_failed()
+    assert model.retry_timer.interval() == 2 * model.retry_ms
+
+    model.retry_timer.stop()
+    model.retry()
+    assert requests == ['older'] * 3
+    model.add_page([played(n) for n in range(40, 30, -1)], 'older', None)
+    assert model.rowCount() == 20
+    assert model.failures == 0
+    assert not model.canFetchMore()  # That was the last page
+
+
+def test_scrolling_retries_once_the_backoff_gives_up(qapp):
+    model, requests = model_with_requests()
+    model.add_page([played(1)], None, 'older')
+    for _ in range(model.max_retries):
+        model.fetchMore()
+        model.fetch_failed()
+        assert model.retry_timer.isActive()
+    model.fetchMore()
+    model.fetch_failed()
+    assert not model.retry_timer.isActive()
+    assert model.canFetchMore()
+    assert model.cursor == 'older'
@@ -0,0 +1,101 @@
+import time
+
+import requests
+
+import main
+
+
+def playback(track_id):
+    return {
+        'item': {'id': track_id, 'name': f"Track {track_id}", 'is_local': False, 'duration_ms': 200000,
+                 'artists': [{'name': 'Artist'}],
+                 'album': {'name': 'Album', 'images': []}},
+        'progress_ms': 1000,
+        'is_playing': True,
+        'shuffle_state': False,
+    }
+
+
+def test_liked_cache_only_asks_for_unknown_tracks_once():
+    cache = main.LikedCache()
+    assert cache.missing(['a', 'b', 'a', None]) == ['a', 'b']
+    cache.update(['a', 'b'], [True, 0])
+    assert (cache.get('a'), cache.get('b'), cache.get('c')) == (True, False, None)
+    assert cache.missing(['a', 'c']) == ['c']
+    assert len(cache.missing([str(n) for n in range(120)])) == cache.batch_size
+
+
+class FlakyClient:
+    """
+    A spotipy.Spotify stand-in whose queue and liked-track lookups fail with error while failures is positive.
+    """
+
+    def __init__(self, failures=0, error=None):
+        self.failures = failures
+        self.error = error or requests.exceptions.ReadTimeout('timed out')
+        self.queue_calls = 0
+        self.contains_calls = 0
+
+    def current_playback(self):
+        return playback('a')
+
+    def queue(self):
+        self.queue_calls += 1
+        raise self.error
+
+    def current_user_saved_tracks_contains(self, track_ids):
+        self.contains_calls += 1
+        if self.failures:
+            self.failures -= 1
+            raise self.error
+        return [True for _ in track_ids]
+
+
+def polled_worker(client):
+    worker = main.Worker(client)
+    worker.start()
+    signals = {'states': [], 'errors': []}
+    worker.state_signal.connect(signals['states'].append)
+    worker.error_signal.connect(signals['errors'].append)
+    return worker, signals
+
+
+def test_failed_liked_lookup_keeps_the_poll_and_is_retried_with_backoff(qapp):
+    client = FlakyClient(failures=2)
+    worker, signals = polled_worker(client)
+
+    worker.fetch_track_data()
+    assert signals['errors'] == []
+    assert signals['states'][-1].track_name == 'Track a'
+    assert signals['states'][-1].is_liked is False
+
+    worker.fetch_track_data()
+    assert client.contains_calls == 1  # Still backing off
+
+    worker.liked_retry_at = 0  # The backoff has passed
+    worker.fetch_track_data()
+    assert client.contains_calls == 2
+    assert 9 < worker.liked_retry_at - time.monotonic() <= 10  # Failed again, so it doubled
+
+    worker.liked_retry_at = 0
+    worker.fetch_track_data()
+    assert client.contains_calls == 3
+    assert signals['states'][-1].is_liked is True
+
+    worker.fetch_track_data()
+    assert client.contains_calls == 3  # Known now, so not looked up again
+    assert client.queue_calls == 1  # Only the liked lookup is retried
+    worker.stop()
+
+
+def test_rate_limited_lookups_back_off_the_polls(qapp):
+    error = main.spotipy.exceptions.SpotifyException(429, -1, 'Too many requests', headers={'Retry-After': '20'})
+    client = FlakyClient(failures=1, error=error)
+    worker, signals = polled_worker(client)
+
+    worker.fetch_track_data()
+    assert signals['states'][-1].track_name == 'Track a'  # The poll itself went through
+    assert signals['errors'] == []
+    assert worker.scheduler.error_count == 1
+    assert 19 < worker.poll_due - time.monotonic() <= 20
+    worker.stop()